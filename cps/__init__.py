@@ -96,7 +96,7 @@ if wtf_present:
 else:
     csrf = None
 
-calibre_db = db.CalibreDB()
+calibre_db = db.CalibreDB(scoped=True)
 
 web_server = WebServer()
 
@@ -217,10 +217,17 @@ def create_app():
     def _cwa_ensure_db_session():
         try:
             calibre_db.ensure_session()
+            # Pick up books added by the ingest service or calibredb since the last request
+            calibre_db.invalidate_if_changed()
         except Exception:
             # Failsafe: let route-level code handle specific DB errors
             pass
-    
+
+    # Every request has a calibre_db session of its own, hand its connection back to the pool
+    @app.teardown_request
+    def _cwa_remove_db_session(exc):
+        calibre_db.remove_session()
+
     # Load user from reverse proxy header early in request lifecycle
     # This ensures current_user resolves correctly before any code accesses user settings
     @app.before_request
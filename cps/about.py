@@ -14,7 +14,7 @@ from collections import OrderedDict
 import flask
 from flask_babel import gettext as _
 
-from . import db, calibre_db, converter, uploader, constants, dep_check
+from . import db, calibre_db, converter, uploader, constants, dep_check, imaging
 from .render_template import render_title_template
 from .usermanagement import user_login_required
 
@@ -62,6 +62,7 @@ def collect_stats():
     _VERSIONS['Ebook converter'] = converter.get_calibre_version()
     _VERSIONS['Kepubify'] = converter.get_kepubify_version()
     _VERSIONS.update(uploader.get_magick_version())
+    _VERSIONS.update(imaging.get_version())
     _VERSIONS.update(sorted_modules)
     return _VERSIONS
 
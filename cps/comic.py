@@ -10,12 +10,6 @@ import os
 from . import logger, isoLanguages, cover
 from .constants import BookMeta
 
-try:
-    from wand.image import Image
-    use_IM = True
-except (ImportError, RuntimeError) as e:
-    use_IM = False
-
 log = logger.create()
 
 try:
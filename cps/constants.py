@@ -34,6 +34,10 @@ CACHE_DIR           = os.environ.get('CACHE_DIR', DEFAULT_CACHE_DIR)
 
 OAUTH_SSL_STRICT = os.environ.get('OAUTH_SSL_STRICT', "1").lower() in ("true", "1")
 
+# Image library for cover thumbnails and cover conversion: 'auto' (first available of pyvips, Pillow and
+# ImageMagick), 'vips', 'pillow' or 'magick'
+IMAGE_BACKEND = os.environ.get('CWA_IMAGE_BACKEND', 'auto').lower()
+
 if HOME_CONFIG:
     home_dir = os.path.join(os.path.expanduser("~"), ".calibre-web-automated")
     if not os.path.exists(home_dir):
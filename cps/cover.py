@@ -7,11 +7,7 @@
 
 import os
 
-try:
-    from wand.image import Image
-    use_IM = True
-except (ImportError, RuntimeError) as e:
-    use_IM = False
+from . import imaging
 
 
 NO_JPEG_EXTENSIONS = ['.png', '.webp', '.bmp']
@@ -21,11 +17,9 @@ COVER_EXTENSIONS = ['.png', '.webp', '.bmp', '.jpg', '.jpeg']
 def cover_processing(tmp_file_name, img, extension):
     tmp_cover_name = os.path.join(os.path.dirname(tmp_file_name), 'cover.jpg')
     if extension in NO_JPEG_EXTENSIONS:
-        if use_IM:
-            with Image(blob=img) as imgc:
-                imgc.format = 'jpeg'
-                imgc.transform_colorspace('srgb')
-                imgc.save(filename=tmp_cover_name)
+        if imaging.backend:
+            with imaging.backend.open(blob=img) as imgc:
+                imgc.save(tmp_cover_name, 'jpg', 92)
                 return tmp_cover_name
         else:
             return None
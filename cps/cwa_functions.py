@@ -12,6 +12,7 @@ from .usermanagement import login_required_if_no_ano, user_login_required
 from .admin import admin_required
 from .render_template import render_title_template
 from .cw_login import login_user, logout_user, current_user
+from .services.worker import WorkerThread, get_lane_threads
 
 import subprocess
 import sqlite3
@@ -177,29 +178,42 @@ def get_ingest_dir():
         return dirs['ingest_folder']
 
 def get_ingest_status():
-    """Read the current ingest service status"""
+    """Current ingest service status, read from the ingest queue in cwa.db (see scripts/ingest_daemon.py).
+    state is one of processing, queued, completed, error, idle or unknown"""
+    status = {'state': 'unknown', 'filename': '', 'timestamp': '', 'detail': '',
+              'queued': 0, 'retrying': 0, 'failed': 0, 'done_last_hour': 0, 'oldest_waiting': ''}
     try:
-        with open('/config/cwa_ingest_status', 'r') as f:
-            status_line = f.read().strip()
-            if ':' in status_line:
-                parts = status_line.split(':')
-                return {
-                    'state': parts[0],
-                    'filename': parts[1] if len(parts) > 1 else '',
-                    'timestamp': parts[2] if len(parts) > 2 else '',
-                    'detail': parts[3] if len(parts) > 3 else ''
-                }
-            else:
-                return {'state': status_line, 'filename': '', 'timestamp': '', 'detail': ''}
-    except (FileNotFoundError, IOError):
-        return {'state': 'unknown', 'filename': '', 'timestamp': '', 'detail': ''}
+        queue_status = CWA_DB().ingest_queue_status()
+    except Exception:
+        return status
+
+    status |= {'queued': queue_status['queued'],
+               'retrying': queue_status['retry'],
+               'failed': queue_status['failed'],
+               'done_last_hour': queue_status['done_last_hour'],
+               'oldest_waiting': queue_status['oldest_waiting']}
+    if queue_status['current']:
+        status |= {'state': 'processing',
+                   'filename': os.path.basename(queue_status['current']['path']),
+                   'timestamp': queue_status['current']['started_at'],
+                   'detail': str(queue_status['processing'])}
+    elif queue_status['queued'] or queue_status['retry']:
+        status['state'] = 'queued'
+    elif queue_status['last']:
+        last = queue_status['last']
+        status |= {'state': 'completed' if last['state'] == 'done' else 'error',
+                   'filename': os.path.basename(last['path']),
+                   'timestamp': last['finished_at'],
+                   'detail': last['error']}
+    else:
+        status['state'] = 'idle'
+    return status
 
 def get_ingest_queue_size():
-    """Get the number of files in the retry queue"""
+    """Number of files waiting in the ingest queue, including those waiting to be retried"""
     try:
-        with open('/config/cwa_ingest_retry_queue', 'r') as f:
-            return len([line for line in f if line.strip()])
-    except (FileNotFoundError, IOError):
+        return CWA_DB().ingest_queue_size()
+    except Exception:
         return 0
 
 def refresh_library(app):
@@ -283,7 +297,7 @@ def set_cwa_settings():
     boolean_settings = []
     string_settings = []
     list_settings = []
-    integer_settings = ['ingest_timeout_minutes', 'auto_send_delay_minutes']  # Special handling for integer settings
+    integer_settings = ['ingest_timeout_minutes', 'auto_send_delay_minutes', 'ingest_workers', 'ingest_batch_size', 'ingest_batch_window_seconds', 'conversion_cache_size_mb', 'worker_cpu_threads', 'worker_io_threads', 'worker_network_threads']  # Special handling for integer settings
     json_settings = ['metadata_provider_hierarchy', 'metadata_providers_enabled']  # Special handling for JSON settings
     
     for setting in cwa_default_settings:
@@ -360,6 +374,16 @@ def set_cwa_settings():
                             int_value = max(5, min(120, int_value))  # Clamp between 5 and 120 minutes
                         elif setting == 'auto_send_delay_minutes':
                             int_value = max(1, min(60, int_value))  # Clamp between 1 and 60 minutes
+                        elif setting == 'ingest_workers':
+                            int_value = max(0, min(16, int_value))  # Clamp between 0 (auto) and 16 workers
+                        elif setting == 'ingest_batch_size':
+                            int_value = max(1, min(100, int_value))  # Clamp between 1 (no batching) and 100 files
+                        elif setting == 'ingest_batch_window_seconds':
+                            int_value = max(1, min(60, int_value))  # Clamp between 1 and 60 seconds
+                        elif setting == 'conversion_cache_size_mb':
+                            int_value = max(0, min(102400, int_value))  # Clamp between 0 (disabled) and 100 GB
+                        elif setting in ('worker_cpu_threads', 'worker_io_threads', 'worker_network_threads'):
+                            int_value = max(1, min(8, int_value))  # Clamp between 1 and 8 threads per lane
                         result[setting] = int_value
                     except (ValueError, TypeError):
                         # Use current value if conversion fails
@@ -367,11 +391,31 @@ def set_cwa_settings():
                             result[setting] = cwa_db.cwa_settings.get(setting, 15)  # Default to 15 minutes
                         elif setting == 'auto_send_delay_minutes':
                             result[setting] = cwa_db.cwa_settings.get(setting, 5)  # Default to 5 minutes
+                        elif setting == 'ingest_workers':
+                            result[setting] = cwa_db.cwa_settings.get(setting, 0)  # Default to auto
+                        elif setting == 'ingest_batch_size':
+                            result[setting] = cwa_db.cwa_settings.get(setting, 1)  # Default to no batching
+                        elif setting == 'ingest_batch_window_seconds':
+                            result[setting] = cwa_db.cwa_settings.get(setting, 5)  # Default to 5 seconds
+                        elif setting == 'conversion_cache_size_mb':
+                            result[setting] = cwa_db.cwa_settings.get(setting, 2048)  # Default to 2 GB
+                        elif setting in ('worker_cpu_threads', 'worker_io_threads', 'worker_network_threads'):
+                            result[setting] = cwa_db.cwa_settings.get(setting, 2)  # Default to 2 threads
                 else:
                     if setting == 'ingest_timeout_minutes':
                         result[setting] = cwa_db.cwa_settings.get(setting, 15)  # Default to 15 minutes
                     elif setting == 'auto_send_delay_minutes':
                         result[setting] = cwa_db.cwa_settings.get(setting, 5)  # Default to 5 minutes
+                    elif setting == 'ingest_workers':
+                        result[setting] = cwa_db.cwa_settings.get(setting, 0)  # Default to auto
+                    elif setting == 'ingest_batch_size':
+                        result[setting] = cwa_db.cwa_settings.get(setting, 1)  # Default to no batching
+                    elif setting == 'ingest_batch_window_seconds':
+                        result[setting] = cwa_db.cwa_settings.get(setting, 5)  # Default to 5 seconds
+                    elif setting == 'conversion_cache_size_mb':
+                        result[setting] = cwa_db.cwa_settings.get(setting, 2048)  # Default to 2 GB
+                    elif setting in ('worker_cpu_threads', 'worker_io_threads', 'worker_network_threads'):
+                        result[setting] = cwa_db.cwa_settings.get(setting, 2)  # Default to 2 threads
 
             # Handle JSON settings
             for setting in json_settings:
@@ -434,6 +478,9 @@ def set_cwa_settings():
             cwa_db.set_default_settings(force=True)
             cwa_settings = cwa_db.get_cwa_settings()
 
+        # Apply changed worker lane sizes without a restart
+        WorkerThread.get_instance().resize_lanes(get_lane_threads())
+
     elif request.method == 'GET':
         cwa_db = CWA_DB()
         cwa_settings = cwa_db.get_cwa_settings()
@@ -453,6 +500,12 @@ def get_cwa_stats() -> dict[str,int]:
     cwa_db = CWA_DB()
     totals = cwa_db.get_stat_totals()
     totals["total_books"] = cwa_get_num_books_in_library() # from web.py
+    ingest_status = cwa_db.ingest_queue_status()
+    totals["ingest_backlog"] = ingest_status["queued"] + ingest_status["retry"]
+    totals["ingest_last_hour"] = ingest_status["done_last_hour"]
+    cache_stats = cwa_db.get_conversion_cache_stats()
+    totals["conversion_cache_hits"] = cache_stats["hits"]
+    totals["conversion_cache_misses"] = cache_stats["misses"]
 
     return totals
 
@@ -474,8 +527,31 @@ headers = {
         _("Timestamp"), _("Filename"), _("Original Backed Up?")],
     "conversions":[
         _("Timestamp"), _("Filename"), _("Original Format"), _("End Format"), _("Original Backed Up?")],
+    "ingest_timings":[
+        _("Stage"), _("Files"), _("p50"), _("p95")],
 }
 
+# Ingest stages recorded by NewBookProcessor, in the order a file goes through them
+ingest_stage_labels = {
+    "readiness_wait": _("Waiting for File"),
+    "hash": _("Content Hash"),
+    "convert": _("Conversion"),
+    "epub_fixer": _("EPUB Fixer"),
+    "calibredb": _("calibredb"),
+    "metadata_fetch": _("Metadata Fetch"),
+    "auto_send": _("Auto-Send"),
+    "gdrive_sync": _("GDrive Sync"),
+    "permissions": _("Permissions"),
+    "total": _("Total"),
+}
+
+def get_ingest_timing_rows(summary:dict) -> list[list[str]]:
+    """Rows of the ingest performance table, known stages first"""
+    stages = summary["stages"]
+    order = [stage for stage in ingest_stage_labels if stage in stages] + sorted(set(stages) - set(ingest_stage_labels))
+    return [[ingest_stage_labels.get(stage, stage), stages[stage]["count"], f"{stages[stage]['p50']:.2f}s", f"{stages[stage]['p95']:.2f}s"]
+            for stage in order]
+
 @cwa_stats.route("/cwa-stats-show", methods=["GET", "POST"])
 @login_required_if_no_ano
 @admin_required
@@ -487,9 +563,11 @@ def cwa_stats_show():
     data_conversions = cwa_db.get_conversion_history(verbose=False)
     data_epub_fixer = cwa_db.get_epub_fixer_history(fixes=False, verbose=False)
     data_epub_fixer_with_fixes = cwa_db.get_epub_fixer_history(fixes=True, verbose=False)
+    ingest_timings = cwa_db.get_ingest_timing_summary()
 
     return render_title_template("cwa_stats.html", title=_("Calibre-Web Automated Sever Stats & Archive"), page="cwa-stats",
                                 cwa_stats=get_cwa_stats(),
+                                ingest_timings=ingest_timings, data_ingest_timings=get_ingest_timing_rows(ingest_timings), headers_ingest_timings=headers["ingest_timings"],
                                 data_enforcement=data_enforcement, headers_enforcement=headers["enforcement"]["no_paths"], 
                                 data_enforcement_with_paths=data_enforcement_with_paths,headers_enforcement_with_paths=headers["enforcement"]["with_paths"], 
                                 data_imports=data_imports, headers_import=headers["imports"],
@@ -8,6 +8,8 @@
 import os
 import re
 import json
+import sqlite3
+import threading
 from datetime import datetime, timezone
 from urllib.parse import quote
 import unidecode
@@ -15,7 +17,7 @@ from weakref import WeakSet
 from uuid import uuid4
 
 from sqlite3 import OperationalError as sqliteOperationalError
-from sqlalchemy import create_engine
+from sqlalchemy import create_engine, event
 from sqlalchemy import Table, Column, ForeignKey, CheckConstraint
 from sqlalchemy import String, Integer, Boolean, TIMESTAMP, Float
 from sqlalchemy.orm import relationship, sessionmaker, scoped_session
@@ -27,7 +29,7 @@ try:
     from sqlalchemy.orm import declarative_base
 except ImportError:
     from sqlalchemy.ext.declarative import declarative_base
-from sqlalchemy.pool import StaticPool
+from sqlalchemy.pool import QueuePool, StaticPool
 from sqlalchemy.sql.expression import and_, true, false, text, func, or_
 from sqlalchemy.ext.associationproxy import association_proxy
 from .cw_login import current_user
@@ -41,6 +43,16 @@ from .string_helper import strip_whitespaces
 
 log = logger.create()
 
+try:
+    # Sessions of the web instance are per greenlet under gevent, a plain thread has a greenlet of its own too
+    from greenlet import getcurrent as _session_scope
+except ImportError:
+    _session_scope = threading.get_ident
+
+# Connections kept open to metadata.db, more are opened (and closed again) when more threads and greenlets need one
+# at the same time. Checking out a connection never waits, a greenlet waiting for one would block its whole thread
+CONNECTION_POOL_SIZE = 10
+
 cc_exceptions = ['composite', 'series']
 cc_classes = {}
 
@@ -523,11 +535,22 @@ class CalibreDB:
     # This is a WeakSet so that references here don't keep other CalibreDB
     # instances alive once they reach the end of their respective scopes
     instances = WeakSet()
-
-    def __init__(self, expire_on_commit=True, init=False):
-        """ Initialize a new CalibreDB session
+    app_db_path = None
+    # Separate connection to metadata.db used only to notice writes made by other connections
+    # (ingest, calibredb), see invalidate_if_changed()
+    change_monitor = None
+    change_lock = threading.Lock()
+    data_version = None
+    custom_columns_signature = None
+    # Bumped whenever the monitor notices a write, every session remembers the count it was last checked at
+    change_count = 0
+
+    def __init__(self, expire_on_commit=True, init=False, scoped=False):
+        """ Initialize a new CalibreDB session. With scoped every thread and greenlet using the instance gets a
+        session (and a pooled connection) of its own, remove_session() closes the one of the caller again
         """
         self.session = None
+        self.scoped = scoped
         if init:
             self.init_db(expire_on_commit)
 
@@ -538,9 +561,39 @@ class CalibreDB:
         self.instances.add(self)
 
     def init_session(self, expire_on_commit=True):
-        self.session = self.session_factory()
-        self.session.expire_on_commit = expire_on_commit
-        self.create_functions(self.config)
+        if self.scoped:
+            self.session = scoped_session(self.create_sessionmaker(expire_on_commit=expire_on_commit),
+                                         scopefunc=_session_scope)
+        else:
+            self.session = self.session_factory()
+            self.session.expire_on_commit = expire_on_commit
+
+    def remove_session(self):
+        """Closes the session of the calling thread or greenlet and returns its connection to the pool"""
+        if self.scoped and self.session is not None:
+            self.session.remove()
+
+    @classmethod
+    def create_sessionmaker(cls, **kwargs):
+        return sessionmaker(autocommit=False, autoflush=True, bind=cls.engine, future=True, **kwargs)
+
+    @classmethod
+    def connect_hook(cls, dbpath, app_db_path):
+        """Prepares every new pooled connection: attaches metadata.db and app.db and adds the SQL functions"""
+        def on_connect(dbapi_connection, connection_record):
+            dbapi_connection.execute("attach database ? as calibre", (dbpath,))
+            dbapi_connection.execute("attach database ? as app_settings", (app_db_path,))
+            # Try enabling WAL to improve concurrency unless running on a network share
+            # Controlled by env var NETWORK_SHARE_MODE (default False)
+            try:
+                nsm = os.getenv('NETWORK_SHARE_MODE', 'False').lower() in ('1', 'true', 'yes', 'on')
+                if not nsm:
+                    dbapi_connection.execute("PRAGMA calibre.journal_mode=WAL")
+                    dbapi_connection.execute("PRAGMA app_settings.journal_mode=WAL")
+            except sqlite3.Error:
+                pass
+            add_functions(dbapi_connection, lambda: cls.config)
+        return on_connect
 
     def ensure_session(self, expire_on_commit=True):
         """Ensure a valid SQLAlchemy session exists.
@@ -688,24 +741,17 @@ class CalibreDB:
             return None
 
         try:
+            # Every thread and greenlet gets a connection of its own, WAL lets them read while another one writes.
+            # Writes of different connections (including query.delete() and execute()) wait for each other in
+            # sqlite's busy handler, up to the timeout
             cls.engine = create_engine('sqlite://',
                                        echo=False,
                                        isolation_level="SERIALIZABLE",
                                        connect_args={'check_same_thread': False, 'timeout': 30},
-                                       poolclass=StaticPool)
-            with cls.engine.begin() as connection:
-                connection.execute(text("attach database '{}' as calibre;".format(dbpath)))
-                connection.execute(text("attach database '{}' as app_settings;".format(app_db_path)))
-                # Try enabling WAL to improve concurrency unless running on a network share
-                # Controlled by env var NETWORK_SHARE_MODE (default False)
-                try:
-                    nsm = os.getenv('NETWORK_SHARE_MODE', 'False').lower() in ('1', 'true', 'yes', 'on')
-                    if not nsm:
-                        connection.execute(text("PRAGMA calibre.journal_mode=WAL"))
-                        connection.execute(text("PRAGMA app_settings.journal_mode=WAL"))
-                except Exception:
-                    pass
-
+                                       poolclass=QueuePool,
+                                       pool_size=CONNECTION_POOL_SIZE,
+                                       max_overflow=-1)
+            event.listen(cls.engine, 'connect', cls.connect_hook(dbpath, app_db_path))
             conn = cls.engine.connect()
             # conn.text_factory = lambda b: b.decode(errors = 'ignore') possible fix for #1302
         except Exception as ex:
@@ -714,22 +760,100 @@ class CalibreDB:
 
         cls.config.db_configured = True
 
-        if not cc_classes:
-            try:
-                cc = conn.execute(text("SELECT id, datatype FROM custom_columns"))
-                cls.setup_db_cc_classes(cc)
-            except OperationalError as e:
-                log.error_or_exception(e)
-                return None
-
-        cls.session_factory = scoped_session(sessionmaker(autocommit=False,
-                                                          autoflush=True,
-                                                          bind=cls.engine, future=True))
+        with conn:
+            if not cc_classes:
+                try:
+                    cc = conn.execute(text("SELECT id, datatype FROM custom_columns"))
+                    cls.setup_db_cc_classes(cc)
+                except OperationalError as e:
+                    log.error_or_exception(e)
+                    return None
+
+        cls.session_factory = scoped_session(cls.create_sessionmaker())
         for inst in cls.instances:
             inst.init_session()
 
+        cls.app_db_path = app_db_path
+        cls.open_change_monitor(dbpath)
         cls._init = True
 
+    @classmethod
+    def open_change_monitor(cls, dbpath):
+        with cls.change_lock:
+            cls.close_change_monitor()
+            try:
+                cls.change_monitor = sqlite3.connect(dbpath, timeout=30, check_same_thread=False)
+                cls.data_version = cls.change_monitor.execute("PRAGMA data_version").fetchone()[0]
+                cls.custom_columns_signature = cls._custom_columns_signature()
+            except sqlite3.Error as ex:
+                log.warning("Could not watch %s for changes made by other processes: %s", dbpath, ex)
+                cls.close_change_monitor()
+
+    @classmethod
+    def close_change_monitor(cls):
+        if cls.change_monitor is not None:
+            try:
+                cls.change_monitor.close()
+            except sqlite3.Error:
+                pass
+        cls.change_monitor = None
+        cls.data_version = None
+
+    @classmethod
+    def _custom_columns_signature(cls):
+        return cls.change_monitor.execute("SELECT group_concat(id || ':' || datatype) FROM custom_columns").fetchone()[0]
+
+    @classmethod
+    def check_for_changes(cls):
+        """Notices writes to metadata.db made through any other connection, e.g. ingest adding books through
+        calibredb. PRAGMA data_version on the monitor connection changes whenever some other connection
+        commits, which includes the pooled connections of this process, so checking it costs next to nothing
+        and can run on every request. Only a change to the custom columns needs the engine rebuilt, for
+        everything else change_count is bumped. Returns True if anything changed"""
+        with cls.change_lock:
+            if cls.change_monitor is None:
+                return False
+            try:
+                version = cls.change_monitor.execute("PRAGMA data_version").fetchone()[0]
+                if version == cls.data_version:
+                    return False
+                cls.data_version = version
+                signature = cls._custom_columns_signature()
+            except sqlite3.Error as ex:
+                log.debug("Could not check metadata.db for changes: %s", ex)
+                return False
+            rebuild = signature != cls.custom_columns_signature
+            cls.custom_columns_signature = signature
+            cls.change_count += 1
+
+        if rebuild:
+            log.info("Custom columns changed outside Calibre-Web, reconnecting to the Calibre database")
+            cls.setup_db(cls.config.config_calibre_dir, cls.app_db_path)
+        return True
+
+    def invalidate_if_changed(self):
+        """Expires what the session of the caller holds in memory if metadata.db has been written to since the
+        session was last checked, so the loaded objects are read again. Only ever touches the session of the
+        calling thread or greenlet, sessions of background tasks are left to their own thread.
+        Returns True if the session was expired"""
+        self.check_for_changes()
+        session = self.session
+        if session is None:
+            return False
+        try:
+            seen = session.info.get('change_count')
+            if seen == self.change_count:
+                return False
+            session.info['change_count'] = self.change_count
+            # A session that hasn't loaded anything yet has nothing to expire
+            if seen is None and not len(session.identity_map):
+                return False
+            session.expire_all()
+        except Exception as ex:
+            log.debug("Could not expire session: %s", ex)
+            return False
+        return True
+
     def get_book(self, book_id):
         self.ensure_session()
         return self.session.query(Books).filter(Books.id == book_id).first()
@@ -1086,34 +1210,22 @@ class CalibreDB:
             return sorted(languages, key=lambda x: x.name, reverse=reverse_order)
 
     def create_functions(self, config=None):
+        """Adds the SQL functions to the connection of the session again. Every pooled connection gets them when
+        it's opened already, see connect_hook()"""
         self.ensure_session()
-        # user defined sort function for calibre databases (Series, etc.)
-        def _title_sort(title):
-            # calibre sort stuff
-            title_pat = re.compile(config.config_title_regex, re.IGNORECASE)
-            match = title_pat.search(title)
-            if match:
-                prep = match.group(1)
-                title = title[len(prep):] + ', ' + prep
-            return strip_whitespaces(title)
-
         try:
             # sqlalchemy <1.4.24 and sqlalchemy 2.0
             conn = self.session.connection().connection.driver_connection
         except AttributeError:
             # sqlalchemy >1.4.24
             conn = self.session.connection().connection.connection
-        try:
-            if config:
-                conn.create_function("title_sort", 1, _title_sort)
-            conn.create_function('uuid4', 0, lambda: str(uuid4()))
-            conn.create_function("lower", 1, lcase)
-        except sqliteOperationalError:
-            pass
+        add_functions(conn, lambda: config or self.config)
 
     @classmethod
     def dispose(cls):
         # global session
+        with cls.change_lock:
+            cls.close_change_monitor()
 
         for inst in cls.instances:
             old_session = inst.session
@@ -1164,6 +1276,27 @@ class CalibreDB:
         self.update_config(config)
 
 
+def add_functions(conn, get_config):
+    """Registers title_sort(), uuid4() and lower() on a sqlite3 connection. get_config is called on every use of
+    title_sort(), so a changed title regex applies without reconnecting"""
+    # user defined sort function for calibre databases (Series, etc.)
+    def _title_sort(title):
+        # calibre sort stuff
+        title_pat = re.compile(get_config().config_title_regex, re.IGNORECASE)
+        match = title_pat.search(title)
+        if match:
+            prep = match.group(1)
+            title = title[len(prep):] + ', ' + prep
+        return strip_whitespaces(title)
+
+    try:
+        conn.create_function("title_sort", 1, _title_sort)
+        conn.create_function('uuid4', 0, lambda: str(uuid4()))
+        conn.create_function("lower", 1, lcase)
+    except sqliteOperationalError:
+        pass
+
+
 def lcase(s):
     try:
         return unidecode.unidecode(s.lower())
@@ -189,7 +189,7 @@ def find_duplicate_books():
                 
                 # Add cover URL
                 if hasattr(book, 'has_cover') and book.has_cover:
-                    book.cover_url = f"/cover/{book.id}"
+                    book.cover_url = f"/cover/{book.id}?c={int(book.last_modified.timestamp())}"
                 else:
                     book.cover_url = "/static/generic_cover.jpg"
             
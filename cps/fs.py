@@ -7,11 +7,19 @@
 
 from . import logger
 from .constants import CACHE_DIR, CONFIG_DIR, CACHE_TYPE_THUMBNAILS
-from os import makedirs, remove
+from hashlib import sha1
+from os import makedirs, remove, rename
 from os.path import isdir, isfile, join
 from shutil import rmtree
 
 
+def thumbnail_shard(filename):
+    """Sub-directories of a thumbnail, two levels named after the hash of its filename. They spread the thumbnails
+    of a library evenly over 65536 directories, instead of hundreds of thousands of files in one"""
+    digest = sha1(filename.encode()).hexdigest()
+    return digest[:2], digest[2:4]
+
+
 class FileSystem:
     _instance = None
     _cache_dir = CACHE_DIR
@@ -47,16 +55,16 @@ class FileSystem:
         return path if cache_type else cache_dir
 
     def get_cache_file_dir(self, filename, cache_type=None):
-        # For thumbnails with deterministic naming, store directly in cache dir
-        # instead of creating subdirectories based on first 2 characters
+        # Thumbnails are sharded by the hash of their name, the deterministic names would put most of them into
+        # the same few subdirectories
         if cache_type == CACHE_TYPE_THUMBNAILS:
-            return self.get_cache_dir(cache_type)
-        
-        # For other cache types, maintain subdirectory structure
-        path = join(self.get_cache_dir(cache_type), filename[:2])
+            path = join(self.get_cache_dir(cache_type), *thumbnail_shard(filename))
+        else:
+            # For other cache types, maintain subdirectory structure
+            path = join(self.get_cache_dir(cache_type), filename[:2])
         if not isdir(path):
             try:
-                makedirs(path)
+                makedirs(path, exist_ok=True)
             except OSError:
                 self.log.info(f'Failed to create path {path} (Permission denied).')
                 raise
@@ -68,6 +76,21 @@ class FileSystem:
 
     def get_cache_file_exists(self, filename, cache_type=None):
         path = self.get_cache_file_path(filename, cache_type)
+        if cache_type == CACHE_TYPE_THUMBNAILS and not isfile(path):
+            return self.move_flat_thumbnail(filename)
+        return isfile(path)
+
+    def move_flat_thumbnail(self, filename):
+        """Moves a thumbnail still stored directly in the cache dir into its shard, see
+        tasks/thumbnail_migration.py. Returns whether there was one"""
+        flat_path = join(self.get_cache_dir(CACHE_TYPE_THUMBNAILS), filename)
+        if not isfile(flat_path):
+            return False
+        path = self.get_cache_file_path(filename, CACHE_TYPE_THUMBNAILS)
+        try:
+            rename(flat_path, path)
+        except OSError:
+            self.log.info(f'Failed to move {flat_path} to {path}')
         return isfile(path)
 
     def delete_cache_dir(self, cache_type=None):
@@ -95,10 +118,14 @@ class FileSystem:
         # Skip if no filename provided (defensive guard)
         if not filename:
             return
-        path = self.get_cache_file_path(filename, cache_type)
-        if isfile(path):
-            try:
-                remove(path)
-            except OSError:
-                self.log.info(f'Failed to delete path {path} (Permission denied).')
-                raise
+        paths = [self.get_cache_file_path(filename, cache_type)]
+        if cache_type == CACHE_TYPE_THUMBNAILS:
+            # Not moved into its shard yet
+            paths.append(join(self.get_cache_dir(cache_type), filename))
+        for path in paths:
+            if isfile(path):
+                try:
+                    remove(path)
+                except OSError:
+                    self.log.info(f'Failed to delete path {path} (Permission denied).')
+                    raise
@@ -7,18 +7,18 @@
 
 import os
 import random
-import io
 import mimetypes
 import re
 import regex
 import shutil
 import socket
+import threading
 from datetime import datetime, timedelta, timezone
 import requests
 import unidecode
 from uuid import uuid4
 
-from flask import send_from_directory, make_response, abort, url_for, Response
+from flask import send_from_directory, make_response, abort, url_for, Response, request, has_request_context
 from flask_babel import gettext as _
 from flask_babel import lazy_gettext as N_
 from flask_babel import get_locale
@@ -26,6 +26,7 @@ from .cw_login import current_user
 from sqlalchemy.sql.expression import true, false, and_, or_, text, func
 from sqlalchemy.exc import InvalidRequestError, OperationalError
 from werkzeug.datastructures import Headers
+from werkzeug.exceptions import NotFound
 from werkzeug.security import generate_password_hash
 from markupsafe import escape
 from urllib.parse import quote
@@ -42,12 +43,13 @@ except ImportError as e:
 from . import calibre_db, cli_param
 from .string_helper import strip_whitespaces
 from .tasks.convert import TaskConvert
-from . import logger, config, db, ub, fs
+from . import logger, config, db, ub, imaging
 from . import gdriveutils as gd
-from .constants import (STATIC_DIR as _STATIC_DIR, CACHE_TYPE_THUMBNAILS, THUMBNAIL_TYPE_COVER, THUMBNAIL_TYPE_SERIES,
+from .constants import (STATIC_DIR as _STATIC_DIR, THUMBNAIL_TYPE_COVER, THUMBNAIL_TYPE_SERIES,
                         SUPPORTED_CALIBRE_BINARIES)
 from .subproc_wrapper import process_wait
-from .services.worker import WorkerThread
+from .services.worker import WorkerThread, STAT_WAITING, STAT_STARTED
+from .services import thumbnail_index
 from .tasks.mail import TaskEmail
 from .tasks.thumbnail import TaskClearCoverThumbnailCache, TaskGenerateCoverThumbnails
 from .tasks.metadata_backup import TaskBackupMetadata
@@ -57,14 +59,11 @@ from .embed_helper import do_calibre_export
 
 log = logger.create()
 
-try:
-    from wand.image import Image
-    from wand.exceptions import MissingDelegateError, BlobError
-    use_IM = True
-except (ImportError, RuntimeError) as e:
-    log.debug('Cannot import Image, generating covers from non jpg files will not work: %s', e)
-    use_IM = False
-    MissingDelegateError = BaseException
+# Cover requests queue the generation of missing thumbnails, at most this many books are pending at a time
+MAX_PENDING_COVER_THUMBNAILS = 32
+# Book id -> task generating its thumbnails for a cover request
+_pending_cover_thumbnails = dict()
+_pending_cover_thumbnails_lock = threading.Lock()
 
 
 # Convert existing book entry to new format
@@ -747,6 +746,56 @@ def delete_book(book, calibrepath, book_format):
         return delete_book_file(book, calibrepath, book_format)
 
 
+# Covers requested with the version they have now (the c query parameter of the templates' cover urls) never change
+# under that url, clients may keep them for a year without asking again
+COVER_IMMUTABLE_MAX_AGE = 365 * 24 * 3600
+
+
+def get_cover_version(last_modified):
+    """Version of a cover for its url, changes whenever the cover might have changed. The templates' last_modified
+    filter gives the same for a book"""
+    return str(int(last_modified.timestamp()))
+
+
+def is_current_thumbnail(thumbnail, last_modified):
+    """Whether a cached thumbnail was written after the book last changed. An older one may show a cover that
+    has been replaced since, e.g. by cover_enforcer or calibredb"""
+    if last_modified.tzinfo is None:
+        # Calibre stores last_modified in UTC
+        last_modified = last_modified.replace(tzinfo=timezone.utc)
+    return thumbnail is not None and thumbnail.mtime >= last_modified.timestamp()
+
+
+def cover_cache_control(response, version):
+    """Lets clients keep the cover for good if it was requested with its current version, version None never
+    matches"""
+    response.cache_control.private = True
+    if version is not None and has_request_context() and request.args.get('c') == version:
+        response.cache_control.no_cache = None
+        response.cache_control.max_age = COVER_IMMUTABLE_MAX_AGE
+        response.cache_control.immutable = True
+    else:
+        # Clients have to revalidate, which costs them a 304 as long as the cover didn't change
+        response.cache_control.no_cache = True
+    return response
+
+
+def send_cover(directory, filename, etag, last_modified, version):
+    """Sends a cover file with a strong ETag and Last-Modified, answering conditional requests with 304"""
+    response = send_from_directory(directory, filename, etag=etag, last_modified=last_modified)
+    return cover_cache_control(response, version)
+
+
+def cover_not_modified(etag, last_modified, version):
+    """304 response if the client already has the cover with this etag, otherwise None"""
+    if not has_request_context() or not request.if_none_match.contains(etag):
+        return None
+    response = Response(status=304)
+    response.set_etag(etag)
+    response.last_modified = last_modified
+    return cover_cache_control(response, version)
+
+
 def get_cover_on_failure():
     try:
         return send_from_directory(_STATIC_DIR, "generic_cover.jpg")
@@ -768,45 +817,31 @@ def get_book_cover_with_uuid(book_uuid, resolution=None):
 
 
 def get_book_cover_internal(book, resolution=None):
-    """Serve book cover with improved thumbnail generation fallback.
+    """Serve book cover with thumbnail generation fallback.
     
-    When a thumbnail is requested but missing, generate it synchronously
-    instead of falling back to the original cover.jpg.
+    When a thumbnail is requested but missing, its generation is queued
+    and the original cover.jpg is served until it's there.
     """
     if book and book.has_cover:
 
         # Send the book cover thumbnail if it exists in cache
         if resolution:
-            cache = fs.FileSystem()
-            # Check for both webp and jpg thumbnails, generate missing ones
-            webp_thumb = get_book_cover_thumbnail_by_format(book, resolution, 'webp')
-            jpg_thumb = get_book_cover_thumbnail_by_format(book, resolution, 'jpg')
-            
-            # Check if files actually exist on disk
-            webp_exists = webp_thumb and cache.get_cache_file_exists(webp_thumb.filename, CACHE_TYPE_THUMBNAILS)
-            jpg_exists = jpg_thumb and cache.get_cache_file_exists(jpg_thumb.filename, CACHE_TYPE_THUMBNAILS)
+            # Check for both webp and jpg thumbnails, generate missing ones. The index only holds thumbnails
+            # whose file exists
+            webp_thumb = thumbnail_index.lookup(THUMBNAIL_TYPE_COVER, book.id, resolution, 'webp')
+            jpg_thumb = thumbnail_index.lookup(THUMBNAIL_TYPE_COVER, book.id, resolution, 'jpg')
+            # Thumbnails older than the book's last change count as missing, their url would be marked immutable
+            # with the version of a cover they may not show
+            webp_exists = is_current_thumbnail(webp_thumb, book.last_modified)
+            jpg_exists = is_current_thumbnail(jpg_thumb, book.last_modified)
             
-            # Generate missing thumbnails on-demand (skip for Kobo requests to avoid delays)
-            if not webp_exists or not jpg_exists:
+            # Missing and outdated thumbnails are generated in the background, until then this request gets the
+            # other format or cover.jpg
+            if (not webp_exists or not jpg_exists) and imaging.backend:
                 try:
-                    from flask import has_request_context, request
-                    is_kobo_request = (has_request_context() and 
-                                     request.path and 
-                                     '/kobo/' in request.path)
-                    
-                    if not is_kobo_request and use_IM:
-                        from .tasks.thumbnail import TaskGenerateCoverThumbnails
-                        # Create and run thumbnail generation for this book
-                        thumbnail_task = TaskGenerateCoverThumbnails(book_id=book.id)
-                        thumbnail_task.create_book_cover_thumbnails(book)
-                        
-                        # Refresh thumbnail references after generation
-                        webp_thumb = get_book_cover_thumbnail_by_format(book, resolution, 'webp')
-                        jpg_thumb = get_book_cover_thumbnail_by_format(book, resolution, 'jpg')
-                        webp_exists = webp_thumb and cache.get_cache_file_exists(webp_thumb.filename, CACHE_TYPE_THUMBNAILS)
-                        jpg_exists = jpg_thumb and cache.get_cache_file_exists(jpg_thumb.filename, CACHE_TYPE_THUMBNAILS)
+                    queue_missing_cover_thumbnails(book.id)
                 except Exception as ex:
-                    log.debug(f'Failed to generate thumbnail on-demand for book {book.id}: {ex}')
+                    log.debug(f'Failed to queue thumbnail generation for book {book.id}: {ex}')
             
             # Determine which thumbnail format to serve based on request context
             try:
@@ -824,17 +859,34 @@ def get_book_cover_internal(book, resolution=None):
                 # Fallback if we can't determine request context
                 thumbnail_to_serve = webp_thumb if webp_exists else (jpg_thumb if jpg_exists else None)
             if thumbnail_to_serve:
-                return send_from_directory(cache.get_cache_file_dir(thumbnail_to_serve.filename, CACHE_TYPE_THUMBNAILS),
-                                           thumbnail_to_serve.filename)
-
+                version = get_cover_version(book.last_modified)
+                etag = "{}-{}-{}".format(thumbnail_to_serve.filename, version, int(thumbnail_to_serve.mtime))
+                try:
+                    return send_cover(thumbnail_to_serve.directory, thumbnail_to_serve.filename, etag,
+                                      datetime.fromtimestamp(thumbnail_to_serve.mtime, timezone.utc), version)
+                except NotFound:
+                    # Removed from the cache since it was indexed
+                    thumbnail_index.invalidate(THUMBNAIL_TYPE_COVER, book.id)
+
+        version = get_cover_version(book.last_modified)
+        etag = "book_{}-{}".format(book.id, version)
+        if resolution:
+            # cover.jpg stands in for a thumbnail that isn't there yet, the url has to pick up the thumbnail later
+            version = None
         # Send the book cover from Google Drive if configured
         if config.config_use_google_drive:
             try:
+                not_modified = cover_not_modified(etag, book.last_modified, version)
+                if not_modified:
+                    return not_modified
                 if not gd.is_gdrive_ready():
                     return get_cover_on_failure()
                 cover_file = gd.get_cover_via_gdrive(book.path)
                 if cover_file:
-                    return Response(cover_file, mimetype='image/jpeg')
+                    response = Response(cover_file, mimetype='image/jpeg')
+                    response.set_etag(etag)
+                    response.last_modified = book.last_modified
+                    return cover_cache_control(response, version)
                 else:
                     log.error('{}/cover.jpg not found on Google Drive'.format(book.path))
                     return get_cover_on_failure()
@@ -846,7 +898,7 @@ def get_book_cover_internal(book, resolution=None):
         else:
             cover_file_path = os.path.join(config.get_book_path(), book.path)
             if os.path.isfile(os.path.join(cover_file_path, "cover.jpg")):
-                return send_from_directory(cover_file_path, "cover.jpg")
+                return send_cover(cover_file_path, "cover.jpg", etag, book.last_modified, version)
             else:
                 return get_cover_on_failure()
     else:
@@ -864,19 +916,6 @@ def get_book_cover_thumbnail(book, resolution):
                 .first())
 
 
-def get_book_cover_thumbnail_by_format(book, resolution, format):
-    """Get thumbnail for specific book, resolution, and format (webp/jpg)"""
-    if book and book.has_cover:
-        return (ub.session
-                .query(ub.Thumbnail)
-                .filter(ub.Thumbnail.type == THUMBNAIL_TYPE_COVER)
-                .filter(ub.Thumbnail.entity_id == book.id)
-                .filter(ub.Thumbnail.resolution == resolution)
-                .filter(ub.Thumbnail.format == format)
-                .filter(or_(ub.Thumbnail.expiration.is_(None), ub.Thumbnail.expiration > datetime.now(timezone.utc)))
-                .first())
-
-
 def get_series_thumbnail_on_failure(series_id, resolution):
     book = (calibre_db.session
         .query(db.Books)
@@ -895,26 +934,18 @@ def get_series_cover_thumbnail(series_id, resolution=None):
 def get_series_cover_internal(series_id, resolution=None):
     # Send the series thumbnail if it exists in cache
     if resolution:
-        thumbnail = get_series_thumbnail(series_id, resolution)
+        thumbnail = thumbnail_index.lookup(THUMBNAIL_TYPE_SERIES, series_id, resolution)
         if thumbnail:
-            cache = fs.FileSystem()
-            if cache.get_cache_file_exists(thumbnail.filename, CACHE_TYPE_THUMBNAILS):
-                return send_from_directory(cache.get_cache_file_dir(thumbnail.filename, CACHE_TYPE_THUMBNAILS),
-                                           thumbnail.filename)
+            version = str(int(thumbnail.mtime))
+            try:
+                return send_cover(thumbnail.directory, thumbnail.filename, "{}-{}".format(thumbnail.filename, version),
+                                  datetime.fromtimestamp(thumbnail.mtime, timezone.utc), version)
+            except NotFound:
+                thumbnail_index.invalidate(THUMBNAIL_TYPE_SERIES, series_id)
 
     return get_series_thumbnail_on_failure(series_id, resolution)
 
 
-def get_series_thumbnail(series_id, resolution):
-    return (ub.session
-        .query(ub.Thumbnail)
-        .filter(ub.Thumbnail.type == THUMBNAIL_TYPE_SERIES)
-        .filter(ub.Thumbnail.entity_id == series_id)
-        .filter(ub.Thumbnail.resolution == resolution)
-        .filter(or_(ub.Thumbnail.expiration.is_(None), ub.Thumbnail.expiration > datetime.now(timezone.utc)))
-        .first())
-
-
 # saves book cover from url
 def save_cover_from_url(url, book_path):
     try:
@@ -935,7 +966,7 @@ def save_cover_from_url(url, book_path):
         # "Invalid host" can be the result of a redirect response
         log.error(u'Cover Download Error %s', ex)
         return False, _("Error Downloading Cover")
-    except MissingDelegateError as ex:
+    except imaging.ImageError as ex:
         log.info(u'File Format Error %s', ex)
         return False, _("Cover Format Error")
     except UnacceptableAddressException as e:
@@ -952,15 +983,15 @@ def save_cover_from_filestorage(filepath, saved_filename, img):
             log.error("Failed to create path for cover")
             return False, _("Failed to create path for cover")
     try:
-        # upload of jpg file without wand
+        # upload of jpg file without an image backend
         if isinstance(img, requests.Response):
             with open(os.path.join(filepath, saved_filename), 'wb') as f:
                 f.write(img.content)
         else:
-            if hasattr(img, "metadata"):
-                # upload of jpg/png... via url
-                img.save(filename=os.path.join(filepath, saved_filename))
-                img.close()
+            if isinstance(img, imaging.BackendImage):
+                # upload of jpg/png... converted by the image backend
+                with img:
+                    img.save(os.path.join(filepath, saved_filename), 'jpg', 92)
             else:
                 # upload of jpg/png... from hdd
                 img.save(os.path.join(filepath, saved_filename))
@@ -980,20 +1011,14 @@ def save_cover(img, book_path):
         if separator:
             content_type = content_type.split(separator)[0].strip()
         
-    if use_IM:
+    if imaging.backend:
         if content_type not in ('image/jpeg', 'image/jpg', 'image/png', 'image/webp', 'image/bmp'):
             log.error("Only jpg/jpeg/png/webp/bmp files are supported as coverfile")
             return False, _("Only jpg/jpeg/png/webp/bmp files are supported as coverfile")
         # convert to jpg because calibre only supports jpg
         try:
-            if hasattr(img, 'stream'):
-                imgc = Image(blob=img.stream)
-            else:
-                imgc = Image(blob=io.BytesIO(img.content))
-            imgc.format = 'jpeg'
-            imgc.transform_colorspace("srgb")
-            img = imgc
-        except (BlobError, MissingDelegateError):
+            img = imaging.backend.open(blob=img.stream.read() if hasattr(img, 'stream') else img.content)
+        except imaging.ImageError:
             log.error("Invalid cover file content")
             return False, _("Invalid cover file content")
     else:
@@ -1020,7 +1045,7 @@ def trigger_thumbnail_generation_for_book(book_id):
     try:
         from .tasks.thumbnail import TaskGenerateCoverThumbnails
         
-        if use_IM:
+        if imaging.backend:
             # Queue thumbnail generation task
             thumbnail_task = TaskGenerateCoverThumbnails(book_id=book_id, task_message="Generating thumbnails after cover update")
             WorkerThread.add(current_user.name, thumbnail_task, hidden=True)
@@ -1251,16 +1276,28 @@ def delete_thumbnail_cache():
     WorkerThread.add(None, TaskClearCoverThumbnailCache(-1))
 
 
+def queue_missing_cover_thumbnails(book_id):
+    """Queues the generation of a book's missing thumbnails for a cover request, unless it's already pending.
+    At most MAX_PENDING_COVER_THUMBNAILS books are pending at a time, later requests queue the rest"""
+    with _pending_cover_thumbnails_lock:
+        for pending_id, task in list(_pending_cover_thumbnails.items()):
+            if task.stat not in (STAT_WAITING, STAT_STARTED):
+                del _pending_cover_thumbnails[pending_id]
+        if book_id in _pending_cover_thumbnails or len(_pending_cover_thumbnails) >= MAX_PENDING_COVER_THUMBNAILS:
+            return
+        # The task doing the work, which is a queued library-wide run if the book was merged into it
+        _pending_cover_thumbnails[book_id] = WorkerThread.add(None, TaskGenerateCoverThumbnails(book_id), hidden=True)
+
+
 def add_book_to_thumbnail_cache(book_id):
     # Always generate thumbnails for new books
     WorkerThread.add(None, TaskGenerateCoverThumbnails(book_id), hidden=True)
 
 
 def update_thumbnail_cache():
-    # Always allow manual thumbnail cache updates
-    task = TaskGenerateCoverThumbnails()
-    WorkerThread.add(None, task)
-    # Return task ID for tracking
+    # Always allow manual thumbnail cache updates, they check the thumbnails of every book
+    task = WorkerThread.add(None, TaskGenerateCoverThumbnails(verify=True))
+    # Return task ID for tracking, of the already queued task if the new one was merged into it
     return task.id
 
 
@@ -0,0 +1,351 @@
+# -*- coding: utf-8 -*-
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Image backends for cover thumbnails and cover conversion. Every backend decodes an image into a BackendImage,
+which can be resized, cropped, composited onto a canvas and encoded as WebP or JPEG.
+
+The backend is chosen once at startup: the one named by the CWA_IMAGE_BACKEND environment variable, or with
+'auto' the first one available of pyvips, Pillow and ImageMagick (Wand). pyvips and Pillow decode JPEGs at a
+reduced size when the image is going to be scaled down anyway and need a fraction of ImageMagick's memory.
+"""
+
+import io
+import os
+
+from . import constants, logger
+
+log = logger.create()
+
+try:
+    import pyvips
+    use_vips = True
+except (ImportError, OSError) as e:
+    log.debug('Cannot import pyvips, using it as image backend will not work: %s', e)
+    use_vips = False
+
+try:
+    from PIL import Image as PILImage, UnidentifiedImageError, __version__ as pillow_version
+    LANCZOS = getattr(PILImage, 'Resampling', PILImage).LANCZOS
+    use_pillow = True
+except ImportError as e:
+    log.debug('Cannot import Pillow, using it as image backend will not work: %s', e)
+    use_pillow = False
+
+try:
+    from wand.image import Image as WandImage
+    from wand.exceptions import WandException
+    from wand import version as wand_version
+    use_IM = True
+except (ImportError, RuntimeError) as e:
+    log.debug('Cannot import Wand, using ImageMagick as image backend will not work: %s', e)
+    use_IM = False
+
+
+class ImageError(Exception):
+    """The image can't be decoded"""
+    pass
+
+
+def _encoder_format(fmt):
+    fmt = fmt.lower()
+    return 'jpeg' if fmt in ('jpg', 'jpeg') else fmt
+
+
+class BackendImage:
+    """A decoded image of one of the backends, closes it when used as context manager"""
+
+    def __init__(self, image):
+        self.image = image
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *args):
+        self.close()
+
+    @property
+    def width(self):
+        raise NotImplementedError
+
+    @property
+    def height(self):
+        raise NotImplementedError
+
+    def resize(self, width, height):
+        raise NotImplementedError
+
+    def crop_center(self, width, height):
+        """Crops the image to width x height around its center"""
+        raise NotImplementedError
+
+    def composite(self, other, left, top):
+        """Draws other onto this image with its top left corner at left, top"""
+        raise NotImplementedError
+
+    def save(self, filename, fmt, quality):
+        """Encodes the image as sRGB 'webp' or 'jpg' with the given quality"""
+        raise NotImplementedError
+
+    def close(self):
+        pass
+
+
+class ImageBackend:
+    name = None
+
+    def open(self, filename=None, blob=None, height=None):
+        """Decodes the image file or the bytes in blob. If the image is going to be scaled down to height, the
+        backend may decode it at a reduced size that's still at least that tall. Raises ImageError"""
+        raise NotImplementedError
+
+    def blank(self, width, height):
+        """A transparent canvas"""
+        raise NotImplementedError
+
+    def init_process(self):
+        """Runs in every process of the thumbnail pool, which has one process per CPU already"""
+        pass
+
+    @property
+    def version(self):
+        raise NotImplementedError
+
+
+class MagickImage(BackendImage):
+    @property
+    def width(self):
+        return self.image.width
+
+    @property
+    def height(self):
+        return self.image.height
+
+    def resize(self, width, height):
+        self.image.resize(width=int(width), height=int(height), filter='lanczos')
+
+    def crop_center(self, width, height):
+        self.image.crop(width=int(width), height=int(height), gravity='center')
+
+    def composite(self, other, left, top):
+        self.image.composite(other.image, int(left), int(top))
+
+    def save(self, filename, fmt, quality):
+        self.image.format = _encoder_format(fmt)
+        self.image.transform_colorspace('srgb')
+        try:
+            self.image.compression_quality = quality
+        except Exception:
+            pass
+        self.image.save(filename=filename)
+
+    def close(self):
+        self.image.close()
+
+
+class MagickBackend(ImageBackend):
+    name = 'magick'
+
+    def open(self, filename=None, blob=None, height=None):
+        img = WandImage()
+        try:
+            if height:
+                # libjpeg decodes at 1/2, 1/4 or 1/8 of the size as long as the image stays this tall
+                img.options['jpeg:size'] = '1x{}'.format(int(height))
+            if filename is not None:
+                img.read(filename=filename)
+            else:
+                img.read(blob=blob)
+        except WandException as ex:
+            img.close()
+            raise ImageError(str(ex))
+        return MagickImage(img)
+
+    def blank(self, width, height):
+        img = WandImage()
+        img.blank(int(width), int(height))
+        return MagickImage(img)
+
+    def init_process(self):
+        os.environ['MAGICK_THREAD_LIMIT'] = '1'
+        os.environ['OMP_NUM_THREADS'] = '1'
+        from wand.resource import limits
+        limits['thread'] = 1
+
+    @property
+    def version(self):
+        return 'ImageMagick {}'.format(wand_version.MAGICK_VERSION)
+
+
+class PillowImage(BackendImage):
+    @property
+    def width(self):
+        return self.image.width
+
+    @property
+    def height(self):
+        return self.image.height
+
+    def resize(self, width, height):
+        self.image = self.image.resize((int(width), int(height)), LANCZOS)
+
+    def crop_center(self, width, height):
+        left = max(0, (self.image.width - int(width)) // 2)
+        top = max(0, (self.image.height - int(height)) // 2)
+        self.image = self.image.crop((left, top, left + min(int(width), self.image.width),
+                                      top + min(int(height), self.image.height)))
+
+    def composite(self, other, left, top):
+        mask = other.image if other.image.mode == 'RGBA' else None
+        self.image.paste(other.image, (int(left), int(top)), mask)
+
+    def save(self, filename, fmt, quality):
+        fmt = _encoder_format(fmt)
+        img = self.image
+        if fmt == 'jpeg' and img.mode != 'RGB':
+            img = img.convert('RGB')
+        img.save(filename, format=fmt.upper(), quality=quality)
+
+    def close(self):
+        self.image.close()
+
+
+class PillowBackend(ImageBackend):
+    name = 'pillow'
+
+    def open(self, filename=None, blob=None, height=None):
+        try:
+            img = PILImage.open(filename if filename is not None else io.BytesIO(blob))
+            if height:
+                # JPEGs are decoded at 1/2, 1/4 or 1/8 of the size as long as the image stays this tall
+                img.draft('RGB', (1, int(height)))
+            img.load()
+        except (UnidentifiedImageError, OSError, ValueError) as ex:
+            raise ImageError(str(ex))
+        if img.mode not in ('RGB', 'RGBA'):
+            has_alpha = 'A' in img.mode or 'transparency' in img.info
+            img = img.convert('RGBA' if has_alpha else 'RGB')
+        return PillowImage(img)
+
+    def blank(self, width, height):
+        return PillowImage(PILImage.new('RGBA', (int(width), int(height)), (0, 0, 0, 0)))
+
+    @property
+    def version(self):
+        return 'Pillow {}'.format(pillow_version)
+
+
+class VipsImage(BackendImage):
+    @property
+    def width(self):
+        return self.image.width
+
+    @property
+    def height(self):
+        return self.image.height
+
+    def resize(self, width, height):
+        self.image = self.image.resize(int(width) / self.image.width, vscale=int(height) / self.image.height,
+                                       kernel='lanczos3')
+
+    def crop_center(self, width, height):
+        width = min(int(width), self.image.width)
+        height = min(int(height), self.image.height)
+        self.image = self.image.crop((self.image.width - width) // 2, (self.image.height - height) // 2,
+                                     width, height)
+
+    def composite(self, other, left, top):
+        img = other.image
+        if img.bands < 3:
+            img = img.colourspace('srgb')
+        if not img.hasalpha():
+            img = img.bandjoin(255)
+        self.image = self.image.composite2(img, 'over', x=int(left), y=int(top))
+
+    def save(self, filename, fmt, quality):
+        img = self.image
+        if img.interpretation != 'srgb':
+            img = img.colourspace('srgb')
+        if _encoder_format(fmt) == 'jpeg':
+            if img.hasalpha():
+                img = img.flatten()
+            img.jpegsave(filename, Q=quality)
+        else:
+            img.webpsave(filename, Q=quality)
+
+    def close(self):
+        self.image = None
+
+
+class VipsBackend(ImageBackend):
+    name = 'vips'
+
+    def open(self, filename=None, blob=None, height=None):
+        try:
+            if height:
+                # Shrinks on load where the format allows it, the result is exactly height tall unless the image
+                # is smaller already
+                if filename is not None:
+                    img = pyvips.Image.thumbnail(filename, 10000000, height=int(height), size='down')
+                else:
+                    img = pyvips.Image.thumbnail_buffer(blob, 10000000, height=int(height), size='down')
+            elif filename is not None:
+                img = pyvips.Image.new_from_file(filename, access='sequential')
+            else:
+                img = pyvips.Image.new_from_buffer(blob, '', access='sequential')
+            # Decode now, so a broken image fails here and not when it's saved
+            img = img.copy_memory()
+        except pyvips.Error as ex:
+            raise ImageError(str(ex))
+        return VipsImage(img)
+
+    def blank(self, width, height):
+        return VipsImage(pyvips.Image.black(int(width), int(height), bands=4).copy(interpretation='srgb'))
+
+    def init_process(self):
+        os.environ['VIPS_CONCURRENCY'] = '1'
+        if hasattr(pyvips, 'concurrency_set'):
+            pyvips.concurrency_set(1)
+
+    @property
+    def version(self):
+        return 'libvips {}.{}.{}'.format(pyvips.version(0), pyvips.version(1), pyvips.version(2))
+
+
+BACKENDS = [('vips', use_vips, VipsBackend), ('pillow', use_pillow, PillowBackend), ('magick', use_IM, MagickBackend)]
+
+
+def get_backend(name):
+    """The backend of the given name, None if its library isn't installed"""
+    for backend_name, available, backend_class in BACKENDS:
+        if backend_name == name:
+            return backend_class() if available else None
+    return None
+
+
+def available_backends():
+    return [backend_name for backend_name, available, __ in BACKENDS if available]
+
+
+def select_backend(name):
+    if name != 'auto':
+        selected = get_backend(name)
+        if selected is not None:
+            return selected
+        log.error("Image backend '%s' is not available, using the first available one", name)
+    available = available_backends()
+    if available:
+        return get_backend(available[0])
+    log.info('None of pyvips, Pillow and ImageMagick is available, cover thumbnails will not be generated')
+    return None
+
+
+def get_version():
+    return {'Image backend': backend.version if backend else 'not installed'}
+
+
+backend = select_backend(constants.IMAGE_BACKEND)
@@ -17,6 +17,7 @@ from flask_babel import format_date
 from .cw_login import current_user
 
 from . import constants, logger
+from .services import thumbnail_index
 
 jinjia = Blueprint('jinjia', __name__)
 log = logger.create()
@@ -172,7 +173,10 @@ def get_cover_srcset(series):
         constants.COVER_THUMBNAIL_LARGE: 'lg'
     }
     for resolution, shortname in resolutions.items():
-        url = url_for('web.get_series_cover', series_id=series.id, resolution=shortname, c=cache_timestamp())
+        # Versioned by the series thumbnail, which lets browsers keep it until it's generated again
+        thumbnail = thumbnail_index.lookup(constants.THUMBNAIL_TYPE_SERIES, series.id, resolution)
+        version = str(int(thumbnail.mtime)) if thumbnail else cache_timestamp()
+        url = url_for('web.get_series_cover', series_id=series.id, resolution=shortname, c=version)
         srcset.append(f'{url} {resolution}x')
     return ', '.join(srcset)
 
@@ -29,7 +29,7 @@ def get_scheduled_tasks(reconnect=True):
     if config.schedule_metadata_backup:
         tasks.append([lambda: TaskBackupMetadata("en"), 'backup metadata', False])
 
-    # Generate all missing book cover thumbnails
+    # Generate the missing cover thumbnails of new and changed books
     if config.schedule_generate_book_covers:
         tasks.append([lambda: TaskClearCoverThumbnailCache(0), 'delete superfluous book covers', True])
         tasks.append([lambda: TaskGenerateCoverThumbnails(), 'generate book covers', False])
@@ -69,10 +69,13 @@ def register_scheduled_tasks(reconnect=True):
 
         # Kick-off tasks, if they should currently be running
         if should_task_be_running(start, duration):
-            scheduler.schedule_tasks_immediately(tasks=get_scheduled_tasks(reconnect))
+            scheduler.schedule_tasks_immediately(tasks=get_scheduled_tasks(reconnect), scheduled=True)
 
 
 def register_startup_tasks():
+    # Queue the tasks again that hadn't finished before the restart
+    WorkerThread.requeue_persisted_tasks()
+
     scheduler = BackgroundScheduler()
 
     if scheduler:
@@ -57,17 +57,21 @@ class BackgroundScheduler:
                 self.schedule_task(task[0], user=user, trigger=trigger, name=task[1], hidden=task[2])
 
     # Expects a lambda expression for the task
-    def schedule_task_immediately(self, task, user=None, name=None, hidden=False):
+    def schedule_task_immediately(self, task, user=None, name=None, hidden=False, scheduled=False):
         if use_APScheduler:
             def immediate_task():
-                WorkerThread.add(user, task(), hidden)
+                worker_task = task()
+                worker_task.scheduled = scheduled
+                WorkerThread.add(user, worker_task, hidden)
             return self.schedule(func=immediate_task, trigger=DateTrigger(), name=name)
 
     # Expects a list of lambda expressions for the tasks
-    def schedule_tasks_immediately(self, tasks, user=None):
+    # scheduled marks the tasks as part of the scheduled run, which ends them with the time window
+    def schedule_tasks_immediately(self, tasks, user=None, scheduled=False):
         if use_APScheduler:
             for task in tasks:
-                self.schedule_task_immediately(task[0], user, name="immediately " + task[1], hidden=task[2])
+                self.schedule_task_immediately(task[0], user, name="immediately " + task[1], hidden=task[2],
+                                               scheduled=scheduled)
 
     # Remove all jobs
     def remove_all_jobs(self):
@@ -0,0 +1,170 @@
+# -*- coding: utf-8 -*-
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Keeps the tasks queued in the WorkerThread in the task_queue table of app.db, so conversions, emails and
+thumbnail jobs that were queued or running when the container stopped are queued again on the next start.
+
+A task is stored by the constructor arguments its serialize() returns, its state and the last checkpoint
+it saved. The arguments are dropped once the task has finished, as they can hold mail texts. Nothing is
+stored until ub.init_db() has set up app.db, and failing writes are logged but never stop the worker.
+"""
+
+import threading
+from datetime import datetime, timedelta
+
+from .. import logger, ub
+
+log = logger.create()
+
+# Task states in the task_queue table
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+FAILED = 'failed'
+ENDED = 'ended'
+CANCELLED = 'cancelled'
+
+# Finished tasks are kept this long
+KEEP_DAYS = 7
+
+_session = None
+_session_path = None
+_session_lock = threading.Lock()
+
+
+def _get_session():
+    global _session, _session_path
+    if not ub.app_DB_path:
+        return None
+    with _session_lock:
+        if _session is None or _session_path != ub.app_DB_path:
+            # Scoped session, every worker thread gets its own connection
+            _session = ub.get_new_session_instance()
+            _session_path = ub.app_DB_path
+        return _session
+
+
+def _run(description, action, default=None):
+    session = _get_session()
+    if session is None:
+        return default
+    try:
+        result = action(session)
+        session.commit()
+        return result
+    except Exception as ex:
+        session.rollback()
+        log.error("Could not {} in the task queue: {}".format(description, ex))
+        return default
+
+
+def _entry(session, task_id):
+    return session.query(ub.TaskQueue).filter(ub.TaskQueue.task_id == str(task_id)).one_or_none()
+
+
+def add(task_id, task_type, resume_key, user, hidden, scheduled, payload, added, not_before=None, checkpoint=None):
+    """Stores a newly queued task. Returns False if it couldn't be stored"""
+    def action(session):
+        session.add(ub.TaskQueue(task_id=str(task_id), task_type=task_type, resume_key=resume_key, user=user,
+                                 hidden=hidden, scheduled=scheduled, payload=payload, checkpoint=checkpoint,
+                                 state=QUEUED, added=added, not_before=not_before))
+        return True
+    return _run("add task {}".format(task_id), action, False)
+
+
+def set_state(task_id, state, error=None):
+    def action(session):
+        entry = _entry(session, task_id)
+        if entry is None:
+            return
+        entry.state = state
+        if state not in (QUEUED, RUNNING):
+            entry.finished = datetime.now()
+            entry.error = str(error) if error else None
+            entry.payload = None
+    _run("update task {}".format(task_id), action)
+
+
+def set_checkpoint(task_id, checkpoint):
+    def action(session):
+        entry = _entry(session, task_id)
+        if entry is not None:
+            entry.checkpoint = checkpoint
+    _run("save the checkpoint of task {}".format(task_id), action)
+
+
+def take_checkpoint(resume_key, live_task_ids=()):
+    """
+    Checkpoint of the most recent scheduled run of the same task that didn't finish, because its time window
+    ended or CWA was restarted. The older runs give up their checkpoint, so only one new run resumes from it.
+    """
+    def action(session):
+        entries = (session.query(ub.TaskQueue)
+                   .filter(ub.TaskQueue.resume_key == resume_key)
+                   .filter(ub.TaskQueue.scheduled == True)
+                   .filter(ub.TaskQueue.state.in_((QUEUED, RUNNING, ENDED)))
+                   .filter(ub.TaskQueue.checkpoint.isnot(None))
+                   .order_by(ub.TaskQueue.id.desc())
+                   .all())
+        checkpoint = None
+        for entry in entries:
+            if entry.task_id in live_task_ids:
+                continue
+            if checkpoint is None:
+                checkpoint = entry.checkpoint
+            entry.checkpoint = None
+            if entry.state != ENDED:
+                entry.state = ENDED
+                entry.finished = datetime.now()
+                entry.payload = None
+        return checkpoint
+    return _run("look up the checkpoint of {}".format(resume_key), action)
+
+
+def end_interrupted_scheduled(live_task_ids=()):
+    """Marks scheduled tasks that were still queued or running before a restart as ended, keeping their
+    checkpoint for the next scheduled run"""
+    def action(session):
+        entries = (session.query(ub.TaskQueue)
+                   .filter(ub.TaskQueue.state.in_((QUEUED, RUNNING)))
+                   .filter(ub.TaskQueue.scheduled == True)
+                   .all())
+        for entry in entries:
+            if entry.task_id not in live_task_ids:
+                entry.state = ENDED
+                entry.finished = datetime.now()
+                entry.error = "Interrupted by a restart"
+                entry.payload = None
+    _run("end interrupted scheduled tasks", action)
+
+
+def unfinished():
+    """Tasks that were queued or running and weren't added by the scheduler, oldest first"""
+    def action(session):
+        entries = (session.query(ub.TaskQueue)
+                   .filter(ub.TaskQueue.state.in_((QUEUED, RUNNING)))
+                   .filter(ub.TaskQueue.scheduled == False)
+                   .order_by(ub.TaskQueue.id)
+                   .all())
+        return [{"task_id": entry.task_id, "task_type": entry.task_type, "user": entry.user,
+                 "hidden": bool(entry.hidden), "payload": entry.payload or {}, "checkpoint": entry.checkpoint,
+                 "added": entry.added or datetime.now(), "not_before": entry.not_before}
+                for entry in entries]
+    return _run("read the unfinished tasks", action, [])
+
+
+def prune(keep_days=KEEP_DAYS):
+    """Deletes tasks that finished more than keep_days ago"""
+    cutoff = datetime.now() - timedelta(days=keep_days)
+
+    def action(session):
+        return (session.query(ub.TaskQueue)
+                .filter(ub.TaskQueue.finished.isnot(None))
+                .filter(ub.TaskQueue.finished < cutoff)
+                .delete())
+    return _run("prune finished tasks", action, 0)
@@ -0,0 +1,135 @@
+# -*- coding: utf-8 -*-
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+In-memory index of the thumbnail files in the cache, so serving a cached cover needs neither app.db nor a stat
+of the cache file. A grid page otherwise runs two thumbnail queries and two isfile checks per cover.
+
+The thumbnails of a book or series are loaded with one query the first time they are asked for, only rows whose
+file exists are kept. The least recently used entries are dropped once MAX_ENTITIES books and series are indexed.
+The thumbnail tasks invalidate the entries whose rows they write or delete, and a cached file that turns out to
+be gone invalidates its entry when it's served.
+"""
+
+import os
+import threading
+from collections import OrderedDict, namedtuple
+from datetime import datetime, timezone
+
+from sqlalchemy import or_
+
+from .. import constants, fs, logger, ub
+
+log = logger.create()
+
+# Books and series kept in the index, an entry holds the up to 6 thumbnail files of one of them
+MAX_ENTITIES = 20000
+
+CachedThumbnail = namedtuple('CachedThumbnail', 'directory, filename, mtime')
+
+# (thumbnail type, entity id) -> {(resolution, format): CachedThumbnail}
+_index = OrderedDict()
+_lock = threading.Lock()
+# Bumped by every invalidation, an entry loaded while the rows were changing isn't stored
+_version = 0
+
+_session = None
+_session_path = None
+_session_lock = threading.Lock()
+
+
+def _get_session():
+    global _session, _session_path
+    if not ub.app_DB_path:
+        return None
+    with _session_lock:
+        if _session is None or _session_path != ub.app_DB_path:
+            # Scoped session, every request thread gets its own connection
+            _session = ub.get_new_session_instance()
+            _session_path = ub.app_DB_path
+        return _session
+
+
+def _load(thumb_type, entity_id):
+    session = _get_session()
+    if session is None:
+        return None
+    try:
+        thumbnails = (session.query(ub.Thumbnail)
+                      .filter(ub.Thumbnail.type == thumb_type)
+                      .filter(ub.Thumbnail.entity_id == entity_id)
+                      .filter(or_(ub.Thumbnail.expiration.is_(None),
+                                  ub.Thumbnail.expiration > datetime.now(timezone.utc)))
+                      .order_by(ub.Thumbnail.id)
+                      .all())
+        session.commit()
+    except Exception as ex:
+        session.rollback()
+        log.error("Could not read the thumbnails of {} {}: {}".format(thumb_type, entity_id, ex))
+        return None
+
+    cache = fs.FileSystem()
+    entry = dict()
+    for thumbnail in thumbnails:
+        try:
+            if not cache.get_cache_file_exists(thumbnail.filename, constants.CACHE_TYPE_THUMBNAILS):
+                continue
+            directory = cache.get_cache_file_dir(thumbnail.filename, constants.CACHE_TYPE_THUMBNAILS)
+            mtime = os.stat(os.path.join(directory, thumbnail.filename)).st_mtime
+        except OSError:
+            continue
+        entry.setdefault((thumbnail.resolution, thumbnail.format.lower()),
+                         CachedThumbnail(directory, thumbnail.filename, mtime))
+    return entry
+
+
+def _get_entry(thumb_type, entity_id):
+    key = (thumb_type, entity_id)
+    with _lock:
+        entry = _index.get(key)
+        if entry is not None:
+            _index.move_to_end(key)
+            return entry
+        version = _version
+
+    entry = _load(thumb_type, entity_id)
+    if entry is None:
+        return dict()
+    with _lock:
+        if version == _version:
+            _index[key] = entry
+            _index.move_to_end(key)
+            while len(_index) > MAX_ENTITIES:
+                _index.popitem(last=False)
+    return entry
+
+
+def lookup(thumb_type, entity_id, resolution, file_format=None):
+    """CachedThumbnail of the given book or series, resolution and format, any format if file_format is None.
+    Returns None if there is no such thumbnail file"""
+    entry = _get_entry(thumb_type, entity_id)
+    if file_format is not None:
+        return entry.get((resolution, file_format))
+    for (thumb_resolution, __), thumbnail in entry.items():
+        if thumb_resolution == resolution:
+            return thumbnail
+    return None
+
+
+def invalidate(thumb_type=None, entity_id=None):
+    """Drops the entry of one book or series, of every entity of thumb_type if entity_id is None, or the whole
+    index if thumb_type is None as well"""
+    global _version
+    with _lock:
+        _version += 1
+        if thumb_type is None:
+            _index.clear()
+        elif entity_id is None:
+            for key in [key for key in _index if key[0] == thumb_type]:
+                del _index[key]
+        else:
+            _index.pop((thumb_type, entity_id), None)
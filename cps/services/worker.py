@@ -7,17 +7,21 @@
 
 import threading
 import abc
-import uuid
+import hashlib
+import importlib
+import json
 import time
+import uuid
 
 try:
     import queue
 except ImportError:
     import Queue as queue
-from datetime import datetime
+from datetime import datetime, timedelta
 from collections import namedtuple
 
 from cps import logger
+from . import task_store
 
 log = logger.create()
 
@@ -32,9 +36,24 @@ STAT_CANCELLED = 5
 # Only retain this many tasks in dequeued list
 TASK_CLEANUP_TRIGGER = 20
 
+# State a task is stored with in app.db once the worker is done with it
+STORED_STATES = {
+    STAT_FAIL: task_store.FAILED,
+    STAT_ENDED: task_store.ENDED,
+    STAT_CANCELLED: task_store.CANCELLED,
+}
+
 QueuedTask = namedtuple('QueuedTask', 'num, user, added, task, hidden')
 
 
+def covers(key, other_key):
+    """Whether a task with coalesce_key key does the work of one with other_key. Keys are (kind, entity) tuples,
+    an entity of None stands for every entity of that kind, e.g. the thumbnails of the whole library"""
+    if key is None or other_key is None or key[0] != other_key[0]:
+        return False
+    return key[1] is None or key[1] == other_key[1]
+
+
 def _get_main_thread():
     for t in threading.enumerate():
         if t.__class__.__name__ == '_MainThread':
@@ -52,8 +71,73 @@ class ImprovedQueue(queue.Queue):
             return list(self.queue)
 
 
-# Class for all worker tasks in the background
-class WorkerThread(threading.Thread):
+# Lanes of the worker pool. Every task runs in the lane named by its lane property, and each lane has its
+# own threads, so a library-wide thumbnail job no longer holds up a user's email or conversion
+LANE_CPU = "cpu"  # conversions, thumbnails
+LANE_IO = "io"  # mail, metadata backup, uploads and other housekeeping
+LANE_NETWORK = "network"  # metadata, GDrive, auto-send
+DEFAULT_LANE_THREADS = {LANE_CPU: 2, LANE_IO: 2, LANE_NETWORK: 2}
+MAX_LANE_THREADS = 8
+
+
+def get_lane_threads():
+    """Threads per lane, from the worker_<lane>_threads CWA settings"""
+    threads = dict(DEFAULT_LANE_THREADS)
+    try:
+        from cwa_db import CWA_DB
+        cwa_settings = CWA_DB().cwa_settings
+        for lane in threads:
+            threads[lane] = max(1, min(MAX_LANE_THREADS, int(cwa_settings.get(f"worker_{lane}_threads", threads[lane]))))
+    except Exception as ex:
+        log.debug("Using the default worker lane sizes: {}".format(ex))
+    return threads
+
+
+class WorkerLane:
+    def __init__(self, name, size):
+        self.name = name
+        self.size = size
+        self.queue = ImprovedQueue()
+        self.threads = list()
+
+    def get(self, worker, timeout):
+        """
+        Takes the oldest queued task whose serial_key isn't held by a running task, so tasks sharing a key
+        run one after the other in the order they were added while the other threads of the lane carry on.
+        While an exclusive task is queued, no lane starts anything else: it runs once every running task has
+        finished, and the lanes carry on after it. Raises queue.Empty if there is none within timeout.
+        """
+        deadline = time.monotonic() + timeout
+        with self.queue.not_empty:
+            while True:
+                with worker.keysLock:
+                    if worker.exclusive:
+                        item = worker.exclusive[0]
+                        if not worker.running and item in self.queue.queue:
+                            worker.running += 1
+                            self.queue.queue.remove(item)
+                            self.queue.not_full.notify()
+                            return item
+                    else:
+                        for item in self.queue.queue:
+                            key = item.task.serial_key
+                            if key is None or key not in worker.running_keys:
+                                if key is not None:
+                                    worker.running_keys.add(key)
+                                worker.running += 1
+                                self.queue.queue.remove(item)
+                                self.queue.not_full.notify()
+                                return item
+                # Tasks finishing don't notify the queue, so this also wakes up every second to check for
+                # keys that have been released
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise queue.Empty
+                self.queue.not_empty.wait(remaining)
+
+
+# Class for all worker tasks in the background, runs them on the threads of their lane
+class WorkerThread:
     _instance = None
 
     @classmethod
@@ -62,36 +146,193 @@ class WorkerThread(threading.Thread):
             cls._instance = WorkerThread()
         return cls._instance
 
-    def __init__(self):
-        threading.Thread.__init__(self)
-
+    def __init__(self, lane_threads=None):
         self.dequeued = list()
 
         self.doLock = threading.Lock()
-        self.queue = ImprovedQueue()
+        # Tasks added with a start time, as (not_before, QueuedTask). They are moved to their lane's queue once
+        # they are due, so the worker keeps running the other tasks while they wait
+        self.delayed = list()
         self.num = 0
-        self.start()
+        # serial_key of every task that is running right now
+        self.running_keys = set()
+        # Number of tasks running in all lanes, and the queued exclusive tasks in the order they were added
+        self.running = 0
+        self.exclusive = list()
+        self.keysLock = threading.Lock()
+        self.lanes = dict()
+        self.resize_lanes(lane_threads or get_lane_threads())
+
+    def resize_lanes(self, lane_threads):
+        """Starts or stops threads so every lane has the given number of them. Surplus threads finish the task
+        they are running first"""
+        with self.doLock:
+            for name, size in lane_threads.items():
+                lane = self.lanes.setdefault(name, WorkerLane(name, size))
+                lane.size = max(1, size)
+                while len(lane.threads) < lane.size:
+                    thread = threading.Thread(target=self.run, args=(lane,),
+                                              name="worker-{}-{}".format(name, len(lane.threads) + 1))
+                    lane.threads.append(thread)
+                    thread.start()
+
+    def lane_of(self, task):
+        lane = getattr(task, "lane", LANE_IO)
+        return self.lanes[lane] if lane in self.lanes else self.lanes[LANE_IO]
 
     @classmethod
-    def add(cls, user, task, hidden=False):
+    def add(cls, user, task, hidden=False, not_before=None, delay=None):
+        """Queues a task. With not_before (a datetime) or delay (seconds or a timedelta) the task is held
+        back until then, without blocking the tasks queued after it.
+        Returns the task that will do the work, which is a queued task if the new one was merged into it"""
         ins = cls.get_instance()
-        ins.num += 1
+        if delay is not None:
+            not_before = datetime.now() + (delay if isinstance(delay, timedelta) else timedelta(seconds=delay))
         username = user if user is not None else 'System'
         log.debug("Add Task for user: {} - {}".format(username, task))
-        ins.queue.put(QueuedTask(
-            num=ins.num,
-            user=username,
-            added=datetime.now(),
-            task=task,
-            hidden=hidden
-        ))
+        with ins.doLock:
+            ins.num += 1
+            item = QueuedTask(
+                num=ins.num,
+                user=username,
+                added=datetime.now(),
+                task=task,
+                hidden=hidden
+            )
+            merged_into, dropped = ins.coalesce(item) if not_before is None else (None, [])
+        for queued in dropped:
+            log.debug("Dropped queued task {}, {} does its work".format(queued.task, task))
+            if queued.task.persisted:
+                task_store.set_state(queued.task.id, task_store.CANCELLED, "Merged into a newer task")
+        if merged_into is not None:
+            log.debug("Merged task {} into queued task {}".format(task, merged_into.task))
+            return merged_into.task
+        ins.persist(item, not_before)
+        ins.enqueue(item, not_before)
+        return task
+
+    def coalesce(self, item):
+        """
+        Collapses duplicate work in the lane of a new task, using the coalesce_key of the tasks. Has to be called
+        with doLock held. Returns the waiting task the new one merges into, if there is one that covers it and
+        that no other task with the same serial_key was queued after. Otherwise the waiting tasks the new one
+        covers are taken out of the queue, as it will run after them anyway, and returned.
+        """
+        key = item.task.coalesce_key
+        if key is None:
+            return None, []
+        lane = self.lane_of(item.task)
+        serial_key = item.task.serial_key
+        with lane.queue.mutex:
+            waiting = [queued for queued in lane.queue.queue if queued.task.stat == STAT_WAITING]
+            for queued in reversed(waiting):
+                if not covers(queued.task.coalesce_key, key):
+                    continue
+                if serial_key is None or not any(later.num > queued.num and later.task.serial_key == serial_key
+                                                 for later in waiting):
+                    return queued, []
+            dropped = [queued for queued in waiting if covers(key, queued.task.coalesce_key)]
+            for queued in dropped:
+                lane.queue.queue.remove(queued)
+                lane.queue.unfinished_tasks -= 1
+                queued.task.stat = STAT_CANCELLED
+                if queued.task.exclusive:
+                    with self.keysLock:
+                        self.exclusive.remove(queued)
+        return None, dropped
+
+    def enqueue(self, item, not_before=None):
+        with self.doLock:
+            if not_before is not None and not_before > datetime.now():
+                item.task.not_before = not_before
+                self.delayed.append((not_before, item))
+                return
+        self.put(item)
+
+    def put(self, item):
+        """Puts the task into its lane's queue, an exclusive task holds back all lanes from now on"""
+        if item.task.exclusive:
+            with self.keysLock:
+                self.exclusive.append(item)
+        self.lane_of(item.task).queue.put(item)
+
+    def persist(self, item, not_before=None):
+        """Stores the task in app.db if it can be serialized, a scheduled task picks up the checkpoint of its
+        last unfinished run"""
+        task = item.task
+        try:
+            payload = task.serialize()
+            if payload is None:
+                return
+            # Lazy translated strings and similar are stored as text
+            payload = json.loads(json.dumps(payload, default=str))
+        except Exception as ex:
+            log.error("Could not serialize task {}: {}".format(task, ex))
+            return
+        task_type = "{}.{}".format(type(task).__module__, type(task).__qualname__)
+        resume_key = hashlib.sha1(json.dumps([task_type, payload], sort_keys=True).encode()).hexdigest()
+        if task.scheduled and task.checkpoint is None:
+            live_task_ids = [str(queued.task.id) for queued in self.tasks]
+            task.checkpoint = task_store.take_checkpoint(resume_key, live_task_ids)
+            if task.checkpoint is not None:
+                log.info("Resuming {} from its last checkpoint".format(task))
+        task.persisted = task_store.add(task.id, task_type, resume_key, item.user, item.hidden, task.scheduled,
+                                        payload, item.added, not_before, task.checkpoint)
+
+    @classmethod
+    def requeue_persisted_tasks(cls):
+        """Queues the tasks that were stored in app.db but hadn't finished when CWA stopped. Tasks that are
+        already queued are skipped, so calling this again does nothing"""
+        ins = cls.get_instance()
+        task_store.prune()
+        live_task_ids = [str(item.task.id) for item in ins.tasks]
+        task_store.end_interrupted_scheduled(live_task_ids)
+        requeued = 0
+        for entry in task_store.unfinished():
+            if entry["task_id"] in live_task_ids:
+                continue
+            try:
+                module_name, __, class_name = entry["task_type"].rpartition(".")
+                task_class = getattr(importlib.import_module(module_name), class_name)
+                if not issubclass(task_class, CalibreTask):
+                    raise TypeError("{} is not a task".format(entry["task_type"]))
+                task = task_class.deserialize(entry["payload"])
+            except Exception as ex:
+                log.error("Could not restore task {}: {}".format(entry["task_id"], ex))
+                task_store.set_state(entry["task_id"], task_store.FAILED, "Could not be restored: {}".format(ex))
+                continue
+            task.id = uuid.UUID(entry["task_id"])
+            task.checkpoint = entry["checkpoint"]
+            task.persisted = True
+            with ins.doLock:
+                ins.num += 1
+                item = QueuedTask(num=ins.num, user=entry["user"], added=entry["added"], task=task,
+                                  hidden=entry["hidden"])
+            task_store.set_state(task.id, task_store.QUEUED)
+            ins.enqueue(item, entry["not_before"])
+            requeued += 1
+        if requeued:
+            log.info("Queued {} unfinished task(s) again".format(requeued))
+        return requeued
 
     @property
     def tasks(self):
         with self.doLock:
-            tasks = self.queue.to_list() + self.dequeued
+            queued = [item for lane in self.lanes.values() for item in lane.queue.to_list()]
+            tasks = queued + [item for __, item in self.delayed] + self.dequeued
             return sorted(tasks, key=lambda x: x.num)
 
+    def release_due_tasks(self):
+        """Moves delayed tasks to their lane's queue once they are due, or straight away when they were cancelled"""
+        now = datetime.now()
+        with self.doLock:
+            due = [entry for entry in self.delayed if entry[0] <= now or entry[1].task.stat != STAT_WAITING]
+            if not due:
+                return
+            self.delayed = [entry for entry in self.delayed if entry not in due]
+            for __, item in sorted(due, key=lambda entry: (entry[0], entry[1].num)):
+                self.put(item)
+
     def cleanup_tasks(self):
         with self.doLock:
             dead = []
@@ -105,23 +346,29 @@ class WorkerThread(threading.Thread):
                 ret = alive
             else:
                 # otherwise, loop off the oldest dead tasks until we hit the target trigger
-                ret = sorted(dead, key=lambda y: y.task.end_time)[-TASK_CLEANUP_TRIGGER:] + alive
+                # (tasks cancelled before they started have no end_time)
+                ret = sorted(dead, key=lambda y: y.task.end_time or datetime.min)[-TASK_CLEANUP_TRIGGER:] + alive
 
             self.dequeued = sorted(ret, key=lambda y: y.num)
 
-    # Main thread loop starting the different tasks
-    def run(self):
+    # Loop of each lane thread, starting the tasks of its lane
+    def run(self, lane):
         main_thread = _get_main_thread()
         while main_thread.is_alive():
+            with self.doLock:
+                if len(lane.threads) > lane.size:
+                    # The lane was shrunk, this thread isn't needed anymore
+                    lane.threads.remove(threading.current_thread())
+                    return
+            self.release_due_tasks()
             try:
                 # this blocks until something is available. This can cause issues when the main thread dies - this
                 # thread will remain alive. We implement a timeout to unblock every second which allows us to check if
                 # the main thread is still alive.
                 # We don't use a daemon here because we don't want the tasks to just be abruptly halted, leading to
                 # possible file / database corruption
-                item = self.queue.get(timeout=1)
+                item = lane.get(self, timeout=1)
             except queue.Empty:
-                time.sleep(1)
                 continue
 
             with self.doLock:
@@ -134,14 +381,28 @@ class WorkerThread(threading.Thread):
 
             # sometimes tasks (like Upload) don't actually have work to do and are created as already finished
             if item.task.stat is STAT_WAITING:
+                if item.task.persisted:
+                    task_store.set_state(item.task.id, task_store.RUNNING)
                 # CalibreTask.start() should wrap all exceptions in its own error handling
                 item.task.start(self)
 
+            if item.task.persisted:
+                task_store.set_state(item.task.id, STORED_STATES.get(item.task.stat, task_store.DONE), item.task.error)
+
+            with self.keysLock:
+                self.running -= 1
+                if item.task.serial_key is not None:
+                    self.running_keys.discard(item.task.serial_key)
+                if item.task.exclusive:
+                    self.exclusive.remove(item)
+
             # remove self_cleanup tasks and hidden "System Tasks" from list
             if item.task.self_cleanup or item.hidden:
-                self.dequeued.remove(item)
+                with self.doLock:
+                    if item in self.dequeued:
+                        self.dequeued.remove(item)
 
-            self.queue.task_done()
+            lane.queue.task_done()
 
     def end_task(self, task_id):
         ins = self.get_instance()
@@ -163,6 +424,12 @@ class CalibreTask:
         self.id = uuid.uuid4()
         self.self_cleanup = False
         self._scheduled = False
+        # Set by WorkerThread.add when the task was added with a delay
+        self.not_before = None
+        # Where a restored or resumed task continues, see save_checkpoint()
+        self.checkpoint = None
+        # Whether the task is stored in app.db
+        self.persisted = False
 
     @abc.abstractmethod
     def run(self, worker_thread):
@@ -179,6 +446,22 @@ class CalibreTask:
         """Does this task gracefully handle being cancelled (STAT_ENDED, STAT_CANCELLED)?"""
         raise NotImplementedError
 
+    def serialize(self):
+        """Constructor arguments (a dict of JSON values) to re-create the task from when it has to be queued again
+        after a restart. None if the task isn't worth keeping"""
+        return None
+
+    @classmethod
+    def deserialize(cls, data):
+        return cls(**data)
+
+    def save_checkpoint(self, checkpoint):
+        """Stores how far the task got (a dict of JSON values). When the task is queued again after a restart,
+        or a scheduled run is ended before it was done, the next run finds it in self.checkpoint"""
+        self.checkpoint = checkpoint
+        if self.persisted:
+            task_store.set_checkpoint(self.id, checkpoint)
+
     def start(self, *args):
         self.start_time = datetime.now()
         self.stat = STAT_STARTED
@@ -239,6 +522,29 @@ class CalibreTask:
     def self_cleanup(self, is_self_cleanup):
         self._self_cleanup = is_self_cleanup
 
+    @property
+    def lane(self):
+        """Worker lane the task runs in, see LANE_CPU, LANE_IO and LANE_NETWORK"""
+        return LANE_IO
+
+    @property
+    def coalesce_key(self):
+        """(kind, entity) of the work this task does, e.g. ("cover_thumbnails", book_id). A new task merges into a
+        waiting task that covers the same work, see WorkerThread.coalesce(). None to never merge"""
+        return None
+
+    @property
+    def serial_key(self):
+        """Tasks with the same serial_key never run at the same time and start in the order they were added,
+        even in a lane with several threads. None to run alongside anything"""
+        return None
+
+    @property
+    def exclusive(self):
+        """An exclusive task waits until the tasks running in every lane have finished and nothing else starts
+        while it runs, e.g. for swapping the Calibre database connection the other tasks are using"""
+        return False
+
     @property
     def scheduled(self):
         return self._scheduled
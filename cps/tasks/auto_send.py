@@ -5,12 +5,11 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # See CONTRIBUTORS for full list of authors.
 
-import time
 from datetime import datetime
 
 from flask_babel import lazy_gettext as N_
 
-from cps.services.worker import CalibreTask, STAT_FINISH_SUCCESS
+from cps.services.worker import CalibreTask, STAT_FINISH_SUCCESS, LANE_NETWORK
 from cps import helper, ub, db, calibre_db, config, logger
 
 log = logger.create()
@@ -18,6 +17,8 @@ log = logger.create()
 
 class TaskAutoSend(CalibreTask):
     def __init__(self, task_message, book_id, user_id, delay_minutes=5):
+        """delay_minutes is informational, pass it to WorkerThread.add(..., delay=) to hold the task back
+        while metadata fetching finishes"""
         super(TaskAutoSend, self).__init__(task_message)
         self.start_time = self.end_time = datetime.now()
         self.book_id = book_id
@@ -26,16 +27,18 @@ class TaskAutoSend(CalibreTask):
         self.book_title = ""
         self.progress = 0
 
+    def serialize(self):
+        return {"task_message": self.message, "book_id": self.book_id, "user_id": self.user_id,
+                "delay_minutes": self.delay_minutes}
+
     def run(self, worker_thread):
         """Auto-send newly ingested book to user's eReader addresses"""
         self.worker_thread = worker_thread
         
         try:
-            # Wait for specified delay to allow metadata fetching to complete
-            if self.delay_minutes > 0:
-                self.message = N_("Waiting for metadata processing...")
-                time.sleep(self.delay_minutes * 60)
-            
+            # The delay that lets metadata fetching finish first is handled by WorkerThread, which holds
+            # this task back without blocking the tasks queued after it
+
             # Get fresh book data
             calibre_db_instance = db.CalibreDB(expire_on_commit=False, init=True)
             book = calibre_db_instance.get_book(self.book_id)
@@ -108,3 +111,7 @@ class TaskAutoSend(CalibreTask):
     @property
     def is_cancellable(self):
         return True
+
+    @property
+    def lane(self):
+        return LANE_NETWORK
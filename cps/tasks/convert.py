@@ -16,7 +16,7 @@ from uuid import uuid4
 from sqlalchemy.exc import SQLAlchemyError
 from flask_babel import lazy_gettext as N_
 
-from cps.services.worker import CalibreTask
+from cps.services.worker import CalibreTask, LANE_CPU
 from cps import db
 from cps import logger, config
 from cps.subproc_wrapper import process_open
@@ -48,6 +48,18 @@ class TaskConvert(CalibreTask):
 
         self.results = dict()
 
+    def serialize(self):
+        # Mail server settings are read from the config again when the task is restored
+        return {"file_path": self.file_path, "book_id": self.book_id, "task_message": self.message,
+                "settings": {k: v for k, v in self.settings.items() if not k.startswith('mail_')},
+                "ereader_mail": self.ereader_mail, "user": self.user}
+
+    @classmethod
+    def deserialize(cls, data):
+        if data.get("ereader_mail"):
+            data["settings"].update(config.get_mail_settings())
+        return cls(**data)
+
     def run(self, worker_thread):
         self.worker_thread = worker_thread
         if config.config_use_google_drive:
@@ -338,3 +350,7 @@ class TaskConvert(CalibreTask):
     @property
     def is_cancellable(self):
         return False
+
+    @property
+    def lane(self):
+        return LANE_CPU
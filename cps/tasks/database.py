@@ -29,3 +29,8 @@ class TaskReconnectDatabase(CalibreTask):
     @property
     def is_cancellable(self):
         return False
+
+    @property
+    def exclusive(self):
+        # reconnect_db() disposes the sessions and custom column tables of the running tasks
+        return True
@@ -111,6 +111,15 @@ class TaskEmail(CalibreTask):
         self.book_id = id
         self.results = dict()
 
+    def serialize(self):
+        # Mail server settings are read from the config again when the task is restored
+        return {"subject": self.subject, "filepath": self.filepath, "attachment": self.attachment,
+                "recipient": self.recipient, "task_message": self.message, "text": self.text, "id": self.book_id}
+
+    @classmethod
+    def deserialize(cls, data):
+        return cls(settings=config.get_mail_settings(), **data)
+
     # from calibre code:
     # https://github.com/kovidgoyal/calibre/blob/731ccd92a99868de3e2738f65949f19768d9104c/src/calibre/utils/smtp.py#L60
     def get_msgid_domain(self):
@@ -28,6 +28,10 @@ class TaskBackupMetadata(CalibreTask):
         self.translated_title = translated_title
         self.set_dirty = set_dirty
 
+    def serialize(self):
+        return {"export_language": self.export_language, "translated_title": self.translated_title,
+                "set_dirty": self.set_dirty, "task_message": self.message}
+
     def run(self, worker_thread):
         if self.set_dirty:
             self.set_all_books_dirty()
@@ -115,3 +119,7 @@ class TaskBackupMetadata(CalibreTask):
     @property
     def is_cancellable(self):
         return True
+
+    @property
+    def coalesce_key(self):
+        return ("queue_metadata_backup" if self.set_dirty else "metadata_backup"), None
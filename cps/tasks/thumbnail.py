@@ -5,22 +5,20 @@
 # SPDX-License-Identifier: GPL-3.0-or-later
 # See CONTRIBUTORS for full list of authors.
 
+import multiprocessing
 import os
+from collections import deque, namedtuple
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
 from shutil import copyfile, copyfileobj
-from urllib.request import urlopen
-from io import BytesIO
 from datetime import datetime, timezone
 
 from .. import constants
-from cps import config, db, fs, gdriveutils, logger, ub
-from cps.services.worker import CalibreTask, STAT_CANCELLED, STAT_ENDED
-from sqlalchemy import func, text, or_
+from cps import config, db, fs, gdriveutils, imaging, logger, ub
+from cps.services import thumbnail_index
+from cps.services.worker import CalibreTask, STAT_CANCELLED, STAT_ENDED, LANE_CPU
+from sqlalchemy import exists, func, text, or_
 from flask_babel import lazy_gettext as N_
-try:
-    from wand.image import Image
-    use_IM = True
-except (ImportError, RuntimeError) as e:
-    use_IM = False
 
 
 def get_resize_height(resolution):
@@ -34,6 +32,44 @@ def get_resize_width(resolution, original_width, original_height):
     return width if width % 2 == 0 else width + 1
 
 
+# Library-wide thumbnail tasks save a checkpoint after this many books or series
+CHECKPOINT_INTERVAL = 25
+
+# Every cover thumbnail is written as WebP (web UI) and JPEG (Kobo and other devices)
+THUMBNAIL_FORMATS = ['webp', 'jpg']
+
+# Library-wide runs over at least this many books render the thumbnails in a pool of processes, one per CPU
+PROCESS_POOL_MIN_BOOKS = 50
+# The parent commits the thumbnail rows of this many books at a time
+THUMBNAIL_COMMIT_BATCH = 50
+
+# Thumbnails to add, write again and remove for one book, see TaskGenerateCoverThumbnails.plan_book_cover_thumbnails
+ThumbnailPlan = namedtuple('ThumbnailPlan', 'book_id, new_thumbnails, outdated, obsolete, obsolete_files')
+
+
+def thumbnail_processes():
+    try:
+        return len(os.sched_getaffinity(0))
+    except AttributeError:
+        return os.cpu_count() or 1
+
+
+def init_thumbnail_process():
+    """Pool initializer, every process gets one image backend thread so the pool doesn't oversubscribe the CPUs"""
+    imaging.backend.init_process()
+
+
+def open_cover(targets, filename=None, blob=None):
+    """Decodes a cover for write_cover_thumbnails(), at a reduced size if the largest target allows it"""
+    return imaging.backend.open(filename=filename, blob=blob, height=get_resize_height(max(targets)))
+
+
+def render_cover_thumbnails(cover_path, targets):
+    """Runs in a pool process: writes the thumbnail files of one book, see write_cover_thumbnails()"""
+    with open_cover(targets, filename=cover_path) as img:
+        write_cover_thumbnails(img, targets)
+
+
 def get_best_fit(width, height, image_width, image_height):
     resize_width = int(width / 2.0)
     resize_height = int(height / 2.0)
@@ -52,11 +88,36 @@ def get_best_fit(width, height, image_width, image_height):
     return {'width': resize_width, 'height': resize_height}
 
 
+def series_cover_books(series_books):
+    """The books whose covers make up a series thumbnail, the last four by series index"""
+    return sorted(series_books, key=lambda b: float(b.series_index), reverse=True)[:4]
+
+
+def write_cover_thumbnails(img, targets):
+    """
+    Writes the thumbnails of one decoded cover. targets maps a resolution to the (format, filename) pairs to write
+    at that size. Resolutions are written from large to small, each one downscaled from the one before instead of
+    from the full cover. img is an imaging.BackendImage and is resized in place.
+    """
+    for resolution in sorted(targets, reverse=True):
+        height = get_resize_height(resolution)
+        if img.height > height:
+            width = get_resize_width(resolution, img.width, img.height)
+            img.resize(width, height)
+        for fmt, filename in targets[resolution]:
+            img.save(filename, fmt, 82)
+
+
 class TaskGenerateCoverThumbnails(CalibreTask):
-    def __init__(self, book_id=-1, task_message=''):
+    def __init__(self, book_id=-1, task_message='', verify=False):
         super(TaskGenerateCoverThumbnails, self).__init__(task_message)
         self.log = logger.create()
         self.book_id = book_id
+        # Library-wide runs only visit books changed since the last complete run and books without thumbnails,
+        # unless verify is set, which checks the thumbnails of every book
+        self.verify = verify
+        self.scan_started = None
+        self.oldest_failure = None
         self.app_db_session = ub.get_new_session_instance()
         self.cache = fs.FileSystem()
         self.resolutions = [
@@ -65,33 +126,26 @@ class TaskGenerateCoverThumbnails(CalibreTask):
             constants.COVER_THUMBNAIL_LARGE
         ]
 
+    def serialize(self):
+        return {"book_id": self.book_id, "task_message": self.message, "verify": self.verify}
+
     def run(self, worker_thread):
-        if use_IM and self.stat != STAT_CANCELLED and self.stat != STAT_ENDED:
+        if imaging.backend and self.stat != STAT_CANCELLED and self.stat != STAT_ENDED:
             self.message = 'Scanning Books'
-            books_with_covers = self.get_books_with_covers(self.book_id)
-            count = len(books_with_covers)
-
-            total_generated = 0
-            for i, book in enumerate(books_with_covers):
-
-                # Generate new thumbnails for missing covers
-                generated = self.create_book_cover_thumbnails(book)
-
-                # Increment the progress
-                self.progress = (1.0 / count) * i
-
-                if generated > 0:
-                    total_generated += generated
-                    self.message = N_('Generated %(count)s cover thumbnails', count=total_generated)
-
-                # Check if job has been cancelled or ended
-                if self.stat == STAT_CANCELLED:
-                    self.log.info(f'GenerateCoverThumbnails task has been cancelled.')
-                    return
-
-                if self.stat == STAT_ENDED:
-                    self.log.info(f'GenerateCoverThumbnails task has been ended.')
-                    return
+            books_with_covers = self.get_books_to_scan()
+            # Books are handled by id, so a restored or resumed run can skip the ones done before
+            if self.checkpoint:
+                books_with_covers = [book for book in books_with_covers if book.id > self.checkpoint["book_id"]]
+
+            if (self.book_id == -1 and not config.config_use_google_drive and thumbnail_processes() > 1
+                    and len(books_with_covers) >= PROCESS_POOL_MIN_BOOKS):
+                total_generated, stopped = self.generate_in_processes(books_with_covers)
+            else:
+                total_generated, stopped = self.generate_in_thread(books_with_covers)
+            if stopped:
+                return
+            if self.book_id == -1:
+                self.save_watermark()
 
             if total_generated == 0:
                 self.self_cleanup = True
@@ -99,14 +153,234 @@ class TaskGenerateCoverThumbnails(CalibreTask):
         self._handleSuccess()
         self.app_db_session.remove()
 
+    def get_books_to_scan(self):
+        if self.book_id != -1:
+            return self.get_books_with_covers(self.book_id)
+        # A resumed run keeps the start of the run it continues, books changed since then are left for the next one
+        if self.checkpoint and self.checkpoint.get("scan_started"):
+            self.scan_started = datetime.fromisoformat(self.checkpoint["scan_started"])
+        else:
+            self.scan_started = self.get_last_modified()
+        watermark = None if self.verify else self.get_watermark()
+        if watermark is None:
+            return self.get_books_with_covers()
+        return self.get_changed_books_with_covers(watermark)
+
+    def get_watermark(self):
+        watermark = (self.app_db_session.query(ub.ThumbnailWatermark)
+                     .filter(ub.ThumbnailWatermark.type == constants.THUMBNAIL_TYPE_COVER)
+                     .one_or_none())
+        return watermark.last_modified if watermark else None
+
+    def save_watermark(self):
+        """Moves the watermark to the start of this run, or to the oldest book that failed, so it's tried again"""
+        last_modified = self.scan_started
+        if self.oldest_failure is not None and (last_modified is None or self.oldest_failure < last_modified):
+            last_modified = self.oldest_failure
+        if last_modified is None:
+            return
+        try:
+            watermark = (self.app_db_session.query(ub.ThumbnailWatermark)
+                         .filter(ub.ThumbnailWatermark.type == constants.THUMBNAIL_TYPE_COVER)
+                         .one_or_none())
+            if watermark is None:
+                watermark = ub.ThumbnailWatermark(type=constants.THUMBNAIL_TYPE_COVER)
+                self.app_db_session.add(watermark)
+            watermark.last_modified = last_modified
+            watermark.updated = datetime.now(timezone.utc)
+            self.app_db_session.commit()
+        except Exception as ex:
+            self.log.error(f'Error saving the cover thumbnail watermark: {ex}')
+            self.app_db_session.rollback()
+
+    def book_failed(self, book):
+        last_modified = book.last_modified.replace(tzinfo=None)
+        if self.oldest_failure is None or last_modified < self.oldest_failure:
+            self.oldest_failure = last_modified
+
+    def save_scan_checkpoint(self, book_id):
+        checkpoint = {"book_id": book_id}
+        if self.scan_started is not None:
+            checkpoint["scan_started"] = self.scan_started.isoformat()
+        self.save_checkpoint(checkpoint)
+
+    def stopped(self):
+        """Checks if the job has been cancelled or ended"""
+        if self.stat == STAT_CANCELLED:
+            self.log.info(f'GenerateCoverThumbnails task has been cancelled.')
+            return True
+        if self.stat == STAT_ENDED:
+            self.log.info(f'GenerateCoverThumbnails task has been ended.')
+            return True
+        return False
+
+    def generate_in_thread(self, books):
+        """Brings the thumbnails of the books up to date one after the other. Returns the number of thumbnails
+        written and whether the task was cancelled or ended"""
+        count = len(books)
+        total_generated = 0
+        for i, book in enumerate(books):
+
+            # Generate new thumbnails for missing covers
+            generated = self.create_book_cover_thumbnails(book)
+
+            # Increment the progress
+            self.progress = (1.0 / count) * i
+
+            if generated > 0:
+                total_generated += generated
+                self.message = N_('Generated %(count)s cover thumbnails', count=total_generated)
+
+            stopped = self.stat in (STAT_CANCELLED, STAT_ENDED)
+            if self.book_id == -1 and (stopped or (i + 1) % CHECKPOINT_INTERVAL == 0):
+                self.save_scan_checkpoint(book.id)
+
+            if self.stopped():
+                return total_generated, True
+        return total_generated, False
+
+    def generate_in_processes(self, books):
+        """
+        Library-wide run that renders the thumbnails in a pool of processes, one per CPU. This thread plans the
+        work of each book, hands the rendering to the pool and writes the thumbnail rows of the finished books in
+        batches, as it's the only one using app.db. Returns like generate_in_thread().
+        """
+        count = len(books)
+        total_generated = 0
+        processed = 0
+        in_flight = dict()
+        # Book ids in the order they were handed out and the ones finished since, the checkpoint is the last book
+        # before the first unfinished one
+        handed_out = deque()
+        finished = set()
+        batch = list()
+        stopped = False
+        books_left = iter(books)
+        workers = thumbnail_processes()
+        pool = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=init_thumbnail_process)
+        try:
+            while True:
+                # Keep every process busy without planning the whole library up front
+                while not stopped and len(in_flight) < 2 * workers:
+                    book = next(books_left, None)
+                    if book is None:
+                        break
+                    handed_out.append(book.id)
+                    plan = self.plan_book_cover_thumbnails(book)
+                    if plan is None:
+                        finished.add(book.id)
+                        processed += 1
+                        continue
+                    try:
+                        cover_path = self.local_cover_path(book)
+                        targets = self.thumbnail_targets(plan.new_thumbnails + plan.outdated)
+                    except Exception as ex:
+                        self.log.debug(f'Error creating thumbnails for book {book.id}: {ex}')
+                        self._handleError(f'Error creating book thumbnails: {ex}')
+                        self.book_failed(book)
+                        finished.add(book.id)
+                        processed += 1
+                        continue
+                    in_flight[pool.submit(render_cover_thumbnails, cover_path, targets)] = (book, plan)
+                if not in_flight:
+                    break
+
+                done, __ = wait(in_flight, timeout=1, return_when=FIRST_COMPLETED)
+                for future in done:
+                    book, plan = in_flight.pop(future)
+                    # A crashed process breaks the whole pool, its book is left for the fallback below
+                    if isinstance(future.exception(), BrokenProcessPool):
+                        raise future.exception()
+                    finished.add(book.id)
+                    processed += 1
+                    if future.exception():
+                        ex = future.exception()
+                        self.log.debug(f'Error creating thumbnails for book {book.id}: {ex}')
+                        self._handleError(f'Error creating book thumbnails: {ex}')
+                        self.book_failed(book)
+                    else:
+                        batch.append(plan)
+                        total_generated += len(plan.new_thumbnails) + len(plan.outdated)
+
+                self.progress = (1.0 / count) * processed
+                if total_generated:
+                    self.message = N_('Generated %(count)s cover thumbnails', count=total_generated)
+                if len(batch) >= THUMBNAIL_COMMIT_BATCH:
+                    self.commit_thumbnail_plans(batch, handed_out, finished)
+
+                if not stopped and self.stopped():
+                    # Drop the books that haven't started, the ones being rendered are still saved
+                    stopped = True
+                    for future in list(in_flight):
+                        if future.cancel():
+                            in_flight.pop(future)
+        except BrokenProcessPool as ex:
+            self.log.error(f'Thumbnail process pool failed, continuing in this thread: {ex}')
+            self.commit_thumbnail_plans(batch, handed_out, finished)
+            remaining = [book for book in books if book.id not in finished]
+            generated, stopped = self.generate_in_thread(remaining)
+            return total_generated + generated, stopped
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+
+        self.commit_thumbnail_plans(batch, handed_out, finished)
+        return total_generated, stopped
+
+    def commit_thumbnail_plans(self, plans, handed_out, finished):
+        """Writes the thumbnail rows of books whose files the pool has written and saves the checkpoint"""
+        if plans:
+            try:
+                for plan in plans:
+                    self.apply_thumbnail_plan(plan)
+                self.app_db_session.commit()
+            except Exception as ex:
+                self.log.debug(f'Error saving book thumbnails: {ex}')
+                self._handleError(f'Error saving book thumbnails: {ex}')
+                self.app_db_session.rollback()
+            else:
+                for plan in plans:
+                    thumbnail_index.invalidate(constants.THUMBNAIL_TYPE_COVER, plan.book_id)
+                    self.delete_obsolete_files(plan)
+            plans.clear()
+
+        last_done = None
+        while handed_out and handed_out[0] in finished:
+            last_done = handed_out.popleft()
+            finished.discard(last_done)
+        if last_done is not None:
+            self.save_scan_checkpoint(last_done)
+
     @staticmethod
     def get_books_with_covers(book_id=-1):
         filter_exp = (db.Books.id == book_id) if book_id != -1 else True
         calibre_db = db.CalibreDB(expire_on_commit=False, init=True)
-        books_cover = calibre_db.session.query(db.Books).filter(db.Books.has_cover == 1).filter(filter_exp).all()
+        books_cover = (calibre_db.session.query(db.Books).filter(db.Books.has_cover == 1).filter(filter_exp)
+                       .order_by(db.Books.id).all())
+        calibre_db.session.close()
+        return books_cover
+
+    @staticmethod
+    def get_changed_books_with_covers(watermark):
+        """Books with a cover changed since the watermark and books without any cover thumbnail"""
+        has_thumbnails = (exists().where(ub.Thumbnail.entity_id == db.Books.id)
+                          .where(ub.Thumbnail.type == constants.THUMBNAIL_TYPE_COVER))
+        calibre_db = db.CalibreDB(expire_on_commit=False, init=True)
+        books_cover = (calibre_db.session.query(db.Books).filter(db.Books.has_cover == 1)
+                       .filter(or_(db.Books.last_modified >= watermark, ~has_thumbnails))
+                       .order_by(db.Books.id).all())
         calibre_db.session.close()
         return books_cover
 
+    @staticmethod
+    def get_last_modified():
+        calibre_db = db.CalibreDB(expire_on_commit=False, init=True)
+        last_modified = calibre_db.session.query(func.max(db.Books.last_modified)).scalar()
+        calibre_db.session.close()
+        if isinstance(last_modified, str):
+            last_modified = datetime.fromisoformat(last_modified)
+        return last_modified.replace(tzinfo=None) if last_modified else None
+
     def get_book_cover_thumbnails(self, book_id):
         return self.app_db_session \
             .query(ub.Thumbnail) \
@@ -115,168 +389,123 @@ class TaskGenerateCoverThumbnails(CalibreTask):
             .filter(or_(ub.Thumbnail.expiration.is_(None), ub.Thumbnail.expiration > datetime.now(timezone.utc))) \
             .all()
 
-    def create_book_cover_thumbnails(self, book):
-        generated = 0
+    def plan_book_cover_thumbnails(self, book):
+        """Works out which thumbnails of one book have to be written, returns a ThumbnailPlan or None if they are
+        all up to date"""
         book_cover_thumbnails = self.get_book_cover_thumbnails(book.id)
 
-        # Build a map: (resolution, format) -> thumbnail
-        thumb_map = {}
-        for t in book_cover_thumbnails:
-            thumb_map[(t.resolution, t.format.lower())] = t
+        # Thumbnails with legacy uuid names or an old format are replaced by ones with deterministic names
+        obsolete = [t for t in book_cover_thumbnails
+                    if not (t.filename.startswith('book_') or t.filename.startswith('series_'))
+                    or t.format.lower() not in THUMBNAIL_FORMATS]
+        thumb_map = {(t.resolution, t.format.lower()): t for t in book_cover_thumbnails if t not in obsolete}
 
-        # For each resolution and format, check if thumbnail exists and file is present
-        formats = ['webp', 'jpg']
+        # Missing thumbnails (no row or no file) get a new row, outdated ones are written again
+        outdated = []
+        new_thumbnails = []
         for resolution in self.resolutions:
-            for fmt in formats:
+            for fmt in THUMBNAIL_FORMATS:
                 thumb = thumb_map.get((resolution, fmt))
-                file_missing = True
-                if thumb:
-                    file_missing = not self.cache.get_cache_file_exists(thumb.filename, constants.CACHE_TYPE_THUMBNAILS)
-                if not thumb or file_missing:
-                    generated += 1
-                    self.create_book_cover_single_thumbnail_format(book, resolution, fmt)
-
-        # Replace outdated, legacy, or format-mismatch thumbnails
-        for thumbnail in book_cover_thumbnails:
+                if not thumb:
+                    new_thumbnails.append(self.new_book_cover_thumbnail(book, resolution, fmt))
+                elif not self.cache.get_cache_file_exists(thumb.filename, constants.CACHE_TYPE_THUMBNAILS):
+                    outdated.append(thumb)
+        for thumb in thumb_map.values():
+            if thumb not in outdated and book.last_modified.replace(tzinfo=None) > thumb.generated_at:
+                outdated.append(thumb)
+
+        if not new_thumbnails and not outdated and not obsolete:
+            return None
+        # An old 'jpeg' row can share its filename with the 'jpg' thumbnail that replaces it
+        written = {thumb.filename for thumb in new_thumbnails + outdated}
+        obsolete_files = [thumb.filename for thumb in obsolete if thumb.filename not in written]
+        return ThumbnailPlan(book.id, new_thumbnails, outdated, obsolete, obsolete_files)
+
+    def apply_thumbnail_plan(self, plan):
+        """Adds the rows of a plan whose files have been written to the session, without committing"""
+        now = datetime.now(timezone.utc)
+        for thumb in plan.outdated:
+            thumb.generated_at = now
+        for thumb in plan.new_thumbnails:
+            self.app_db_session.add(thumb)
+        for thumb in plan.obsolete:
+            self.app_db_session.delete(thumb)
+
+    def delete_obsolete_files(self, plan):
+        for filename in plan.obsolete_files:
             try:
-                legacy_naming = not (thumbnail.filename.startswith('book_') or thumbnail.filename.startswith('series_'))
-                wrong_format = thumbnail.format.lower() not in formats
-                source_newer = book.last_modified.replace(tzinfo=None) > thumbnail.generated_at
-
-                # If any legacy condition matched, migrate: delete old file & regenerate with deterministic name
-                if legacy_naming or wrong_format:
-                    old_id = thumbnail.id
-                    old_filename = thumbnail.filename
-                    self.app_db_session.delete(thumbnail)
-                    self.app_db_session.commit()
-                    # Regenerate both formats for this resolution
-                    for fmt in formats:
-                        self.create_book_cover_single_thumbnail_format(book, thumbnail.resolution, fmt)
-                    # remove old file if still present
-                    try:
-                        self.cache.delete_cache_file(old_filename, constants.CACHE_TYPE_THUMBNAILS)
-                    except Exception:
-                        pass
-                    generated += 1
-                    continue
-
-                if source_newer:
-                    generated += 1
-                    self.update_book_cover_thumbnail(book, thumbnail)
-            except Exception as ex:
-                self.log.debug(f"Thumbnail migration/update issue for book {book.id}: {ex}")
-        return generated
-
-    def create_book_cover_single_thumbnail_format(self, book, resolution, fmt):
-        thumbnail = ub.Thumbnail()
-        thumbnail.type = constants.THUMBNAIL_TYPE_COVER
-        thumbnail.entity_id = book.id
-        thumbnail.format = fmt
-        thumbnail.resolution = resolution
-
-        self.app_db_session.add(thumbnail)
-        try:
-            self.app_db_session.commit()
-            self.generate_book_thumbnail(book, thumbnail)
-        except Exception as ex:
-            self.log.debug(f'Error creating {fmt.upper()} book thumbnail: ' + str(ex))
-            self._handleError(f'Error creating {fmt.upper()} book thumbnail: ' + str(ex))
-            self.app_db_session.rollback()
-
-    def create_book_cover_single_thumbnail(self, book, resolution):
-        # Generate WebP thumbnail (for web UI)
-        thumbnail_webp = ub.Thumbnail()
-        thumbnail_webp.type = constants.THUMBNAIL_TYPE_COVER
-        thumbnail_webp.entity_id = book.id
-        thumbnail_webp.format = 'webp'
-        thumbnail_webp.resolution = resolution
+                self.cache.delete_cache_file(filename, constants.CACHE_TYPE_THUMBNAILS)
+            except Exception:
+                pass
 
-        self.app_db_session.add(thumbnail_webp)
+    def create_book_cover_thumbnails(self, book):
+        """Brings the thumbnails of one book up to date. The cover is decoded once for all the thumbnails that
+        have to be written and the thumbnail rows are committed together. Returns how many were written"""
+        plan = self.plan_book_cover_thumbnails(book)
+        if plan is None:
+            return 0
         try:
+            # The files are written before touching app.db, which keeps the write transaction short
+            self.generate_book_thumbnails(book, plan.new_thumbnails + plan.outdated)
+            self.apply_thumbnail_plan(plan)
             self.app_db_session.commit()
-            self.generate_book_thumbnail(book, thumbnail_webp)
         except Exception as ex:
-            self.log.debug('Error creating WebP book thumbnail: ' + str(ex))
-            self._handleError('Error creating WebP book thumbnail: ' + str(ex))
+            self.log.debug(f'Error creating thumbnails for book {book.id}: {ex}')
+            self._handleError(f'Error creating book thumbnails: {ex}')
             self.app_db_session.rollback()
+            self.book_failed(book)
+            return 0
 
-        # Generate JPEG thumbnail (for Kobo/devices)
-        thumbnail_jpg = ub.Thumbnail()
-        thumbnail_jpg.type = constants.THUMBNAIL_TYPE_COVER
-        thumbnail_jpg.entity_id = book.id
-        thumbnail_jpg.format = 'jpg'
-        thumbnail_jpg.resolution = resolution
+        thumbnail_index.invalidate(constants.THUMBNAIL_TYPE_COVER, book.id)
+        self.delete_obsolete_files(plan)
+        return len(plan.new_thumbnails) + len(plan.outdated)
 
-        self.app_db_session.add(thumbnail_jpg)
-        try:
-            self.app_db_session.commit()
-            self.generate_book_thumbnail(book, thumbnail_jpg)
-        except Exception as ex:
-            self.log.debug('Error creating JPEG book thumbnail: ' + str(ex))
-            self._handleError('Error creating JPEG book thumbnail: ' + str(ex))
-            self.app_db_session.rollback()
+    @staticmethod
+    def new_book_cover_thumbnail(book, resolution, fmt):
+        thumbnail = ub.Thumbnail()
+        thumbnail.type = constants.THUMBNAIL_TYPE_COVER
+        thumbnail.entity_id = book.id
+        thumbnail.format = fmt
+        thumbnail.resolution = resolution
+        thumbnail.filename = ub.thumbnail_filename(thumbnail.type, book.id, resolution, fmt)
+        return thumbnail
 
-    def update_book_cover_thumbnail(self, book, thumbnail):
-        thumbnail.generated_at = datetime.now(timezone.utc)
+    def thumbnail_targets(self, thumbnails):
+        """Files to write for the given thumbnail rows, in the form write_cover_thumbnails() takes"""
+        targets = dict()
+        for thumbnail in thumbnails:
+            filename = self.cache.get_cache_file_path(thumbnail.filename, constants.CACHE_TYPE_THUMBNAILS)
+            targets.setdefault(thumbnail.resolution, []).append((thumbnail.format, filename))
+        return targets
 
-        try:
-            self.app_db_session.commit()
-            self.cache.delete_cache_file(thumbnail.filename, constants.CACHE_TYPE_THUMBNAILS)
-            self.generate_book_thumbnail(book, thumbnail)
-        except Exception as ex:
-            self.log.debug('Error updating book thumbnail: ' + str(ex))
-            self._handleError('Error updating book thumbnail: ' + str(ex))
-            self.app_db_session.rollback()
+    @staticmethod
+    def local_cover_path(book):
+        book_cover_filepath = os.path.join(config.get_book_path(), book.path, 'cover.jpg')
+        if not os.path.isfile(book_cover_filepath):
+            raise Exception('Book cover file not found')
+        return book_cover_filepath
+
+    def generate_book_thumbnails(self, book, thumbnails):
+        """Writes the files of the given thumbnail rows of one book from a single decode of its cover"""
+        if not book or not thumbnails:
+            return
+        targets = self.thumbnail_targets(thumbnails)
+
+        if config.config_use_google_drive:
+            if not gdriveutils.is_gdrive_ready():
+                raise Exception('Google Drive is configured but not ready')
+
+            content = gdriveutils.get_cover_via_gdrive(book.path)
+            if not content:
+                raise Exception('Google Drive cover url not found')
+            with open_cover(targets, blob=content) as img:
+                write_cover_thumbnails(img, targets)
+        else:
+            with open_cover(targets, filename=self.local_cover_path(book)) as img:
+                write_cover_thumbnails(img, targets)
 
     def generate_book_thumbnail(self, book, thumbnail):
-        if book and thumbnail:
-            if config.config_use_google_drive:
-                if not gdriveutils.is_gdrive_ready():
-                    raise Exception('Google Drive is configured but not ready')
-
-                content = gdriveutils.get_cover_via_gdrive(book.path)
-                if not content:
-                    raise Exception('Google Drive cover url not found')
-                try:
-                    stream = BytesIO(content)
-                    with Image(file=stream) as img:
-                        filename = self.cache.get_cache_file_path(thumbnail.filename,
-                                                                  constants.CACHE_TYPE_THUMBNAILS)
-                        height = get_resize_height(thumbnail.resolution)
-                        if img.height > height:
-                            width = get_resize_width(thumbnail.resolution, img.width, img.height)
-                            img.resize(width=width, height=height, filter='lanczos')
-                        # Set format for thumbnail
-                        img.format = thumbnail.format
-                        try:
-                            img.compression_quality = 82
-                        except Exception:
-                            pass
-                        img.save(filename=filename)
-                except Exception as ex:
-                    self.log.debug('Error generating thumbnail file: ' + str(ex))
-                    raise ex
-                finally:
-                    if stream is not None:
-                        stream.close()
-            else:
-                book_cover_filepath = os.path.join(config.get_book_path(), book.path, 'cover.jpg')
-                if not os.path.isfile(book_cover_filepath):
-                    raise Exception('Book cover file not found')
-
-                with Image(filename=book_cover_filepath) as img:
-                    height = get_resize_height(thumbnail.resolution)
-                    filename = self.cache.get_cache_file_path(thumbnail.filename, constants.CACHE_TYPE_THUMBNAILS)
-                    if img.height > height:
-                        width = get_resize_width(thumbnail.resolution, img.width, img.height)
-                        img.resize(width=width, height=height, filter='lanczos')
-                    # Set format for thumbnail
-                    img.format = thumbnail.format
-                    try:
-                        img.compression_quality = 82
-                    except Exception:
-                        pass
-                    img.save(filename=filename)
+        self.generate_book_thumbnails(book, [thumbnail])
 
     @property
     def name(self):
@@ -285,6 +514,8 @@ class TaskGenerateCoverThumbnails(CalibreTask):
     def __str__(self):
         if self.book_id > 0:
             return "Add Cover Thumbnails for Book {}".format(self.book_id)
+        elif self.verify:
+            return "Verify Cover Thumbnails"
         else:
             return "Generate Cover Thumbnails"
 
@@ -292,6 +523,21 @@ class TaskGenerateCoverThumbnails(CalibreTask):
     def is_cancellable(self):
         return True
 
+    @property
+    def lane(self):
+        return LANE_CPU
+
+    @property
+    def serial_key(self):
+        return "thumbnails"
+
+    @property
+    def coalesce_key(self):
+        # An incremental run doesn't do the work of a verify or of a single book, which might not have changed
+        if self.book_id == -1 and not self.verify:
+            return "cover_thumbnail_scan", None
+        return "cover_thumbnails", None if self.book_id == -1 else self.book_id
+
 
 class TaskGenerateSeriesThumbnails(CalibreTask):
     def __init__(self, task_message=''):
@@ -305,42 +551,54 @@ class TaskGenerateSeriesThumbnails(CalibreTask):
             constants.COVER_THUMBNAIL_MEDIUM,
         ]
 
+    def serialize(self):
+        return {"task_message": self.message}
+
     def run(self, worker_thread):
-        if self.calibre_db.session and use_IM and self.stat != STAT_CANCELLED and self.stat != STAT_ENDED:
+        if self.calibre_db.session and imaging.backend and self.stat != STAT_CANCELLED and self.stat != STAT_ENDED:
             self.message = 'Scanning Series'
             all_series = self.get_series_with_four_plus_books()
+            # Series are handled by id, so a restored or resumed run can skip the ones done before
+            if self.checkpoint:
+                all_series = [series for series in all_series if series.id > self.checkpoint["series_id"]]
             count = len(all_series)
 
             total_generated = 0
             for i, series in enumerate(all_series):
                 generated = 0
                 series_thumbnails = self.get_series_thumbnails(series.id)
-                series_books = self.get_series_books(series.id)
+                books = series_cover_books(self.get_series_books(series.id))
+                source = self.get_series_source(books)
 
                 # Generate new thumbnails for missing covers
                 resolutions = list(map(lambda t: t.resolution, series_thumbnails))
                 missing_resolutions = list(set(self.resolutions).difference(resolutions))
                 for resolution in missing_resolutions:
                     generated += 1
-                    self.create_series_thumbnail(series, series_books, resolution)
+                    self.create_series_thumbnail(series, books, resolution, source)
 
-                # Replace outdated or missing thumbnails
+                # Replace thumbnails whose books or covers changed, and missing ones. Other changes to the books
+                # (metadata edits) don't touch the thumbnail
                 for thumbnail in series_thumbnails:
-                    if any(book.last_modified > thumbnail.generated_at for book in series_books):
+                    if thumbnail.source != source:
                         generated += 1
-                        self.update_series_thumbnail(series_books, thumbnail)
+                        self.update_series_thumbnail(books, thumbnail, source)
 
                     elif not self.cache.get_cache_file_exists(thumbnail.filename, constants.CACHE_TYPE_THUMBNAILS):
                         generated += 1
-                        self.update_series_thumbnail(series_books, thumbnail)
+                        self.update_series_thumbnail(books, thumbnail, source)
 
                 # Increment the progress
                 self.progress = (1.0 / count) * i
 
                 if generated > 0:
+                    thumbnail_index.invalidate(constants.THUMBNAIL_TYPE_SERIES, series.id)
                     total_generated += generated
                     self.message = N_('Generated {0} series thumbnails').format(total_generated)
 
+                if self.stat in (STAT_CANCELLED, STAT_ENDED) or (i + 1) % CHECKPOINT_INTERVAL == 0:
+                    self.save_checkpoint({"series_id": series.id})
+
                 # Check if job has been cancelled or ended
                 if self.stat == STAT_CANCELLED:
                     self.log.info(f'GenerateSeriesThumbnails task has been cancelled.')
@@ -364,6 +622,7 @@ class TaskGenerateSeriesThumbnails(CalibreTask):
             .filter(db.Books.has_cover == 1) \
             .group_by(text('books_series_link.series')) \
             .having(func.count('book_series_link') > 3) \
+            .order_by(db.Series.id) \
             .all()
 
     def get_series_books(self, series_id):
@@ -383,98 +642,114 @@ class TaskGenerateSeriesThumbnails(CalibreTask):
             .filter(or_(ub.Thumbnail.expiration.is_(None), ub.Thumbnail.expiration > datetime.now(timezone.utc)))
             .all())
 
-    def create_series_thumbnail(self, series, series_books, resolution):
+    @staticmethod
+    def get_cover_version(book):
+        """Changes whenever the cover of the book changes: the mtime of cover.jpg, or last_modified if that can't
+        be read"""
+        if not config.config_use_google_drive:
+            try:
+                return int(os.stat(os.path.join(config.get_book_path(), book.path, 'cover.jpg')).st_mtime)
+            except OSError:
+                pass
+        return int(book.last_modified.timestamp())
+
+    def get_series_source(self, books):
+        """Ids and cover versions of the books composed into a series thumbnail, stored with it to tell whether it
+        has to be written again"""
+        return ','.join('{}:{}'.format(book.id, self.get_cover_version(book)) for book in books)
+
+    def get_cover_thumbnail_paths(self, books, resolution):
+        """Maps the id of a book to the cached cover thumbnail to compose it from. A quarter of a series thumbnail
+        is half its height, so a book thumbnail of at least half the resolution is used, the smallest one that's
+        newer than the book. Books without such a thumbnail are left out"""
+        thumbnails = (self.app_db_session
+                      .query(ub.Thumbnail)
+                      .filter(ub.Thumbnail.type == constants.THUMBNAIL_TYPE_COVER)
+                      .filter(ub.Thumbnail.entity_id.in_([book.id for book in books]))
+                      .filter(ub.Thumbnail.resolution * 2 >= resolution)
+                      .filter(ub.Thumbnail.format.in_(THUMBNAIL_FORMATS))
+                      .order_by(ub.Thumbnail.resolution, ub.Thumbnail.id)
+                      .all())
+        paths = dict()
+        for book in books:
+            last_modified = book.last_modified.replace(tzinfo=None)
+            for thumb in thumbnails:
+                if thumb.entity_id != book.id or thumb.generated_at < last_modified:
+                    continue
+                if self.cache.get_cache_file_exists(thumb.filename, constants.CACHE_TYPE_THUMBNAILS):
+                    paths[book.id] = self.cache.get_cache_file_path(thumb.filename, constants.CACHE_TYPE_THUMBNAILS)
+                    break
+        return paths
+
+    def create_series_thumbnail(self, series, books, resolution, source):
         thumbnail = ub.Thumbnail()
         thumbnail.type = constants.THUMBNAIL_TYPE_SERIES
         thumbnail.entity_id = series.id
         # Store series thumbnails as WebP as well
         thumbnail.format = 'webp'
         thumbnail.resolution = resolution
+        thumbnail.source = source
 
         self.app_db_session.add(thumbnail)
         try:
             self.app_db_session.commit()
-            self.generate_series_thumbnail(series_books, thumbnail)
+            self.generate_series_thumbnail(books, thumbnail)
         except Exception as ex:
             self.log.debug('Error creating book thumbnail: ' + str(ex))
             self._handleError('Error creating book thumbnail: ' + str(ex))
             self.app_db_session.rollback()
 
-    def update_series_thumbnail(self, series_books, thumbnail):
+    def update_series_thumbnail(self, books, thumbnail, source):
         thumbnail.generated_at = datetime.now(timezone.utc)
+        thumbnail.source = source
 
         try:
             self.app_db_session.commit()
             self.cache.delete_cache_file(thumbnail.filename, constants.CACHE_TYPE_THUMBNAILS)
-            self.generate_series_thumbnail(series_books, thumbnail)
+            self.generate_series_thumbnail(books, thumbnail)
         except Exception as ex:
             self.log.debug('Error updating book thumbnail: ' + str(ex))
             self._handleError('Error updating book thumbnail: ' + str(ex))
             self.app_db_session.rollback()
 
-    def generate_series_thumbnail(self, series_books, thumbnail):
-        # Get the last four books in the series based on series_index
-        books = sorted(series_books, key=lambda b: float(b.series_index), reverse=True)[:4]
+    def open_series_cover(self, book, thumbnail_path, height):
+        """Decodes the cached thumbnail of a book, or its original cover if there is none"""
+        if thumbnail_path:
+            return imaging.backend.open(filename=thumbnail_path)
+        if config.config_use_google_drive:
+            if not gdriveutils.is_gdrive_ready():
+                raise Exception('Google Drive is configured but not ready')
+
+            content = gdriveutils.get_cover_via_gdrive(book.path)
+            if not content:
+                raise Exception('Google Drive cover url not found')
+            return imaging.backend.open(blob=content, height=height)
+        return imaging.backend.open(filename=TaskGenerateCoverThumbnails.local_cover_path(book), height=height)
+
+    def generate_series_thumbnail(self, books, thumbnail):
+        thumbnail_paths = self.get_cover_thumbnail_paths(books, thumbnail.resolution)
 
         top = 0
         left = 0
         width = 0
         height = 0
-        with Image() as canvas:
+        canvas = None
+        try:
             for book in books:
-                if config.config_use_google_drive:
-                    if not gdriveutils.is_gdrive_ready():
-                        raise Exception('Google Drive is configured but not ready')
-
-                    web_content_link = gdriveutils.get_cover_via_gdrive(book.path)
-                    if not web_content_link:
-                        raise Exception('Google Drive cover url not found')
-
-                    stream = None
-                    try:
-                        stream = urlopen(web_content_link)
-                        with Image(file=stream) as img:
-                            # Use the first image in this set to determine the width and height to scale the
-                            # other images in this set
-                            if width == 0 or height == 0:
-                                width = get_resize_width(thumbnail.resolution, img.width, img.height)
-                                height = get_resize_height(thumbnail.resolution)
-                                canvas.blank(width, height)
-
-                            dimensions = get_best_fit(width, height, img.width, img.height)
-
-                            # resize and crop the image
-                            img.resize(width=int(dimensions['width']), height=int(dimensions['height']),
-                                       filter='lanczos')
-                            img.crop(width=int(width / 2.0), height=int(height / 2.0), gravity='center')
-
-                            # add the image to the canvas
-                            canvas.composite(img, left, top)
-
-                    except Exception as ex:
-                        self.log.debug('Error generating thumbnail file: ' + str(ex))
-                        raise ex
-                    finally:
-                        if stream is not None:
-                            stream.close()
-
-                book_cover_filepath = os.path.join(config.get_book_path(), book.path, 'cover.jpg')
-                if not os.path.isfile(book_cover_filepath):
-                    raise Exception('Book cover file not found')
-
-                with Image(filename=book_cover_filepath) as img:
+                with self.open_series_cover(book, thumbnail_paths.get(book.id),
+                                            get_resize_height(thumbnail.resolution)) as img:
                     # Use the first image in this set to determine the width and height to scale the
                     # other images in this set
-                    if width == 0 or height == 0:
+                    if canvas is None:
                         width = get_resize_width(thumbnail.resolution, img.width, img.height)
                         height = get_resize_height(thumbnail.resolution)
-                        canvas.blank(width, height)
+                        canvas = imaging.backend.blank(width, height)
 
                     dimensions = get_best_fit(width, height, img.width, img.height)
 
                     # resize and crop the image
-                    img.resize(width=int(dimensions['width']), height=int(dimensions['height']), filter='lanczos')
-                    img.crop(width=int(width / 2.0), height=int(height / 2.0), gravity='center')
+                    img.resize(dimensions['width'], dimensions['height'])
+                    img.crop_center(width / 2.0, height / 2.0)
 
                     # add the image to the canvas
                     canvas.composite(img, left, top)
@@ -488,13 +763,11 @@ class TaskGenerateSeriesThumbnails(CalibreTask):
                 else:
                     left = int(width / 2.0)
 
-            canvas.format = thumbnail.format
             filename = self.cache.get_cache_file_path(thumbnail.filename, constants.CACHE_TYPE_THUMBNAILS)
-            try:
-                canvas.compression_quality = 80
-            except Exception:
-                pass
-            canvas.save(filename=filename)
+            canvas.save(filename, thumbnail.format, 80)
+        finally:
+            if canvas is not None:
+                canvas.close()
 
     @property
     def name(self):
@@ -507,6 +780,18 @@ class TaskGenerateSeriesThumbnails(CalibreTask):
     def is_cancellable(self):
         return True
 
+    @property
+    def lane(self):
+        return LANE_CPU
+
+    @property
+    def serial_key(self):
+        return "thumbnails"
+
+    @property
+    def coalesce_key(self):
+        return "series_thumbnails", None
+
 
 class TaskClearCoverThumbnailCache(CalibreTask):
     def __init__(self, book_id, task_message=N_('Clearing cover thumbnail cache')):
@@ -516,6 +801,9 @@ class TaskClearCoverThumbnailCache(CalibreTask):
         self.app_db_session = ub.get_new_session_instance()
         self.cache = fs.FileSystem()
 
+    def serialize(self):
+        return {"book_id": self.book_id, "task_message": self.message}
+
     def run(self, worker_thread):
         if self.app_db_session:
             if self.book_id == 0:  # delete superfluous thumbnails
@@ -551,6 +839,7 @@ class TaskClearCoverThumbnailCache(CalibreTask):
                 .filter(ub.Thumbnail.entity_id == thumbnail.entity_id) \
                 .delete()
             self.app_db_session.commit()
+            thumbnail_index.invalidate(constants.THUMBNAIL_TYPE_COVER, thumbnail.entity_id)
         except Exception as ex:
             self.log.debug('Error deleting book thumbnail: ' + str(ex))
             self._handleError('Error deleting book thumbnail: ' + str(ex))
@@ -559,6 +848,7 @@ class TaskClearCoverThumbnailCache(CalibreTask):
         try:
             self.app_db_session.query(ub.Thumbnail).filter(ub.Thumbnail.type == constants.THUMBNAIL_TYPE_COVER).delete()
             self.app_db_session.commit()
+            thumbnail_index.invalidate(constants.THUMBNAIL_TYPE_COVER)
             self.cache.delete_cache_dir(constants.CACHE_TYPE_THUMBNAILS)
         except Exception as ex:
             self.log.debug('Error deleting thumbnail directory: ' + str(ex))
@@ -578,3 +868,17 @@ class TaskClearCoverThumbnailCache(CalibreTask):
     @property
     def is_cancellable(self):
         return False
+
+    @property
+    def lane(self):
+        return LANE_CPU
+
+    @property
+    def serial_key(self):
+        return "thumbnails"
+
+    @property
+    def coalesce_key(self):
+        if self.book_id == 0:
+            return "superfluous_cover_thumbnails", None
+        return "clear_cover_thumbnails", None if self.book_id < 0 else self.book_id
@@ -6,8 +6,14 @@
 # See CONTRIBUTORS for full list of authors.
 
 import os
+import re
 import shutil
-from .. import logger, ub, fs, config_sql
+
+from flask_babel import lazy_gettext as N_
+
+from .. import logger, ub, fs
+from ..services import thumbnail_index
+from ..services.worker import CalibreTask, WorkerThread, STAT_CANCELLED, STAT_ENDED
 from ..constants import CACHE_TYPE_THUMBNAILS
 
 log = logger.create()
@@ -15,50 +21,58 @@ log = logger.create()
 MIGRATION_VERSION_KEY = "thumbnail_flat_structure_migration"
 MIGRATION_VERSION = "v1.0"
 
+# Thumbnails moved into their shard between two refreshes of the thumbnail index
+INDEX_REFRESH_INTERVAL = 1000
+
+# Thumbnails of the old layout were named after a uuid4, e.g. 3f2b...-...-....jpg
+LEGACY_THUMBNAIL_NAME = re.compile(r'^[0-9a-f]{8}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{4}-[0-9a-f]{12}\.\w+$', re.I)
+
+
+def get_migration_marker_path():
+    # Stored next to the thumbnails, outside of the cache dir so it isn't moved into a shard or cleared with it
+    return os.path.join(fs.CONFIG_DIR, '.' + MIGRATION_VERSION_KEY)
+
+
 def get_migration_status():
     """Check if the thumbnail migration has already been completed."""
     try:
-        session = ub.get_new_session_instance()
-        try:
-            # Check if migration marker exists in settings
-            setting = session.query(ub.Settings).filter(
-                ub.Settings.mail_server == MIGRATION_VERSION_KEY
-            ).first()
-            return setting.mail_server_type == MIGRATION_VERSION if setting else False
-        finally:
-            session.close()
-    except Exception:
+        with open(get_migration_marker_path()) as marker:
+            return marker.read().strip() == MIGRATION_VERSION
+    except OSError:
         return False
 
+
 def set_migration_completed():
     """Mark the thumbnail migration as completed."""
     try:
-        session = ub.get_new_session_instance()
-        try:
-            # Store migration marker in settings table
-            setting = session.query(ub.Settings).filter(
-                ub.Settings.mail_server == MIGRATION_VERSION_KEY
-            ).first()
-            
-            if not setting:
-                setting = ub.Settings()
-                setting.mail_server = MIGRATION_VERSION_KEY
-                session.add(setting)
-            
-            setting.mail_server_type = MIGRATION_VERSION
-            session.commit()
-        except Exception as ex:
-            log.error(f"Failed to mark migration as completed: {ex}")
-            session.rollback()
-        finally:
-            session.close()
-    except Exception as ex:
-        log.error(f"Failed to access database for migration marker: {ex}")
+        with open(get_migration_marker_path(), 'w') as marker:
+            marker.write(MIGRATION_VERSION)
+    except OSError as ex:
+        log.error(f"Failed to mark migration as completed: {ex}")
+
+
+def is_legacy_subdir(path):
+    """Subdirectories of the old uuid based layout hold thumbnails named after their uuid, the shards of the
+    current layout only hold a second level of directories. Any other file found in a shard is left alone"""
+    try:
+        with os.scandir(path) as entries:
+            return any(entry.is_file() and LEGACY_THUMBNAIL_NAME.match(entry.name) for entry in entries)
+    except OSError:
+        return False
+
+
+def has_flat_thumbnails(thumbnails_dir):
+    try:
+        with os.scandir(thumbnails_dir) as entries:
+            return any(entry.is_file() for entry in entries)
+    except OSError:
+        return False
+
 
 def migrate_thumbnail_structure():
     """
-    One-time migration for existing CWA installations to move from
-    subdirectory-based thumbnail storage to flat directory structure.
+    Migration for existing CWA installations, which stored their thumbnails
+    in subdirectories named after the first two characters of a uuid.
     
     This will:
     1. Clear all existing thumbnail database entries
@@ -76,15 +90,17 @@ def migrate_thumbnail_structure():
         if os.path.exists(thumbnails_dir):
             for item in os.listdir(thumbnails_dir):
                 item_path = os.path.join(thumbnails_dir, item)
-                # Look for hex subdirectories (00, 01, ..., ff, bo, etc.)
+                # Look for hex subdirectories (00, 01, ..., ff, bo, etc.) that aren't shards
                 if (os.path.isdir(item_path) and 
                     len(item) == 2 and 
-                    item not in ['.', '..']):
+                    item not in ['.', '..'] and
+                    is_legacy_subdir(item_path)):
                     subdirs_found.append(item)
                     migration_needed = True
         
         if not migration_needed:
             log.info("Thumbnail migration: No old subdirectories found, skipping migration")
+            set_migration_completed()
             return
             
         log.info(f"Thumbnail migration: Found {len(subdirs_found)} old subdirectories, starting migration")
@@ -94,6 +110,7 @@ def migrate_thumbnail_structure():
         try:
             deleted_count = session.query(ub.Thumbnail).delete()
             session.commit()
+            thumbnail_index.invalidate()
             log.info(f"Thumbnail migration: Cleared {deleted_count} old database entries")
         except Exception as ex:
             log.error(f"Thumbnail migration: Failed to clear database entries: {ex}")
@@ -122,8 +139,6 @@ def migrate_thumbnail_structure():
         
         log.info(f"Thumbnail migration: Removed {files_removed} old files and {dirs_removed} subdirectories")
         log.info("Thumbnail migration: Complete. Thumbnails will be regenerated automatically as needed.")
-        
-        # Mark migration as completed
         set_migration_completed()
         
     except Exception as ex:
@@ -135,11 +150,76 @@ def check_and_migrate_thumbnails():
     This should be called during application startup.
     """
     try:
-        # Skip if already migrated
         if get_migration_status():
             log.debug("Thumbnail migration: Already completed, skipping")
-            return
-            
-        migrate_thumbnail_structure()
+        else:
+            migrate_thumbnail_structure()
+
+        # Thumbnails stored directly in the cache dir are moved into their shards in the background
+        if has_flat_thumbnails(fs.FileSystem().get_cache_dir(CACHE_TYPE_THUMBNAILS)):
+            WorkerThread.add(None, TaskShardThumbnailCache())
     except Exception as ex:
-        log.error(f"Thumbnail migration check failed: {ex}")
\ No newline at end of file
+        log.error(f"Thumbnail migration check failed: {ex}")
+
+
+class TaskShardThumbnailCache(CalibreTask):
+    """
+    Moves the thumbnails stored directly in the cache dir into the two level shards of fs.thumbnail_shard().
+    Thumbnails already moved are gone from the cache dir, so an interrupted run simply continues with the rest
+    when it's queued again on the next start. Until then fs.FileSystem moves a thumbnail into its shard as soon
+    as it's asked for.
+    """
+    def __init__(self, task_message=N_('Moving thumbnails into subdirectories')):
+        super(TaskShardThumbnailCache, self).__init__(task_message)
+        self.log = logger.create()
+        self.cache = fs.FileSystem()
+
+    def serialize(self):
+        return {"task_message": self.message}
+
+    def run(self, worker_thread):
+        thumbnails_dir = self.cache.get_cache_dir(CACHE_TYPE_THUMBNAILS)
+        try:
+            with os.scandir(thumbnails_dir) as entries:
+                filenames = [entry.name for entry in entries if entry.is_file()]
+        except OSError as ex:
+            self._handleError(f'Error reading the thumbnail cache: {ex}')
+            return
+
+        count = len(filenames)
+        moved = 0
+        for i, filename in enumerate(filenames):
+            try:
+                if self.cache.move_flat_thumbnail(filename):
+                    moved += 1
+            except OSError as ex:
+                self.log.debug(f'Error moving thumbnail {filename}: {ex}')
+            if (i + 1) % INDEX_REFRESH_INTERVAL == 0:
+                # Indexed thumbnails still point to the cache dir
+                thumbnail_index.invalidate()
+                self.progress = (1.0 / count) * i
+                self.message = N_('Moved %(count)s thumbnails into subdirectories', count=moved)
+
+            if self.stat in (STAT_CANCELLED, STAT_ENDED):
+                thumbnail_index.invalidate()
+                self.log.info(f'ShardThumbnailCache task has been stopped after moving {moved} thumbnails.')
+                return
+
+        thumbnail_index.invalidate()
+        self.log.info(f'Thumbnail migration: Moved {moved} thumbnails into subdirectories')
+        self._handleSuccess()
+
+    @property
+    def name(self):
+        return N_('Cover Thumbnails')
+
+    def __str__(self):
+        return "Move Thumbnails into Subdirectories"
+
+    @property
+    def is_cancellable(self):
+        return True
+
+    @property
+    def coalesce_key(self):
+        return "shard_thumbnail_cache", None
@@ -49,7 +49,9 @@ def render_task_status(tasklist):
 
             # localize the task status
             if isinstance(task.stat, int):
-                if task.stat == STAT_WAITING:
+                if task.stat == STAT_WAITING and task.not_before:
+                    ret['status'] = _('Scheduled for %(time)s', time=format_datetime(task.not_before, format='short'))
+                elif task.stat == STAT_WAITING:
                     ret['status'] = _('Waiting')
                 elif task.stat == STAT_FAIL:
                     ret['status'] = _('Failed')
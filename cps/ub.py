@@ -580,12 +580,12 @@ def filename(context):
     to reason about and purge selectively.
     """
     params = context.get_current_parameters()
-    file_format = params.get('format', 'jpeg')
-    entity_id = params.get('entity_id')
-    resolution = params.get('resolution')
-    thumb_type = params.get('type')  # cover or series
-    uuid_val = params.get('uuid')
+    return thumbnail_filename(params.get('type'), params.get('entity_id'), params.get('resolution'),
+                              params.get('format', 'jpeg'), params.get('uuid'))
 
+
+def thumbnail_filename(thumb_type, entity_id, resolution, file_format='jpeg', uuid_val=None):
+    """Filename of a thumbnail, see filename()"""
     # map format 'jpeg' -> extension jpg
     if file_format == 'jpeg':
         ext = 'jpg'
@@ -618,6 +618,40 @@ class Thumbnail(Base):
     filename = Column(String, default=filename)
     generated_at = Column(DateTime, default=lambda: datetime.now(timezone.utc))
     expiration = Column(DateTime, nullable=True)
+    # Series thumbnails: ids and cover versions of the books composed into it
+    source = Column(String, nullable=True)
+
+
+# Newest Books.last_modified covered by the last complete library-wide thumbnail run of a type, the next run only
+# visits books changed since then and books without thumbnails
+class ThumbnailWatermark(Base):
+    __tablename__ = 'thumbnail_watermark'
+
+    id = Column(Integer, primary_key=True)
+    type = Column(SmallInteger, unique=True)
+    last_modified = Column(DateTime)
+    updated = Column(DateTime, default=lambda: datetime.now(timezone.utc))
+
+
+# Background task queued in the WorkerThread, kept so unfinished tasks can be queued again after a restart
+# (see services/task_store.py)
+class TaskQueue(Base):
+    __tablename__ = 'task_queue'
+
+    id = Column(Integer, primary_key=True)
+    task_id = Column(String, unique=True)
+    task_type = Column(String)
+    resume_key = Column(String)
+    user = Column(String)
+    hidden = Column(Boolean, default=False)
+    scheduled = Column(Boolean, default=False)
+    payload = Column(JSON(none_as_null=True), nullable=True)
+    checkpoint = Column(JSON(none_as_null=True), nullable=True)
+    state = Column(String, default='queued')
+    error = Column(String, nullable=True)
+    added = Column(DateTime)
+    not_before = Column(DateTime, nullable=True)
+    finished = Column(DateTime, nullable=True)
 
 
 # Add missing tables during migration of database
@@ -628,6 +662,10 @@ def add_missing_tables(engine, _session):
         Thumbnail.__table__.create(bind=engine)
     if not engine.dialect.has_table(engine.connect(), "kosync_progress"):
         KOSyncProgress.__table__.create(bind=engine)
+    if not engine.dialect.has_table(engine.connect(), "task_queue"):
+        TaskQueue.__table__.create(bind=engine)
+    if not engine.dialect.has_table(engine.connect(), "thumbnail_watermark"):
+        ThumbnailWatermark.__table__.create(bind=engine)
 
 
 # migrate all settings missing in registration table
@@ -656,6 +694,19 @@ def migrate_user_session_table(engine, _session):
             conn.execute(text("ALTER TABLE user_session ADD column 'expiry' Integer"))
             trans.commit()
 
+
+def migrate_thumbnail_table(engine, _session):
+    try:
+        _session.query(exists().where(Thumbnail.source)).scalar()
+        _session.commit()
+    except exc.OperationalError:  # Database is not compatible, some columns are missing
+        _session.rollback()
+        with engine.connect() as conn:
+            trans = conn.begin()
+            conn.execute(text("ALTER TABLE thumbnail ADD column 'source' String"))
+            trans.commit()
+
+
 def migrate_user_table(engine, _session):
     try:
         _session.query(exists().where(User.hardcover_token)).scalar()
@@ -794,6 +845,7 @@ def migrate_Database(_session):
     add_missing_tables(engine, _session)
     migrate_registration_table(engine, _session)
     migrate_user_session_table(engine, _session)
+    migrate_thumbnail_table(engine, _session)
     migrate_user_table(engine, _session)
     migrate_oauth_provider_table(engine, _session)
     migrate_config_table(engine, _session)
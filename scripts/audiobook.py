@@ -8,16 +8,23 @@
 
 import base64
 import os
+import sys
 from collections import namedtuple
 
 import mutagen
 
 try:
-    from wand.image import Image
-
-    use_IM = True
-except (ImportError, RuntimeError) as e:
-    use_IM = False
+    from cps import imaging
+except ModuleNotFoundError:
+    # Add project root (parent of scripts/) to sys.path and retry
+    project_root = os.path.abspath(os.path.join(os.path.dirname(os.path.abspath(__file__)), ".."))
+    if project_root not in sys.path:
+        sys.path.insert(0, project_root)
+    try:
+        from cps import imaging
+    except Exception:
+        # Without cps covers are only kept if they are JPEGs already
+        imaging = None
 
 BookMeta = namedtuple(
     "BookMeta",
@@ -33,11 +40,9 @@ def cover_processing(tmp_file_path, img, extension):
     # tmp_cover_name = os.path.join(os.path.dirname(tmp_file_name), 'cover.jpg')
     tmp_cover_name = tmp_file_path + ".jpg"
     if extension in NO_JPEG_EXTENSIONS:
-        if use_IM:
-            with Image(blob=img) as imgc:
-                imgc.format = "jpeg"
-                imgc.transform_colorspace("srgb")
-                imgc.save(filename=tmp_cover_name)
+        if imaging is not None and imaging.backend:
+            with imaging.backend.open(blob=img) as imgc:
+                imgc.save(tmp_cover_name, "jpg", 92)
                 return tmp_cover_name
         else:
             return None
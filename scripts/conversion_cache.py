@@ -0,0 +1,161 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+On-disk cache of conversion results, so a file that comes back through ingest (a retry from
+/config/processed_books/failed, a re-imported library) or convert-library doesn't go through
+ebook-convert/kepubify again.
+
+Entries are keyed by the BLAKE2b hash of the source file (see hash_index.py), the target format, the
+version of every converter involved and a fingerprint of the calibre conversion defaults and plugins
+under $HOME/.config/calibre, so upgrading calibre or changing its conversion settings misses the
+cache instead of serving stale output. The files live under CACHE_DIR and are tracked in the
+cwa_conversion_cache table of cwa.db, which is also used to evict the least recently used entries
+once the cache grows past conversion_cache_size_mb. Hits and misses are logged with each conversion
+in cwa_conversions.
+
+Cached files are only ever reflinked or copied out of the cache, never hardlinked, as the
+kindle-epub-fixer rewrites converted EPUBs in place.
+"""
+
+import functools
+import hashlib
+import json
+import os
+import subprocess
+
+from file_placement import place_file
+
+CACHE_DIR = "/config/conversion_cache"
+
+
+@functools.lru_cache(maxsize=None)
+def converter_version(command: str) -> str | None:
+    """First line of `command --version`, e.g. "ebook-convert (calibre 8.5.0)". None if it can't be run"""
+    try:
+        result = subprocess.run([command, "--version"], capture_output=True, text=True, timeout=60)
+        lines = (result.stdout or result.stderr).strip().splitlines()
+        return lines[0] if result.returncode == 0 and lines else None
+    except (OSError, subprocess.SubprocessError):
+        return None
+
+
+def settings_fingerprint(home: str) -> str:
+    """Hash of the calibre conversion defaults (small .py files, hashed by content) and the installed
+    plugins (hashed by name, size and mtime) that ebook-convert picks up from home"""
+    digest = hashlib.blake2b(digest_size=16)
+    conversion_dir = os.path.join(home, ".config", "calibre", "conversion")
+    plugins_dir = os.path.join(home, ".config", "calibre", "plugins")
+    for folder, by_content in ((conversion_dir, True), (plugins_dir, False)):
+        try:
+            names = sorted(os.listdir(folder))
+        except OSError:
+            continue
+        for name in names:
+            path = os.path.join(folder, name)
+            try:
+                if by_content:
+                    with open(path, 'rb') as f:
+                        digest.update(name.encode() + f.read())
+                else:
+                    stat = os.stat(path)
+                    digest.update(f"{name}:{stat.st_size}:{stat.st_mtime_ns}".encode())
+            except OSError:
+                continue
+    return digest.hexdigest()
+
+
+class ConversionCache:
+    def __init__(self, db, max_size_mb: int, cache_dir: str = CACHE_DIR, log_prefix: str = "[conversion-cache]"):
+        self.db = db
+        self.max_bytes = max(0, int(max_size_mb or 0)) * 1024 * 1024
+        self.cache_dir = cache_dir
+        self.log_prefix = log_prefix
+
+
+    @property
+    def enabled(self) -> bool:
+        return self.max_bytes > 0
+
+
+    def make_key(self, source_hash: str | None, target_format: str, converters: list[str], env: dict | None = None) -> str | None:
+        """Cache key for converting the file with this content hash to target_format with the given converter
+        commands. None (don't use the cache) when it's disabled or a converter's version can't be determined"""
+        if not self.enabled or not source_hash:
+            return None
+        versions = [converter_version(command) for command in converters]
+        if None in versions:
+            return None
+        home = (env or os.environ).get("HOME", "")
+        key_data = json.dumps([source_hash, target_format.lower(), versions, settings_fingerprint(home)])
+        return hashlib.blake2b(key_data.encode(), digest_size=32).hexdigest()
+
+
+    def entry_path(self, key: str, target_format: str) -> str:
+        return os.path.join(self.cache_dir, key[:2], f"{key}.{target_format.lower()}")
+
+
+    def fetch(self, key: str | None, dest: str) -> bool:
+        """Places the cached result for key at dest. Returns False on a miss"""
+        if key is None:
+            return False
+        entry = self.db.conversion_cache_lookup(key)
+        if entry is None:
+            return False
+        path, size = entry
+        try:
+            if os.path.getsize(path) != size:
+                raise OSError(f"size of {path} doesn't match the cache index")
+            place_file(path, dest)
+            return True
+        except OSError as e:
+            print(f"{self.log_prefix} WARN: Dropping unusable conversion cache entry {key}: {e}", flush=True)
+            self.remove(key, path)
+            return False
+
+
+    def store(self, key: str | None, converted_path: str) -> None:
+        """Adds a converted file to the cache, then evicts the least recently used entries while the cache
+        is over its size limit. Never raises, a failed store only costs the next conversion"""
+        if key is None:
+            return
+        try:
+            size = os.path.getsize(converted_path)
+            if size == 0 or size > self.max_bytes:
+                return
+            path = self.entry_path(key, os.path.splitext(converted_path)[1][1:])
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Copy under a temporary name so a concurrent fetch never sees a partial file
+            tmp_path = f"{path}.tmp-{os.getpid()}"
+            place_file(converted_path, tmp_path)
+            os.replace(tmp_path, path)
+            self.db.conversion_cache_add(key, path, size)
+            self.evict()
+        except Exception as e:
+            print(f"{self.log_prefix} WARN: Could not add {os.path.basename(converted_path)} to the conversion cache: {e}", flush=True)
+
+
+    def evict(self) -> int:
+        """Removes least recently used entries until the cache fits in max_bytes. Returns how many were removed"""
+        total = self.db.conversion_cache_total_size()
+        removed = 0
+        if total <= self.max_bytes:
+            return removed
+        for key, path, size in self.db.conversion_cache_lru():
+            if total <= self.max_bytes:
+                break
+            self.remove(key, path)
+            total -= size
+            removed += 1
+        return removed
+
+
+    def remove(self, key: str, path: str) -> None:
+        self.db.conversion_cache_remove(key)
+        try:
+            os.remove(path)
+        except OSError:
+            pass
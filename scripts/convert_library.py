@@ -23,6 +23,10 @@ import grp
 
 from cwa_db import CWA_DB
 from kindle_epub_fixer import EPUBFixer
+import library_permissions
+from file_placement import place_file
+from conversion_cache import ConversionCache
+import hash_index
 
 ### Global Variables
 convert_library_log_file = "/config/convert-library.log"
@@ -121,6 +125,7 @@ class LibraryConverter:
             print_and_log(f"[convert-library]: Ignoring formats: {', '.join(self.convert_ignored_formats)}")
             
         self.kindle_epub_fixer = self.cwa_settings['kindle_epub_fixer']
+        self.conversion_cache = ConversionCache(self.db, self.cwa_settings.get('conversion_cache_size_mb', 0), log_prefix="[convert-library]")
 
         self.supported_book_formats = {'acsm', 'azw', 'azw3', 'azw4', 'cbz', 'cbr', 'cb7', 'cbc', 'chm', 'djvu', 'docx', 'epub', 'fb2', 'fbz', 'html', 'htmlz', 'lit', 'lrf', 'mobi', 'odt', 'pdf', 'prc', 'pdb', 'pml', 'rb', 'rtf', 'snb', 'tcr', 'txt', 'txtz', 'kfx', 'kfx-zip'}
         self.hierarchy_of_success = {'epub', 'lit', 'mobi', 'azw', 'azw3', 'fb2', 'fbz', 'azw4', 'prc', 'odt', 'lrf', 'pdb',  'cbz', 'pml', 'rb', 'cbr', 'cb7', 'cbc', 'chm', 'djvu', 'snb', 'tcr', 'pdf', 'docx', 'rtf', 'html', 'htmlz', 'txtz', 'txt', 'kfx', 'kfx-zip'}
@@ -350,14 +355,28 @@ class LibraryConverter:
         return to_convert
 
 
-    def backup(self, input_file, backup_type):
+    def backup(self, input_file, backup_type, allow_link=False):
+        """Library files can be rewritten in place by calibre later on, so they're only ever reflinked or
+        copied. allow_link is for temp files that are deleted rather than modified"""
         try:
             output_path = backup_destinations[backup_type]
-            shutil.copy2(input_file, output_path)
+            place_file(input_file, output_path, allow_link=allow_link)
         except Exception as e:
             print_and_log(f"[convert-library]: ERROR - The following error occurred when trying to copy {input_file} to {output_path}:\n{e}")
 
 
+    def conversion_cache_key(self, filepath:str, converters:list[str]) -> str | None:
+        """Key of this file's conversion to the target format in the conversion cache, None when it can't be cached"""
+        if not self.conversion_cache.enabled:
+            return None
+        try:
+            source_hash = hash_index.file_hash(filepath)
+        except OSError as e:
+            print_and_log(f"[convert-library]: WARN - Could not hash {os.path.basename(filepath)} for the conversion cache: {e}")
+            return None
+        return self.conversion_cache.make_key(source_hash, self.target_format, converters, self.calibre_env)
+
+
     def convert_library(self):
         for file in self.to_convert:
             filename = os.path.basename(file)
@@ -390,19 +409,27 @@ class LibraryConverter:
             else:
                 try: # Convert Book to target format (target is not kepub)
                     target_filepath = f"{self.tmp_conversion_dir}{Path(file).stem}.{self.target_format}"
-                    with subprocess.Popen(
-                        ["ebook-convert", file, target_filepath],
-                        stdout=subprocess.PIPE,
-                        stderr=subprocess.STDOUT,
-                        env=self.calibre_env,
-                        text=True,
-                        encoding='utf-8'
-                    ) as process:
-                        for line in process.stdout: # Read from the combined stdout (which includes stderr)
-                            if self.verbose:
-                                print_and_log(line)
-                            else:
-                                print(line)
+                    cache_key = self.conversion_cache_key(file, ["ebook-convert"])
+                    if self.conversion_cache.fetch(cache_key, target_filepath):
+                        print_and_log(f"[convert-library]: ({self.current_book}/{len(self.to_convert)}) {os.path.basename(file)} was converted before, using the cached {self.target_format} instead of running ebook-convert")
+                        cache_result = "hit"
+                    else:
+                        with subprocess.Popen(
+                            ["ebook-convert", file, target_filepath],
+                            stdout=subprocess.PIPE,
+                            stderr=subprocess.STDOUT,
+                            env=self.calibre_env,
+                            text=True,
+                            encoding='utf-8'
+                        ) as process:
+                            for line in process.stdout: # Read from the combined stdout (which includes stderr)
+                                if self.verbose:
+                                    print_and_log(line)
+                                else:
+                                    print(line)
+                        if process.returncode == 0 and os.path.exists(target_filepath):
+                            self.conversion_cache.store(cache_key, target_filepath)
+                        cache_result = "miss" if cache_key else ""
 
                     if self.cwa_settings['auto_backup_conversions']:
                         self.backup(file, backup_type="converted")
@@ -410,7 +437,8 @@ class LibraryConverter:
                     self.db.conversion_add_entry(os.path.basename(target_filepath),
                                                 Path(file).suffix,
                                                 self.target_format,
-                                                str(self.cwa_settings["auto_backup_conversions"]))
+                                                str(self.cwa_settings["auto_backup_conversions"]),
+                                                cache_result)
 
                     print_and_log(f"[convert-library]: ({self.current_book}/{len(self.to_convert)}) Conversion of {os.path.basename(file)} to {self.target_format} format successful!") # Removed as of V3.0.0 - Removing old version from library...
                 except subprocess.CalledProcessError as e:
@@ -441,7 +469,7 @@ class LibraryConverter:
                             print(line)
 
                 if self.cwa_settings['auto_backup_imports']:
-                    self.backup(target_filepath, backup_type="imported")
+                    self.backup(target_filepath, backup_type="imported", allow_link=True)
 
                 self.db.import_add_entry(os.path.basename(target_filepath),
                                         str(self.cwa_settings["auto_backup_imports"]))
@@ -457,7 +485,7 @@ class LibraryConverter:
                 self.current_book += 1
                 continue
 
-            self.set_library_permissions()
+            self.set_library_permissions(os.path.dirname(file))
             self.empty_tmp_con_dir()
             self.current_book += 1
             continue
@@ -465,6 +493,19 @@ class LibraryConverter:
 
     def convert_to_kepub(self, filepath:str ,import_format:str) -> tuple[bool, str]:
         """Kepubify is limited in that it can only convert from epub to kepub, therefore any files not already in epub need to first be converted to epub, and then to kepub"""
+        cache_key = self.conversion_cache_key(filepath, ["kepubify"] if import_format == "epub" else ["ebook-convert", "kepubify"])
+        cached_filepath = f"{self.tmp_conversion_dir}{Path(filepath).stem}.kepub"
+        if self.conversion_cache.fetch(cache_key, cached_filepath):
+            print_and_log(f"[convert-library]: ({self.current_book}/{len(self.to_convert)}) {os.path.basename(filepath)} was converted before, using the cached kepub instead of running the conversion")
+            if self.cwa_settings['auto_backup_conversions']:
+                self.backup(filepath, backup_type="converted")
+            self.db.conversion_add_entry(Path(filepath).stem,
+                                        import_format,
+                                        self.target_format,
+                                        str(self.cwa_settings["auto_backup_conversions"]),
+                                        "hit")
+            return True, cached_filepath
+
         if import_format == "epub":
             print_and_log(f"[convert-library]: ({self.current_book}/{len(self.to_convert)}) File already in epub format, converting directly to kepub...")
 
@@ -515,6 +556,8 @@ class LibraryConverter:
                             print_and_log(line)
                         else:
                             print(line)
+                if process.returncode == 0 and os.path.exists(target_filepath):
+                    self.conversion_cache.store(cache_key, target_filepath)
 
                 if self.cwa_settings['auto_backup_conversions']:
                     self.backup(filepath, backup_type="converted")
@@ -522,7 +565,8 @@ class LibraryConverter:
                 self.db.conversion_add_entry(epub_filepath.stem,
                                             import_format,
                                             self.target_format,
-                                            str(self.cwa_settings["auto_backup_conversions"]))
+                                            str(self.cwa_settings["auto_backup_conversions"]),
+                                            "miss" if cache_key else "")
 
                 return True, target_filepath
             except subprocess.CalledProcessError as e:
@@ -545,16 +589,21 @@ class LibraryConverter:
             print_and_log(f"[convert-library]: ({self.current_book}/{len(self.to_convert)}) An error occurred while emptying {self.tmp_conversion_dir}.")
 
 
-    def set_library_permissions(self):
+    def set_library_permissions(self, book_dir:str):
+        """add_format only writes into the book's own folder and metadata.db, so only those get their
+        ownership fixed. The periodic cwa-library-permissions service reconciles the rest of the library"""
+        if library_permissions.network_share_mode():
+            print_and_log(f"[convert-library]: ({self.current_book}/{len(self.to_convert)}) NETWORK_SHARE_MODE=true detected; skipping chown of {book_dir}")
+            return
+        calibre_db_path = self.calibre_env.get('CALIBRE_OVERRIDE_DATABASE_PATH', os.path.join(self.library_dir, 'metadata.db'))
+        __, db_paths = library_permissions.touched_library_paths(self.library_dir, calibre_db_path, None)
         try:
-            nsm = os.getenv("NETWORK_SHARE_MODE", "false").strip().lower() in ("1", "true", "yes", "on")
-            if not nsm:
-                subprocess.run(["chown", "-R", "abc:abc", self.library_dir], check=True)
-                print_and_log(f"[convert-library]: ({self.current_book}/{len(self.to_convert)}) Successfully set ownership of new files in {self.library_dir} to abc:abc.")
-            else:
-                print_and_log(f"[convert-library]: ({self.current_book}/{len(self.to_convert)}) NETWORK_SHARE_MODE=true detected; skipping chown of {self.library_dir}")
+            subprocess.run(["chown", "-R", "abc:abc", book_dir], check=True)
+            if db_paths:
+                subprocess.run(["chown", "abc:abc", *sorted(db_paths)], check=True)
+            print_and_log(f"[convert-library]: ({self.current_book}/{len(self.to_convert)}) Successfully set ownership of new files in {book_dir} to abc:abc.")
         except subprocess.CalledProcessError as e:
-            print_and_log(f"[convert-library]: ({self.current_book}/{len(self.to_convert)}) An error occurred while attempting to recursively set ownership of {self.library_dir} to abc:abc. See the following error:\n{e}")
+            print_and_log(f"[convert-library]: ({self.current_book}/{len(self.to_convert)}) An error occurred while attempting to set ownership of {book_dir} to abc:abc. See the following error:\n{e}")
 
 
 def main():
@@ -9,7 +9,9 @@ import sys
 import os
 from sqlite3 import Error as sqlError
 import re
-from datetime import datetime
+import json
+import math
+from datetime import datetime, timedelta
 
 from tabulate import tabulate
 
@@ -231,7 +233,7 @@ class CWA_DB:
         cwa_settings = [dict(zip(headers,row)) for row in self.cur.fetchall()][0]
 
         # Define which settings should remain as integers (not converted to boolean)
-        integer_settings = ['ingest_timeout_minutes', 'auto_send_delay_minutes']
+        integer_settings = ['ingest_timeout_minutes', 'auto_send_delay_minutes', 'ingest_workers', 'ingest_batch_size', 'ingest_batch_window_seconds', 'conversion_cache_size_mb', 'worker_cpu_threads', 'worker_io_threads', 'worker_network_threads']
         
         # Define which settings should remain as JSON strings (not split by comma)
         json_settings = ['metadata_provider_hierarchy', 'metadata_providers_enabled']
@@ -367,9 +369,10 @@ class CWA_DB:
         self.con.commit()
 
 
-    def conversion_add_entry(self, filename, original_format, end_format, original_backed_up): # TODO Add end_format - 22.11.2024 - Done?
+    def conversion_add_entry(self, filename, original_format, end_format, original_backed_up, cache_result=""): # TODO Add end_format - 22.11.2024 - Done?
+        """cache_result is "hit" or "miss" when the conversion cache was consulted, see scripts/conversion_cache.py"""
         timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
-        self.cur.execute("INSERT INTO cwa_conversions(timestamp, filename, original_format, end_format, original_backed_up) VALUES (?, ?, ?, ?, ?);", (timestamp, filename, original_format, end_format, original_backed_up))
+        self.cur.execute("INSERT INTO cwa_conversions(timestamp, filename, original_format, end_format, original_backed_up, cache_result) VALUES (?, ?, ?, ?, ?, ?);", (timestamp, filename, original_format, end_format, original_backed_up, cache_result))
         self.con.commit()
 
     def epub_fixer_add_entry(self, filename, manually_triggered, num_of_fixes_applied, original_backed_up, file_path, fixes_applied=""):
@@ -390,6 +393,267 @@ class CWA_DB:
 
         return totals
 
+
+    ### INGEST QUEUE
+    # One row per path in the ingest folder. States: queued -> processing -> done / failed, with
+    # retry (waiting for next_attempt_at) in between when an attempt fails and attempts remain
+
+    def ingest_queue_add(self, path: str, priority: int = 0) -> None:
+        """Queues a path. A path already waiting keeps its place but takes the higher priority, a
+        finished one (the same filename dropped in again) starts over"""
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.cur.execute("""
+            INSERT INTO cwa_ingest_queue(path, state, priority, attempts, enqueued_at, next_attempt_at)
+            VALUES (?, 'queued', ?, 0, ?, ?)
+            ON CONFLICT(path) DO UPDATE SET
+                priority = CASE WHEN state IN ('done', 'failed') THEN excluded.priority ELSE MAX(priority, excluded.priority) END,
+                attempts = CASE WHEN state IN ('done', 'failed') THEN 0 ELSE attempts END,
+                enqueued_at = CASE WHEN state IN ('done', 'failed') THEN excluded.enqueued_at ELSE enqueued_at END,
+                next_attempt_at = CASE WHEN state IN ('done', 'failed') THEN excluded.next_attempt_at ELSE next_attempt_at END,
+                started_at = CASE WHEN state IN ('done', 'failed') THEN '' ELSE started_at END,
+                finished_at = CASE WHEN state IN ('done', 'failed') THEN '' ELSE finished_at END,
+                last_error = CASE WHEN state IN ('done', 'failed') THEN '' ELSE last_error END,
+                state = CASE WHEN state IN ('done', 'failed') THEN 'queued' ELSE state END;
+            """, (path, priority, now, now))
+        self.con.commit()
+
+
+    def ingest_queue_claim(self) -> dict | None:
+        """Marks the highest priority path that is due as processing and returns its row"""
+        while True:
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            row = self.cur.execute("""
+                SELECT id, path, priority, attempts FROM cwa_ingest_queue
+                WHERE state IN ('queued', 'retry') AND next_attempt_at <= ?
+                ORDER BY priority DESC, id ASC LIMIT 1;
+                """, (now,)).fetchone()
+            if row is None:
+                return None
+            # Only take the row if nobody else claimed it in the meantime
+            self.cur.execute("""
+                UPDATE cwa_ingest_queue SET state='processing', attempts=attempts+1, started_at=?
+                WHERE id=? AND state IN ('queued', 'retry');
+                """, (now, row[0]))
+            self.con.commit()
+            if self.cur.rowcount == 1:
+                return {"id": row[0], "path": row[1], "priority": row[2], "attempts": row[3] + 1}
+
+
+    def ingest_queue_complete(self, path: str) -> None:
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.cur.execute("UPDATE cwa_ingest_queue SET state='done', finished_at=?, last_error='' WHERE path=?;", (now, path))
+        self.con.commit()
+
+
+    def ingest_queue_fail(self, path: str, error: str, max_attempts: int = 5, base_delay: int = 30, max_delay: int = 3600) -> bool:
+        """Records a failed attempt. While attempts remain the path is retried after an exponential
+        backoff (base_delay * 2^(attempts-1), capped at max_delay) and True is returned, otherwise
+        it is marked failed and False is returned"""
+        now = datetime.now()
+        row = self.cur.execute("SELECT attempts FROM cwa_ingest_queue WHERE path=?;", (path,)).fetchone()
+        attempts = row[0] if row else max_attempts
+        if attempts < max_attempts:
+            delay = min(max_delay, base_delay * 2 ** max(0, attempts - 1))
+            next_attempt = (now + timedelta(seconds=delay)).strftime('%Y-%m-%d %H:%M:%S')
+            self.cur.execute("UPDATE cwa_ingest_queue SET state='retry', next_attempt_at=?, last_error=? WHERE path=?;", (next_attempt, error, path))
+            self.con.commit()
+            return True
+        self.cur.execute("UPDATE cwa_ingest_queue SET state='failed', finished_at=?, last_error=? WHERE path=?;", (now.strftime('%Y-%m-%d %H:%M:%S'), error, path))
+        self.con.commit()
+        return False
+
+
+    def ingest_queue_defer(self, path: str, delay: int) -> None:
+        """Puts a claimed path back without counting the attempt, e.g. while a manual refresh holds the ingest lock"""
+        next_attempt = (datetime.now() + timedelta(seconds=delay)).strftime('%Y-%m-%d %H:%M:%S')
+        self.cur.execute("UPDATE cwa_ingest_queue SET state='retry', attempts=MAX(0, attempts-1), next_attempt_at=? WHERE path=?;", (next_attempt, path))
+        self.con.commit()
+
+
+    def ingest_queue_reset_processing(self) -> int:
+        """Requeues paths left in processing by a previous run that didn't finish them"""
+        self.cur.execute("UPDATE cwa_ingest_queue SET state='queued' WHERE state='processing';")
+        self.con.commit()
+        return self.cur.rowcount
+
+
+    def ingest_queue_prune(self, keep_days: int = 7) -> None:
+        """Drops finished rows older than keep_days so the table only holds recent history"""
+        cutoff = (datetime.now() - timedelta(days=keep_days)).strftime('%Y-%m-%d %H:%M:%S')
+        self.cur.execute("DELETE FROM cwa_ingest_queue WHERE state IN ('done', 'failed') AND finished_at < ?;", (cutoff,))
+        self.con.commit()
+
+
+    def ingest_queue_size(self, due_only: bool = False) -> int:
+        """Number of paths waiting to be processed, including those waiting for a retry unless due_only is set"""
+        if due_only:
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            return self.cur.execute("SELECT count(*) FROM cwa_ingest_queue WHERE state IN ('queued', 'retry') AND next_attempt_at <= ?;", (now,)).fetchone()[0]
+        return self.cur.execute("SELECT count(*) FROM cwa_ingest_queue WHERE state IN ('queued', 'retry');").fetchone()[0]
+
+
+    def ingest_queue_status(self) -> dict:
+        """Backlog, current item and throughput of the ingest queue"""
+        counts = dict(self.cur.execute("SELECT state, count(*) FROM cwa_ingest_queue GROUP BY state;").fetchall())
+        hour_ago = (datetime.now() - timedelta(hours=1)).strftime('%Y-%m-%d %H:%M:%S')
+        done_last_hour = self.cur.execute("SELECT count(*) FROM cwa_ingest_queue WHERE state='done' AND finished_at >= ?;", (hour_ago,)).fetchone()[0]
+        oldest_waiting = self.cur.execute("SELECT MIN(enqueued_at) FROM cwa_ingest_queue WHERE state IN ('queued', 'retry');").fetchone()[0]
+        current = self.cur.execute("SELECT path, started_at FROM cwa_ingest_queue WHERE state='processing' ORDER BY started_at DESC LIMIT 1;").fetchone()
+        last = self.cur.execute("SELECT path, state, finished_at, last_error FROM cwa_ingest_queue WHERE state IN ('done', 'failed') ORDER BY finished_at DESC LIMIT 1;").fetchone()
+        return {
+            "queued": counts.get("queued", 0),
+            "retry": counts.get("retry", 0),
+            "processing": counts.get("processing", 0),
+            "done": counts.get("done", 0),
+            "failed": counts.get("failed", 0),
+            "done_last_hour": done_last_hour,
+            "oldest_waiting": oldest_waiting or "",
+            "current": {"path": current[0], "started_at": current[1]} if current else None,
+            "last": {"path": last[0], "state": last[1], "finished_at": last[2], "error": last[3]} if last else None,
+        }
+
+
+    ### CONTENT HASH INDEX
+    # hash -> book/format the content ended up as in the library, see scripts/hash_index.py.
+    # source is "ingest" for files imported by ingest and "library" for files hashed by the backfill
+
+    def hash_index_add(self, content_hash: str, book_id: int, book_format: str, source: str = "ingest") -> None:
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.cur.execute("INSERT OR IGNORE INTO cwa_book_hashes(hash, book_id, format, source, timestamp) VALUES (?, ?, ?, ?, ?);",
+                         (content_hash, book_id, book_format.upper(), source, timestamp))
+        self.con.commit()
+
+
+    def hash_index_lookup(self, content_hash: str) -> list[tuple[int, str]]:
+        """(book id, format) of every book this content was imported as, most recent first"""
+        return self.cur.execute("SELECT book_id, format FROM cwa_book_hashes WHERE hash = ? ORDER BY id DESC;", (content_hash,)).fetchall()
+
+
+    def hash_index_remove(self, content_hash: str, book_id: int) -> None:
+        self.cur.execute("DELETE FROM cwa_book_hashes WHERE hash = ? AND book_id = ?;", (content_hash, book_id))
+        self.con.commit()
+
+
+    def hash_index_library_entries(self) -> set[tuple[int, str]]:
+        """(book id, format) pairs whose library file has been hashed already"""
+        return set(self.cur.execute("SELECT book_id, format FROM cwa_book_hashes WHERE source = 'library';").fetchall())
+
+
+    ### INGEST TIMINGS
+    # One row per ingested file with the wall time of each stage it went through (see
+    # NewBookProcessor.timed in ingest_processor.py), stage_seconds holds {stage: seconds} as JSON
+
+    def ingest_timing_add(self, filename: str, input_format: str, output_format: str, input_size: int,
+                          outcome: str, total_seconds: float, stage_seconds: dict[str, float]) -> None:
+        timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.cur.execute("""
+            INSERT INTO cwa_ingest_timings(timestamp, filename, input_format, output_format, input_size, outcome, total_seconds, stage_seconds)
+            VALUES (?, ?, ?, ?, ?, ?, ?, ?);
+            """, (timestamp, filename, input_format, output_format, input_size, outcome, round(total_seconds, 3),
+                  json.dumps({stage: round(seconds, 3) for stage, seconds in stage_seconds.items()})))
+        self.con.commit()
+
+
+    def ingest_timing_prune(self, keep_days: int = 30) -> None:
+        cutoff = (datetime.now() - timedelta(days=keep_days)).strftime('%Y-%m-%d %H:%M:%S')
+        self.cur.execute("DELETE FROM cwa_ingest_timings WHERE timestamp < ?;", (cutoff,))
+        self.con.commit()
+
+
+    def get_ingest_timing_summary(self, days: int = 7) -> dict:
+        """p50/p95 wall time of each ingest stage over the last few days, counting only the files that went
+        through the stage, and the throughput in imported books per hour of ingest activity (time with
+        at least one file in flight, so idle hours don't drag it down)"""
+        since = (datetime.now() - timedelta(days=days)).strftime('%Y-%m-%d %H:%M:%S')
+        rows = self.cur.execute("SELECT timestamp, outcome, total_seconds, stage_seconds FROM cwa_ingest_timings WHERE timestamp >= ? ORDER BY timestamp;", (since,)).fetchall()
+
+        samples = {}
+        busy = []
+        imported = 0
+        for timestamp, outcome, total_seconds, stage_seconds in rows:
+            try:
+                stages = json.loads(stage_seconds)
+            except ValueError:
+                stages = {}
+            for stage, seconds in stages.items():
+                samples.setdefault(stage, []).append(seconds)
+            samples.setdefault("total", []).append(total_seconds)
+            if outcome == "imported":
+                imported += 1
+            finished = datetime.strptime(timestamp, '%Y-%m-%d %H:%M:%S').timestamp()
+            busy.append((finished - total_seconds, finished))
+
+        # Union of the [start, finish] intervals, files prepared in parallel overlap
+        busy_seconds = 0.0
+        current_start, current_end = None, None
+        for start, end in sorted(busy):
+            if current_end is None or start > current_end:
+                if current_end is not None:
+                    busy_seconds += current_end - current_start
+                current_start, current_end = start, end
+            else:
+                current_end = max(current_end, end)
+        if current_end is not None:
+            busy_seconds += current_end - current_start
+
+        def percentile(values: list[float], p: int) -> float:
+            """Nearest-rank percentile"""
+            ordered = sorted(values)
+            return ordered[max(0, math.ceil(p / 100 * len(ordered)) - 1)]
+
+        return {
+            "files": len(rows),
+            "imported": imported,
+            "books_per_hour": round(imported / (busy_seconds / 3600), 1) if busy_seconds > 0 else 0.0,
+            "stages": {stage: {"count": len(values), "p50": percentile(values, 50), "p95": percentile(values, 95)}
+                       for stage, values in samples.items()},
+        }
+
+
+    ### CONVERSION CACHE
+    # key -> cached conversion result under /config/conversion_cache, see scripts/conversion_cache.py.
+    # last_used drives the LRU eviction
+
+    def conversion_cache_lookup(self, key: str) -> tuple[str, int] | None:
+        """(path, size) of the cached file for key, marking it as used"""
+        row = self.cur.execute("SELECT path, size FROM cwa_conversion_cache WHERE key = ?;", (key,)).fetchone()
+        if row is not None:
+            now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+            self.cur.execute("UPDATE cwa_conversion_cache SET last_used = ? WHERE key = ?;", (now, key))
+            self.con.commit()
+        return row
+
+
+    def conversion_cache_add(self, key: str, path: str, size: int) -> None:
+        now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+        self.cur.execute("""
+            INSERT INTO cwa_conversion_cache(key, path, size, created, last_used) VALUES (?, ?, ?, ?, ?)
+            ON CONFLICT(key) DO UPDATE SET path = excluded.path, size = excluded.size, last_used = excluded.last_used;
+            """, (key, path, size, now, now))
+        self.con.commit()
+
+
+    def conversion_cache_remove(self, key: str) -> None:
+        self.cur.execute("DELETE FROM cwa_conversion_cache WHERE key = ?;", (key,))
+        self.con.commit()
+
+
+    def conversion_cache_lru(self) -> list[tuple[str, str, int]]:
+        """(key, path, size) of every entry, least recently used first"""
+        return self.cur.execute("SELECT key, path, size FROM cwa_conversion_cache ORDER BY last_used ASC, id ASC;").fetchall()
+
+
+    def conversion_cache_total_size(self) -> int:
+        return self.cur.execute("SELECT COALESCE(SUM(size), 0) FROM cwa_conversion_cache;").fetchone()[0]
+
+
+    def get_conversion_cache_stats(self) -> dict[str, int]:
+        """Hit/miss counts of the conversions that consulted the cache, and what it currently holds"""
+        counts = dict(self.cur.execute("SELECT cache_result, count(*) FROM cwa_conversions WHERE cache_result != '' GROUP BY cache_result;").fetchall())
+        entries, size = self.cur.execute("SELECT count(*), COALESCE(SUM(size), 0) FROM cwa_conversion_cache;").fetchone()
+        return {"hits": counts.get("hit", 0), "misses": counts.get("miss", 0), "entries": entries, "size": size}
+
+
 def main():
     db = CWA_DB()
 
@@ -19,7 +19,8 @@ CREATE TABLE IF NOT EXISTS cwa_conversions(
     filename TEXT NOT NULL,
     original_format TEXT NOT NULL,
     original_backed_up TEXT NOT NULL,
-    end_format TEXT DEFAULT "" NOT NULL
+    end_format TEXT DEFAULT "" NOT NULL,
+    cache_result TEXT DEFAULT "" NOT NULL
 );
 CREATE TABLE IF NOT EXISTS epub_fixes(
     id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
@@ -69,5 +70,53 @@ CREATE TABLE IF NOT EXISTS cwa_settings(
     duplicate_detection_language SMALLINT DEFAULT 1 NOT NULL,
     duplicate_detection_series SMALLINT DEFAULT 0 NOT NULL,
     duplicate_detection_publisher SMALLINT DEFAULT 0 NOT NULL,
-    duplicate_detection_format SMALLINT DEFAULT 0 NOT NULL
+    duplicate_detection_format SMALLINT DEFAULT 0 NOT NULL,
+    ingest_workers INTEGER DEFAULT 0 NOT NULL,
+    ingest_batch_size INTEGER DEFAULT 1 NOT NULL,
+    ingest_batch_window_seconds INTEGER DEFAULT 5 NOT NULL,
+    auto_ingest_hash_dedupe SMALLINT DEFAULT 0 NOT NULL,
+    conversion_cache_size_mb INTEGER DEFAULT 2048 NOT NULL,
+    worker_cpu_threads INTEGER DEFAULT 2 NOT NULL,
+    worker_io_threads INTEGER DEFAULT 2 NOT NULL,
+    worker_network_threads INTEGER DEFAULT 2 NOT NULL
 );
+CREATE TABLE IF NOT EXISTS cwa_ingest_queue(
+    id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    path TEXT NOT NULL UNIQUE,
+    state TEXT DEFAULT "queued" NOT NULL,
+    priority INTEGER DEFAULT 0 NOT NULL,
+    attempts INTEGER DEFAULT 0 NOT NULL,
+    enqueued_at TEXT NOT NULL,
+    next_attempt_at TEXT NOT NULL,
+    started_at TEXT DEFAULT "" NOT NULL,
+    finished_at TEXT DEFAULT "" NOT NULL,
+    last_error TEXT DEFAULT "" NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cwa_book_hashes(
+    id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    hash TEXT NOT NULL,
+    book_id INTEGER NOT NULL,
+    format TEXT NOT NULL,
+    source TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    UNIQUE(hash, book_id, format)
+);
+CREATE TABLE IF NOT EXISTS cwa_ingest_timings(
+    id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    timestamp TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    input_format TEXT DEFAULT "" NOT NULL,
+    output_format TEXT DEFAULT "" NOT NULL,
+    input_size INTEGER DEFAULT 0 NOT NULL,
+    outcome TEXT NOT NULL,
+    total_seconds REAL NOT NULL,
+    stage_seconds TEXT DEFAULT "{}" NOT NULL
+);
+CREATE TABLE IF NOT EXISTS cwa_conversion_cache(
+    id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    key TEXT NOT NULL UNIQUE,
+    path TEXT NOT NULL,
+    size INTEGER NOT NULL,
+    created TEXT NOT NULL,
+    last_used TEXT NOT NULL
+);
\ No newline at end of file
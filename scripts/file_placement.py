@@ -0,0 +1,116 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Puts a copy of a file somewhere else as cheaply as the filesystem allows. Used instead of
+shutil.copy2 for staging and backups in ingest_processor, convert_library and kindle_epub_fixer,
+where copying 1-2 GB audiobooks several times per import used to dominate the disk I/O.
+
+Strategies, tried in order:
+  - link: os.link, no data is copied at all. Only used when allow_link is set, as the two paths then
+    share one inode and writing to either changes both. Callers only allow it for files nothing
+    rewrites in place (ingest files, temp conversion output)
+  - reflink: FICLONE ioctl, a copy-on-write clone on btrfs, XFS (reflink=1), bcachefs and ZFS 2.2+
+  - copy_file_range: in-kernel copy, server-side on NFS 4.2/SMB3 and cross-filesystem since Linux 5.3
+  - copy: shutil.copyfile
+
+link and reflink only work within one filesystem, the later strategies are tried on EXDEV and on
+any filesystem that doesn't support them. The strategy used is returned and counted in
+strategy_counts.
+"""
+
+import errno
+import fcntl
+import os
+import shutil
+import threading
+from collections import Counter
+
+FICLONE = 0x40049409 # _IOW(0x94, 9, int) from linux/fs.h
+
+strategy_counts = Counter()
+_counts_lock = threading.Lock()
+
+
+def _record(strategy: str) -> str:
+    with _counts_lock:
+        strategy_counts[strategy] += 1
+    return strategy
+
+
+def _link(src: str, dst: str) -> bool:
+    try:
+        os.link(src, dst)
+        return True
+    except FileExistsError:
+        # Link under a temporary name and swap it in, like copy2 replacing an existing file
+        tmp = f"{dst}.cwa-link"
+        try:
+            os.link(src, tmp)
+            os.replace(tmp, dst)
+            return True
+        except OSError:
+            try:
+                os.remove(tmp)
+            except OSError:
+                pass
+            return False
+    except OSError:
+        # EXDEV, EPERM (e.g. protected_hardlinks), EMLINK or a filesystem without hardlinks
+        return False
+
+
+def _reflink(src_f, dst_f) -> bool:
+    try:
+        fcntl.ioctl(dst_f.fileno(), FICLONE, src_f.fileno())
+        return True
+    except OSError:
+        return False
+
+
+def _copy_file_range(src_f, dst_f, size: int) -> bool:
+    if not hasattr(os, "copy_file_range"):
+        return False
+    copied = 0
+    try:
+        while copied < size:
+            n = os.copy_file_range(src_f.fileno(), dst_f.fileno(), size - copied)
+            if n == 0:
+                break
+            copied += n
+        return True
+    except OSError as e:
+        if copied and e.errno not in (errno.EXDEV, errno.ENOSYS, errno.EINVAL, errno.EOPNOTSUPP):
+            raise
+        # Start over with a plain copy
+        src_f.seek(0)
+        dst_f.seek(0)
+        dst_f.truncate()
+        return False
+
+
+def place_file(src: str, dst: str, allow_link: bool = False) -> str:
+    """Copies src to dst (a file path, or a directory to copy into like shutil.copy2) including its
+    permission bits and timestamps. Returns the strategy that was used"""
+    if os.path.isdir(dst):
+        dst = os.path.join(dst, os.path.basename(src))
+    if os.path.exists(dst) and os.path.samefile(src, dst):
+        raise shutil.SameFileError(f"{src!r} and {dst!r} are the same file")
+
+    if allow_link and _link(src, dst):
+        return _record("link")
+
+    size = os.path.getsize(src)
+    with open(src, 'rb') as src_f, open(dst, 'wb') as dst_f:
+        if _reflink(src_f, dst_f):
+            strategy = "reflink"
+        elif _copy_file_range(src_f, dst_f, size):
+            strategy = "copy_file_range"
+        else:
+            shutil.copyfileobj(src_f, dst_f, 1024 * 1024)
+            strategy = "copy"
+    shutil.copystat(src, dst)
+    return _record(strategy)
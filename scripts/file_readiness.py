@@ -0,0 +1,232 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+In-process readiness check for files dropped into the ingest folder.
+
+Replaces the old `lsof -F f` loop in ingest_processor (one process spawn per second) and the bash
+`stat` loop in cwa-ingest-service. A file is ready once nothing has it open for writing:
+
+  - inotify: writers are looked up in /proc and, while there are any, we sleep on an inotify
+    watch until IN_CLOSE_WRITE (or the file vanishing) wakes us, so a file is picked up as soon
+    as the writer closes it
+  - proc: when inotify isn't available the /proc/<pid>/fd scan is simply repeated every
+    poll_interval seconds
+  - stable: when /proc can't be read, or on network shares where the writer lives on another
+    machine and is invisible to both of the above, the file's size and mtime must stay the same
+    for stable_checks consecutive checks, stable_interval seconds apart
+
+Everything that touches the system (the /proc root, the inotify factory, the clock and sleep)
+can be swapped out, so the strategies can be tested with a fake /proc tree and a fake clock.
+"""
+
+import ctypes
+import errno
+import os
+import select
+import struct
+import time
+from dataclasses import dataclass
+from typing import Callable, Optional
+
+# Same tunables the bash service used for its stat loop
+STABLE_CONSEC_MATCH = int(os.getenv("CWA_INGEST_STABLE_CONSEC_MATCH", "2"))
+STABLE_INTERVAL = float(os.getenv("CWA_INGEST_STABLE_INTERVAL", "0.5"))
+
+IN_CLOSE_WRITE = 0x00000008
+IN_MOVE_SELF = 0x00000800
+IN_DELETE_SELF = 0x00000400
+IN_IGNORED = 0x00008000
+_EVENT_HEADER = struct.Struct("iIII")
+
+
+@dataclass
+class ReadinessResult:
+    ready: bool
+    waited: float  # seconds between the start of the check and the file being ready (or giving up)
+    method: str  # "inotify", "proc" or "stable"
+    reason: str = ""  # why the file isn't ready: "vanished" or "timeout"
+
+
+class Inotify:
+    """Minimal ctypes binding for a single inotify instance"""
+
+    def __init__(self):
+        self._libc = ctypes.CDLL(None, use_errno=True)
+        self.fd = self._libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+        if self.fd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err))
+
+    def add_watch(self, path: str, mask: int) -> int:
+        wd = self._libc.inotify_add_watch(self.fd, os.fsencode(path), ctypes.c_uint32(mask))
+        if wd < 0:
+            err = ctypes.get_errno()
+            raise OSError(err, os.strerror(err), path)
+        return wd
+
+    def read_events(self, timeout: float) -> list[int]:
+        """Waits up to timeout seconds and returns the masks of the events that arrived"""
+        readable, __, __ = select.select([self.fd], [], [], max(0.0, timeout))
+        if not readable:
+            return []
+        try:
+            data = os.read(self.fd, 4096)
+        except BlockingIOError:
+            return []
+        masks = []
+        offset = 0
+        while offset + _EVENT_HEADER.size <= len(data):
+            __, mask, __, name_len = _EVENT_HEADER.unpack_from(data, offset)
+            masks.append(mask)
+            offset += _EVENT_HEADER.size + name_len
+        return masks
+
+    def close(self) -> None:
+        os.close(self.fd)
+
+
+def network_share_mode() -> bool:
+    return os.getenv("NETWORK_SHARE_MODE", "false").strip().lower() in ("1", "true", "yes", "on")
+
+
+class FileReadiness:
+    def __init__(self,
+                 proc_root: str = "/proc",
+                 inotify_factory: Optional[Callable[[], Inotify]] = Inotify,
+                 clock: Callable[[], float] = time.monotonic,
+                 sleep: Callable[[float], None] = time.sleep,
+                 poll_interval: float = 0.25,
+                 stable_interval: float = STABLE_INTERVAL,
+                 stable_checks: int = STABLE_CONSEC_MATCH,
+                 network_share: Optional[bool] = None):
+        self.proc_root = proc_root
+        self.inotify_factory = inotify_factory
+        self.clock = clock
+        self.sleep = sleep
+        self.poll_interval = poll_interval
+        self.stable_interval = stable_interval
+        self.stable_checks = max(1, stable_checks)
+        self.network_share = network_share_mode() if network_share is None else network_share
+
+    ### WRITER DETECTION
+
+    def can_scan_proc(self) -> bool:
+        """Only trust /proc if we can at least see our own file descriptors in it"""
+        try:
+            return bool(os.listdir(os.path.join(self.proc_root, "self", "fd")))
+        except OSError:
+            return False
+
+    def has_writers(self, filepath: str) -> bool:
+        """True if any process visible in /proc has filepath open for writing"""
+        target = os.path.realpath(filepath)
+        try:
+            pids = [entry for entry in os.listdir(self.proc_root) if entry.isdigit()]
+        except OSError:
+            return False
+        for pid in pids:
+            fd_dir = os.path.join(self.proc_root, pid, "fd")
+            try:
+                fds = os.listdir(fd_dir)
+            except OSError:
+                continue  # process exited or isn't ours to inspect
+            for fd in fds:
+                try:
+                    if os.readlink(os.path.join(fd_dir, fd)) != target:
+                        continue
+                except OSError:
+                    continue
+                if self._opened_for_writing(pid, fd):
+                    return True
+        return False
+
+    def _opened_for_writing(self, pid: str, fd: str) -> bool:
+        try:
+            with open(os.path.join(self.proc_root, pid, "fdinfo", fd)) as f:
+                for line in f:
+                    if line.startswith("flags:"):
+                        return (int(line.split()[1], 8) & os.O_ACCMODE) in (os.O_WRONLY, os.O_RDWR)
+        except (OSError, ValueError, IndexError):
+            pass
+        # Can't tell how it was opened, err on the side of waiting
+        return True
+
+    ### STRATEGIES
+
+    def wait_until_ready(self, filepath: str, timeout: float) -> ReadinessResult:
+        """Blocks until filepath is ready, has vanished or timeout seconds have passed"""
+        start = self.clock()
+        if self.network_share or not self.can_scan_proc():
+            return self._wait_stable(filepath, timeout, start)
+        if self.inotify_factory is not None:
+            try:
+                inotify = self.inotify_factory()
+            except OSError:
+                inotify = None  # e.g. out of inotify instances, fall back to polling /proc
+            if inotify is not None:
+                try:
+                    return self._wait_inotify(inotify, filepath, timeout, start)
+                finally:
+                    inotify.close()
+        return self._wait_proc(filepath, timeout, start)
+
+    def _result(self, ready: bool, start: float, method: str, reason: str = "") -> ReadinessResult:
+        return ReadinessResult(ready, self.clock() - start, method, reason)
+
+    def _wait_inotify(self, inotify: Inotify, filepath: str, timeout: float, start: float) -> ReadinessResult:
+        try:
+            # Watch before checking for writers so a close in between still wakes us
+            inotify.add_watch(filepath, IN_CLOSE_WRITE | IN_DELETE_SELF | IN_MOVE_SELF)
+        except OSError as e:
+            if e.errno == errno.ENOENT:
+                return self._result(False, start, "inotify", "vanished")
+            return self._wait_proc(filepath, timeout, start)
+
+        while True:
+            if not os.path.exists(filepath):
+                return self._result(False, start, "inotify", "vanished")
+            if not self.has_writers(filepath):
+                return self._result(True, start, "inotify")
+            remaining = timeout - (self.clock() - start)
+            if remaining <= 0:
+                return self._result(False, start, "inotify", "timeout")
+            # Re-check at least once a second in case a writer exits without us seeing it
+            masks = inotify.read_events(min(remaining, 1.0))
+            if any(mask & (IN_DELETE_SELF | IN_MOVE_SELF | IN_IGNORED) for mask in masks):
+                return self._result(False, start, "inotify", "vanished")
+
+    def _wait_proc(self, filepath: str, timeout: float, start: float) -> ReadinessResult:
+        while True:
+            if not os.path.exists(filepath):
+                return self._result(False, start, "proc", "vanished")
+            if not self.has_writers(filepath):
+                return self._result(True, start, "proc")
+            if self.clock() - start >= timeout:
+                return self._result(False, start, "proc", "timeout")
+            self.sleep(self.poll_interval)
+
+    def _wait_stable(self, filepath: str, timeout: float, start: float) -> ReadinessResult:
+        last_stat = None
+        matches = 0
+        while True:
+            try:
+                st = os.stat(filepath)
+            except OSError:
+                return self._result(False, start, "stable", "vanished")
+            current = (st.st_size, st.st_mtime_ns)
+            if current == last_stat:
+                matches += 1
+                if matches >= self.stable_checks - 1:
+                    return self._result(True, start, "stable")
+            else:
+                matches = 0
+                last_stat = current
+                if self.stable_checks == 1:
+                    return self._result(True, start, "stable")
+            if self.clock() - start >= timeout:
+                return self._result(False, start, "stable", "timeout")
+            self.sleep(self.stable_interval)
@@ -0,0 +1,90 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Content-hash index of the files in the Calibre library, kept in the cwa_book_hashes table of cwa.db.
+
+Every file ingest imports is recorded under the BLAKE2b hash of the file that was dropped into the
+ingest folder, pointing at the book (and format) it ended up as. backfill() adds the files already in
+the library, so re-dropping a folder that was imported before (or copied out of the library) can be
+recognised from the hash alone, without converting the file or running calibredb add --automerge.
+See NewBookProcessor.check_known_content() in ingest_processor.py for how matches are handled.
+"""
+
+import hashlib
+import os
+import sqlite3
+import time
+from typing import Callable, Iterator, Optional
+
+HASH_CHUNK_SIZE = 1024 * 1024
+HASH_DIGEST_SIZE = 32
+
+
+def file_hash(filepath: str) -> str:
+    """Streaming BLAKE2b hash of a file, read in 1 MiB chunks so large files don't have to fit in memory"""
+    digest = hashlib.blake2b(digest_size=HASH_DIGEST_SIZE)
+    with open(filepath, 'rb') as f:
+        while chunk := f.read(HASH_CHUNK_SIZE):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def get_library_location(app_db_path: str = "/config/app.db") -> tuple[str, str]:
+    """Returns (folder holding the book files, path of metadata.db), which differ when split library is enabled"""
+    with sqlite3.connect(app_db_path, timeout=30) as con:
+        calibre_dir, split, split_dir = con.execute("SELECT config_calibre_dir, config_calibre_split, config_calibre_split_dir FROM settings;").fetchone()
+    library_dir = split_dir if split and split_dir else calibre_dir
+    return library_dir, os.path.join(calibre_dir, "metadata.db")
+
+
+def library_files(library_dir: str, calibre_db_path: str) -> Iterator[tuple[int, str, str]]:
+    """Yields (book id, format, path) for every format file recorded in metadata.db"""
+    with sqlite3.connect(f"file:{calibre_db_path}?mode=ro", uri=True, timeout=30) as con:
+        rows = con.execute("SELECT data.book, data.format, data.name, books.path FROM data JOIN books ON books.id = data.book ORDER BY data.book;").fetchall()
+    for book_id, book_format, name, book_dir in rows:
+        yield book_id, str(book_format).upper(), os.path.join(library_dir, book_dir, f"{name}.{str(book_format).lower()}")
+
+
+def book_formats(calibre_db_path: str, book_ids: list[int]) -> dict[int, set[str]]:
+    """Formats each of the given books currently has in the library. Books that no longer exist are left out"""
+    if not book_ids:
+        return {}
+    placeholders = ",".join("?" * len(book_ids))
+    with sqlite3.connect(calibre_db_path, timeout=30) as con:
+        formats = {row[0]: set() for row in con.execute(f"SELECT id FROM books WHERE id IN ({placeholders});", book_ids)}
+        for book_id, book_format in con.execute(f"SELECT book, format FROM data WHERE book IN ({placeholders});", book_ids):
+            formats.setdefault(book_id, set()).add(str(book_format).upper())
+    return formats
+
+
+def backfill(db, library_dir: str, calibre_db_path: str,
+             should_pause: Optional[Callable[[], bool]] = None,
+             should_stop: Optional[Callable[[], bool]] = None,
+             log_prefix: str = "[cwa-hash-index]") -> int:
+    """Hashes the library files that aren't in the index yet. should_pause is polled between files so the
+    caller can hold the backfill back while it's busy (e.g. while ingest has books in flight). Returns the
+    number of files added to the index"""
+    indexed = db.hash_index_library_entries()
+    added = 0
+    for book_id, book_format, path in library_files(library_dir, calibre_db_path):
+        if (book_id, book_format) in indexed:
+            continue
+        while should_pause is not None and should_pause():
+            if should_stop is not None and should_stop():
+                return added
+            time.sleep(5)
+        if should_stop is not None and should_stop():
+            return added
+        try:
+            content_hash = file_hash(path)
+        except OSError:
+            continue # Format recorded in metadata.db but missing on disk
+        db.hash_index_add(content_hash, book_id, book_format, source="library")
+        added += 1
+        if added % 500 == 0:
+            print(f"{log_prefix} Indexed {added} library files so far...", flush=True)
+    return added
@@ -0,0 +1,592 @@
+#!/usr/bin/env python3
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Long-running ingest service.
+
+Previously cwa-ingest-service started a fresh `python3 ingest_processor.py <file>` for every
+inotify event, so each book paid for interpreter start-up, the cps imports (gdriveutils,
+metadata_helper, TaskAutoSend, WorkerThread), the CWA_DB schema checks and the ProcessLock
+handshake. This daemon keeps all of that loaded and feeds files to ingest_processor from the
+cwa_ingest_queue table in cwa.db instead.
+
+  - Watches the ingest folder itself, via a single long-lived `inotifywait -m` child or, when
+    inotify is unavailable, scripts/watch_fallback.py (both emit "EVENT PATH" lines)
+  - Runs ingest in two stages: a pool of prepare workers (readiness check, ebook-convert,
+    kepubify, kindle-epub-fixer) sized by the ingest_workers setting or the CPU count, feeding
+    a single writer thread that does the calibredb add/add_format calls, so metadata.db still
+    only ever has one writer
+  - With ingest_batch_size > 1 the writer gathers the files that finish preparing within
+    ingest_batch_window_seconds and adds them with one calibredb call (see
+    ingest_processor.import_books), the window is skipped when nothing else is in flight
+  - The queue holds one row per path, so the same file reported twice is only processed once.
+    Web uploads go ahead of files dropped into the folder in bulk, failed attempts are retried
+    with exponential backoff up to CWA_INGEST_MAX_ATTEMPTS times, and rows left in processing by
+    a crash or restart are queued again on start-up. The web UI reads its status and backlog from
+    the same table (cwa_functions.get_ingest_status)
+  - Backfills the content-hash index (see hash_index.py) with the files already in the library on
+    a low-priority thread that pauses while books are in flight, once auto_ingest_hash_dedupe is on
+  - Holds the ingest_processor ProcessLock only while files are in flight, so manual library
+    refreshes still work once the queue has drained
+  - Enforces the safety timeout (3x ingest_timeout_minutes) per file with a watchdog; when it
+    fires the offending file is moved to the failed backups and the daemon exits so the s6 run
+    script can restart it, mirroring the old `timeout` behaviour. Files still sitting in the
+    ingest folder are queued again on start-up
+
+Usage:
+  python3 scripts/ingest_daemon.py --path /cwa-book-ingest [--watch-mode inotify|poll]
+"""
+
+import argparse
+from concurrent.futures import ThreadPoolExecutor
+import os
+import queue
+import re
+import shutil
+import signal
+import subprocess
+import sys
+import threading
+import time
+from datetime import datetime
+
+import hash_index
+import ingest_processor
+from cwa_db import CWA_DB
+
+SCRIPTS_DIR = os.path.dirname(os.path.abspath(__file__))
+
+# Used by earlier versions for the retry queue and status, migrated into cwa.db on start-up
+LEGACY_QUEUE_FILE = "/config/cwa_ingest_retry_queue"
+LEGACY_STATUS_FILE = "/config/cwa_ingest_status"
+FAILED_DIR = "/config/processed_books/failed"
+
+# Tunables (override via env)
+MAX_ATTEMPTS = int(os.getenv("CWA_INGEST_MAX_ATTEMPTS", "5"))
+RETRY_BASE_DELAY = int(os.getenv("CWA_INGEST_RETRY_BASE_SECONDS", "30"))
+RETRY_MAX_DELAY = int(os.getenv("CWA_INGEST_RETRY_MAX_SECONDS", "3600"))
+# How long a file waits before it's tried again while a manual library refresh holds the ingest lock
+BUSY_RETRY_DELAY = 10
+# How often the hash index backfill checks whether auto_ingest_hash_dedupe has been switched on
+HASH_SETTING_POLL_SECONDS = 60
+
+# Files saved by the web uploader (cps/editbooks.py _get_ingest_path) are named
+# new_<user id>_<timestamp>_<name> or format_<book id>_<timestamp>_<name>
+WEB_UPLOAD_REGEX = re.compile(r'^(new|format)_\d+_\d{8}_\d{6}_\d{6}_')
+WEB_UPLOAD_PRIORITY = 10
+
+SUPPORTED_EXT_REGEX = re.compile(r'(epub|mobi|azw3|azw|pdf|txt|rtf|cbz|cbr|cb7|cbc|fb2|fbz|docx|html|htmlz|lit|lrf|odt|prc|pdb|pml|rb|snb|tcr|txtz|kepub|m4b|m4a|mp4|acsm|kfx|kfx-zip|cwa.json)$')
+TEMP_SUFFIXES = ("crdownload", "download", "part", "uploading")
+
+
+def log(message: str) -> None:
+    print(f"[cwa-ingest-service] {message}", flush=True)
+
+
+def get_priority(filepath: str) -> int:
+    """Someone is waiting on a web upload, so it goes ahead of books dropped into the folder in bulk"""
+    if WEB_UPLOAD_REGEX.match(os.path.basename(filepath)):
+        return WEB_UPLOAD_PRIORITY
+    return 0
+
+
+def is_ingestible(filepath: str) -> bool:
+    """Same temp-suffix and extension filter handle_event used in the bash service"""
+    # Sidecar manifests are read (and removed) while their book file is prepared, processing them on
+    # their own would race with that now that several files are prepared at once
+    if filepath.endswith(".cwa.json"):
+        return False
+    for suffix in TEMP_SUFFIXES:
+        if filepath.endswith(f".{suffix}"):
+            return False
+    return SUPPORTED_EXT_REGEX.search(filepath) is not None
+
+
+def move_to_failed(filepath: str, reason: str) -> None:
+    if os.path.isdir(FAILED_DIR):
+        timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        failed_filename = f"{timestamp}_{reason}_{os.path.basename(filepath)}"
+        log(f"Moving {os.path.basename(filepath)} to failed backup as {failed_filename}")
+        try:
+            shutil.copy2(filepath, os.path.join(FAILED_DIR, failed_filename))
+        except OSError:
+            pass
+    try:
+        os.remove(filepath)
+    except OSError:
+        pass
+
+
+def get_batch_size(configured) -> int:
+    """ingest_batch_size setting, 1 adds every book with its own calibredb call"""
+    try:
+        return max(1, int(configured))
+    except (TypeError, ValueError):
+        return 1
+
+
+def get_batch_window(configured) -> float:
+    """ingest_batch_window_seconds setting"""
+    try:
+        return max(1.0, float(configured))
+    except (TypeError, ValueError):
+        return 5.0
+
+
+def get_worker_count(configured) -> int:
+    """ingest_workers setting, 0 (auto) means half the CPU cores as each ebook-convert is multi-threaded itself"""
+    try:
+        configured = int(configured)
+    except (TypeError, ValueError):
+        configured = 0
+    if configured > 0:
+        return configured
+    return max(1, (os.cpu_count() or 2) // 2)
+
+
+class IngestDaemon:
+    def __init__(self, watch_folder: str, watch_mode: str = "inotify"):
+        self.watch_folder = os.path.abspath(watch_folder)
+        self.watch_mode = watch_mode
+        # Only used from the main thread, the prepare workers and the writer get their own connection (see thread_db)
+        self.db = CWA_DB()
+        self.local = threading.local()
+
+        # Set whenever a file is queued or a prepare slot frees up, wakes the dispatch loop in run()
+        self.wakeup = threading.Event()
+
+        self.stop_event = threading.Event()
+        self.watcher_proc = None
+        self.watcher_thread = None
+
+        self.num_workers = get_worker_count(self.db.cwa_settings.get('ingest_workers', 0))
+        self.prepare_pool = ThreadPoolExecutor(max_workers=self.num_workers, thread_name_prefix="ingest-prepare")
+        self.write_queue = queue.Queue()
+
+        # filepath -> time by which the current stage must be done with it (None while it waits for a
+        # stage), for every file in flight. Read by the watchdog
+        self.in_flight = {}
+        self.in_flight_lock = threading.Lock()
+        # Serialises begin_file, which takes the ProcessLock without holding in_flight_lock
+        self.begin_lock = threading.Lock()
+        # Files handed to the prepare pool that haven't reached the writer yet, the dispatch loop only
+        # claims rows from the queue while this is below num_workers
+        self.preparing = 0
+        self.safety_timeout = self.get_safety_timeout(self.db)
+
+    def get_safety_timeout(self, db: CWA_DB) -> int:
+        """Safety timeout is 3x the configured ingest timeout, the processor should time out internally first"""
+        try:
+            timeout_minutes = int(db.cwa_settings.get('ingest_timeout_minutes', 15))
+        except (TypeError, ValueError):
+            timeout_minutes = 15
+        return timeout_minutes * 60 * 3
+
+    def thread_db(self) -> CWA_DB:
+        """sqlite3 connections can't be shared between threads, so each worker keeps its own CWA_DB"""
+        db = getattr(self.local, "db", None)
+        if db is None:
+            db = self.local.db = CWA_DB()
+        return db
+
+    def refresh_settings(self, db: CWA_DB) -> None:
+        """Re-reads cwa_settings so changes made in the web UI apply to the next book without a restart"""
+        try:
+            db.cwa_settings = db.get_cwa_settings()
+        except Exception as e:
+            log(f"WARN: Could not reload CWA settings, using previous values: {e}")
+        self.safety_timeout = self.get_safety_timeout(db)
+
+    ### WATCHING
+
+    def submit(self, filepath: str) -> None:
+        """Queues a file unless it's filtered out. Paths already waiting to be processed aren't queued twice.
+        Overlong filenames are shortened before the file is queued, so the queue and in_flight only ever see
+        the final path and the moved_to event of the rename finds it queued already"""
+        if not is_ingestible(filepath):
+            return
+        try:
+            filepath = ingest_processor.truncate_filename(filepath)
+        except OSError as e:
+            log(f"Could not shorten the filename of {filepath}: {e}")
+            return
+        try:
+            self.thread_db().ingest_queue_add(filepath, get_priority(filepath))
+        except Exception as e:
+            log(f"Could not queue {filepath}: {e}")
+            return
+        self.wakeup.set()
+
+    def scan_existing(self) -> None:
+        """Queues files left in the ingest folder, e.g. by a restart after a safety timeout"""
+        for dirpath, __, filenames in os.walk(self.watch_folder):
+            for filename in sorted(filenames):
+                self.submit(os.path.join(dirpath, filename))
+
+    def inotify_command(self) -> list[str]:
+        command = ["inotifywait", "-m", "-r", "--format=%e %w%f", "-e", "close_write", "-e", "moved_to", self.watch_folder]
+        if shutil.which("s6-setuidgid"):
+            command = ["s6-setuidgid", "abc"] + command
+        return command
+
+    def fallback_command(self) -> list[str]:
+        return [sys.executable, os.path.join(SCRIPTS_DIR, "watch_fallback.py"), "--path", self.watch_folder, "--interval", "5"]
+
+    def run_watcher(self, command: list[str]) -> int:
+        """Runs a watcher that emits "EVENT PATH" lines and queues every path it reports"""
+        try:
+            self.watcher_proc = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+        except OSError as e:
+            log(f"Could not start watcher {command[0]}: {e}")
+            return 1
+        for line in self.watcher_proc.stdout:
+            __, __, filepath = line.rstrip("\n").partition(" ")
+            if filepath:
+                self.submit(filepath)
+        return self.watcher_proc.wait()
+
+    def watch(self) -> None:
+        if self.watch_mode == "inotify":
+            self.run_watcher(self.inotify_command())
+            if self.stop_event.is_set():
+                return
+            log("Falling back to polling watcher")
+        self.run_watcher(self.fallback_command())
+        if not self.stop_event.is_set():
+            log("Watcher exited unexpectedly, stopping so the service can be restarted")
+            self.stop_event.set()
+
+    ### PROCESSING
+
+    def begin_file(self, filepath: str) -> bool:
+        """Takes the ingest ProcessLock when the first file goes in flight. Returns False if another
+        ingest run (e.g. a manual library refresh) holds it"""
+        with self.begin_lock:
+            with self.in_flight_lock:
+                if self.in_flight:
+                    self.in_flight[filepath] = None
+                    return True
+            # Waiting for the lock mustn't hold up the watchdog or the files finishing on the other threads.
+            # Only begin_file adds to in_flight, so it's still empty once the lock is ours
+            if not ingest_processor.process_lock.acquire(timeout=10):
+                return False
+            with self.in_flight_lock:
+                self.in_flight[filepath] = None
+            return True
+
+    def set_stage_deadline(self, filepath: str, deadline: float | None) -> None:
+        """The safety timeout applies to each stage's work on a file, not to the time spent queued for it"""
+        with self.in_flight_lock:
+            if filepath in self.in_flight:
+                self.in_flight[filepath] = deadline
+
+    def end_file(self, filepath: str) -> None:
+        with self.in_flight_lock:
+            self.in_flight.pop(filepath, None)
+            if not self.in_flight:
+                ingest_processor.process_lock.release()
+
+    def watchdog(self) -> None:
+        while not self.stop_event.wait(5):
+            with self.in_flight_lock:
+                in_flight = list(self.in_flight.items())
+            for filepath, deadline in in_flight:
+                if deadline is None or time.time() <= deadline:
+                    continue
+                filename = os.path.basename(filepath)
+                log(f"SAFETY TIMEOUT: {filepath} took longer than safety timeout of {self.safety_timeout} seconds")
+                log(f"This indicates a serious issue - processor should have timed out internally at {self.safety_timeout // 3} seconds")
+                try:
+                    self.thread_db().ingest_queue_fail(filepath, "safety timeout", max_attempts=0)
+                except Exception as e:
+                    log(f"Could not update ingest queue for {filename}: {e}")
+                move_to_failed(filepath, "safety_timeout")
+                ingest_processor.process_lock.release()
+                # The stuck call can't be interrupted from here, exit and let s6 restart the daemon
+                os._exit(124)
+
+    def prepare(self, filepath: str) -> None:
+        """Prepare stage, runs on the worker pool and hands the result to the writer"""
+        nbp = None
+        error = ""
+        self.set_stage_deadline(filepath, time.time() + self.safety_timeout)
+        try:
+            # Waiting for the writer to finish happens in prepare_book (see file_readiness.py)
+            if os.path.exists(filepath):
+                log(f"New file detected - {filepath} - Starting Ingest Processor...")
+                db = self.thread_db()
+                self.refresh_settings(db)
+                nbp = ingest_processor.prepare_book(filepath, db)
+        except Exception as e:
+            log(f"Error preparing {filepath}: {e}")
+            error = str(e) or type(e).__name__
+        self.set_stage_deadline(filepath, None)
+        self.write_queue.put((filepath, nbp, error))
+        with self.in_flight_lock:
+            self.preparing -= 1
+        self.wakeup.set()
+
+    def files_waiting(self, batched: int) -> bool:
+        """True if files other than the ones already batched are still being prepared or waiting to be"""
+        with self.in_flight_lock:
+            in_flight = len(self.in_flight)
+        if in_flight > batched:
+            return True
+        try:
+            return self.thread_db().ingest_queue_size(due_only=True) > 0
+        except Exception:
+            return False
+
+    def next_batch(self) -> list | None:
+        """Waits for the next prepared file and, with ingest_batch_size > 1, gathers the files that finish
+        preparing within ingest_batch_window_seconds so they can be added with one calibredb call.
+        Doesn't wait at all when nothing else is in flight. Returns None once the daemon is stopping"""
+        item = self.write_queue.get()
+        if item is None:
+            return None
+        batch = [item]
+
+        db = self.thread_db()
+        self.refresh_settings(db)
+        batch_size = get_batch_size(db.cwa_settings.get('ingest_batch_size', 1))
+        deadline = time.time() + get_batch_window(db.cwa_settings.get('ingest_batch_window_seconds', 5))
+        while len(batch) < batch_size and self.files_waiting(len(batch)):
+            remaining = deadline - time.time()
+            if remaining <= 0:
+                break
+            try:
+                item = self.write_queue.get(timeout=remaining)
+            except queue.Empty:
+                break
+            if item is None:
+                # Write what we have, the loop in write() picks the shutdown up next
+                self.write_queue.put(None)
+                break
+            batch.append(item)
+        return batch
+
+    def write(self) -> None:
+        """Library-write stage, the only thread that runs calibredb against metadata.db"""
+        while True:
+            batch = self.next_batch()
+            if batch is None:
+                return
+
+            # One calibredb call handles the whole batch, so the batch gets one safety timeout per file
+            deadline = time.time() + self.safety_timeout * len(batch)
+            for filepath, __, __ in batch:
+                self.set_stage_deadline(filepath, deadline)
+
+            results = []
+            to_import = []
+            for filepath, nbp, error in batch:
+                if nbp is not None:
+                    if not error and nbp.prepare_error is not None:
+                        error = str(nbp.prepare_error) or type(nbp.prepare_error).__name__
+                    if not error:
+                        to_import.append(nbp)
+                results.append([filepath, nbp, error])
+
+            try:
+                if len(to_import) > 1:
+                    log(f"Adding {len(to_import)} books to the library in one batch")
+                if to_import:
+                    ingest_processor.import_books(to_import, self.thread_db())
+            except Exception as e:
+                log(f"Error importing batch of {len(to_import)} file(s): {e}")
+                for result in results:
+                    if result[1] in to_import:
+                        result[2] = str(e) or type(e).__name__
+
+            db = self.thread_db()
+            for filepath, nbp, error in results:
+                try:
+                    if nbp is not None:
+                        # Files that failed to prepare still hold their prepare worker's connection
+                        nbp.db = db
+                        nbp.cleanup()
+                except Exception as e:
+                    log(f"Error cleaning up {filepath}: {e}")
+                finally:
+                    self.end_file(filepath)
+
+                try:
+                    if error:
+                        self.record_failure(db, filepath, error)
+                    elif nbp is not None:
+                        log(f"Successfully processed: {filepath}")
+                        db.ingest_queue_complete(filepath)
+                    else:
+                        db.ingest_queue_fail(filepath, "file no longer exists", max_attempts=0)
+                except Exception as e:
+                    log(f"Could not update ingest queue for {filepath}: {e}")
+            # The ingest lock may have been released, let the dispatch loop carry on
+            self.wakeup.set()
+
+    def record_failure(self, db: CWA_DB, filepath: str, error: str) -> None:
+        """Schedules another attempt while the file is still in the ingest folder and attempts remain,
+        moves it to the failed backups once they've run out"""
+        if not os.path.exists(filepath):
+            # ingest_processor already moved it to the failed backups
+            db.ingest_queue_fail(filepath, error, max_attempts=0)
+            return
+        if db.ingest_queue_fail(filepath, error, MAX_ATTEMPTS, RETRY_BASE_DELAY, RETRY_MAX_DELAY):
+            log(f"Will retry {filepath} later: {error}")
+        else:
+            log(f"Giving up on {filepath} after {MAX_ATTEMPTS} attempt(s): {error}")
+            move_to_failed(filepath, "max_attempts")
+
+    ### DISPATCH
+
+    def start_file(self, db: CWA_DB, filepath: str) -> bool:
+        """Hands a claimed file to the prepare pool. Returns False if the ingest lock is held elsewhere,
+        in which case the file is put back in the queue and dispatching should pause"""
+        if not os.path.exists(filepath):
+            db.ingest_queue_fail(filepath, "file no longer exists", max_attempts=0)
+            return True
+        if not self.begin_file(filepath):
+            log(f"Processor busy, retrying in {BUSY_RETRY_DELAY} seconds: {filepath}")
+            db.ingest_queue_defer(filepath, BUSY_RETRY_DELAY)
+            return False
+        with self.in_flight_lock:
+            self.preparing += 1
+        self.prepare_pool.submit(self.prepare, filepath)
+        return True
+
+    def dispatch(self) -> None:
+        """Claims due files from the queue, highest priority first, while a prepare worker is free"""
+        db = self.thread_db()
+        while not self.stop_event.is_set():
+            with self.in_flight_lock:
+                if self.preparing >= self.num_workers:
+                    return
+            item = db.ingest_queue_claim()
+            if item is None:
+                return
+            if item["attempts"] > 1:
+                log(f"Retrying {item['path']} (attempt {item['attempts']} of {MAX_ATTEMPTS})")
+            if not self.start_file(db, item["path"]):
+                return
+
+    def migrate_legacy_queue(self) -> None:
+        """Moves entries from the flat retry queue file used by earlier versions into cwa.db"""
+        if os.path.isfile(LEGACY_QUEUE_FILE):
+            try:
+                with open(LEGACY_QUEUE_FILE, 'r') as f:
+                    queued = [line.strip() for line in f if line.strip()]
+                for queued_file in queued:
+                    if os.path.isfile(queued_file):
+                        self.submit(queued_file)
+                os.remove(LEGACY_QUEUE_FILE)
+                if queued:
+                    log(f"Moved {len(queued)} entries from the old retry queue file into cwa.db")
+            except OSError as e:
+                log(f"WARN: Could not migrate old retry queue file: {e}")
+        try:
+            os.remove(LEGACY_STATUS_FILE)
+        except OSError:
+            pass
+
+    def is_busy(self) -> bool:
+        with self.in_flight_lock:
+            return bool(self.in_flight)
+
+    def hash_dedupe_enabled(self) -> bool:
+        try:
+            return bool(self.thread_db().get_cwa_settings().get('auto_ingest_hash_dedupe', 0))
+        except Exception as e:
+            log(f"WARN: Could not read the content-hash dedupe setting: {e}")
+            return False
+
+    def backfill_hash_index(self) -> None:
+        """Hashes library files missing from the content-hash index, at idle I/O and the lowest CPU priority and
+        only while no books are being ingested. Waits until auto_ingest_hash_dedupe is switched on"""
+        while not self.hash_dedupe_enabled():
+            if self.stop_event.wait(HASH_SETTING_POLL_SECONDS):
+                return
+        # Linux lets a single thread be niced and ioniced through its native id
+        thread_id = threading.get_native_id()
+        try:
+            os.setpriority(os.PRIO_PROCESS, thread_id, 19)
+        except (AttributeError, OSError):
+            pass
+        if shutil.which("ionice"):
+            try:
+                subprocess.run(["ionice", "-c", "3", "-p", str(thread_id)], check=False, capture_output=True)
+            except OSError:
+                pass
+        try:
+            library_dir, calibre_db_path = hash_index.get_library_location()
+            added = hash_index.backfill(self.thread_db(), library_dir, calibre_db_path,
+                                        should_pause=self.is_busy, should_stop=self.stop_event.is_set,
+                                        log_prefix="[cwa-ingest-service]")
+            if added:
+                log(f"Added {added} library file(s) to the content-hash index")
+        except Exception as e:
+            log(f"WARN: Content-hash index backfill stopped: {e}")
+
+    def stop(self, *args) -> None:
+        self.stop_event.set()
+        self.wakeup.set()
+        if self.watcher_proc and self.watcher_proc.poll() is None:
+            self.watcher_proc.terminate()
+
+    def run(self) -> int:
+        log(f"Watching folder: {self.watch_folder} ({self.watch_mode}, {self.num_workers} prepare worker(s))")
+        db = self.thread_db()
+        requeued = db.ingest_queue_reset_processing()
+        if requeued:
+            log(f"Re-queued {requeued} file(s) left in processing by the previous run")
+        db.ingest_queue_prune()
+        db.ingest_timing_prune()
+        self.migrate_legacy_queue()
+
+        writer = threading.Thread(target=self.write, name="ingest-writer")
+        writer.start()
+        self.watcher_thread = threading.Thread(target=self.watch, name="ingest-watcher", daemon=True)
+        self.watcher_thread.start()
+        threading.Thread(target=self.watchdog, name="ingest-watchdog", daemon=True).start()
+        threading.Thread(target=self.backfill_hash_index, name="ingest-hash-backfill", daemon=True).start()
+
+        self.scan_existing()
+
+        while not self.stop_event.is_set():
+            self.wakeup.clear()
+            try:
+                self.dispatch()
+            except Exception as e:
+                log(f"Unexpected error dispatching queued files: {e}")
+            # Also wake up periodically so retries are picked up once their backoff has passed
+            self.wakeup.wait(timeout=5)
+
+        self.stop()
+        # Let books that are already being converted finish and be written before exiting
+        self.prepare_pool.shutdown(wait=True)
+        self.write_queue.put(None)
+        writer.join()
+        return 0
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Long-running CWA ingest service")
+    parser.add_argument("--path", required=True, help="Ingest folder to watch")
+    parser.add_argument("--watch-mode", choices=["inotify", "poll"], default="inotify",
+                        help="Use inotifywait (default) or the polling watcher")
+    args = parser.parse_args(argv)
+
+    if not os.path.isdir(args.path):
+        log(f"Ingest folder does not exist: {args.path}")
+        return 2
+
+    daemon = IngestDaemon(args.path, args.watch_mode)
+    signal.signal(signal.SIGTERM, daemon.stop)
+    signal.signal(signal.SIGINT, daemon.stop)
+    return daemon.run()
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -7,6 +7,7 @@
 import atexit
 import json
 import os
+import re
 import subprocess
 import sys
 import tempfile
@@ -14,11 +15,17 @@ import time
 import shutil
 import sqlite3
 import fcntl
+from contextlib import contextmanager
 from pathlib import Path
 
 from cwa_db import CWA_DB
 from kindle_epub_fixer import EPUBFixer
 import audiobook
+import library_permissions
+import hash_index
+from file_placement import place_file
+from file_readiness import FileReadiness
+from conversion_cache import ConversionCache
 
 # Optional: enable GDrive sync and auto-send by importing cps modules when available
 _GDRIVE_AVAILABLE = False
@@ -218,18 +225,16 @@ except Exception as e:
     if '_CPS_AVAILABLE' not in locals():
         _CPS_AVAILABLE = False
 
-def gdrive_sync_if_enabled():
-    """Sync Calibre library to Google Drive if enabled in app config."""
+def gdrive_sync_if_enabled() -> bool:
+    """Sync Calibre library to Google Drive if enabled in app config. Returns whether a sync was attempted"""
     if _GDRIVE_AVAILABLE and getattr(_cps_config, "config_use_google_drive", False):
         try:
             _gdriveutils.updateGdriveCalibreFromLocal()
             print("[ingest-processor] GDrive sync completed.", flush=True)
         except Exception as e:
             print(f"[ingest-processor] WARN: GDrive sync failed: {e}", flush=True)
-
-# Acquire process lock to prevent concurrent execution
-if not process_lock.acquire(timeout=10):
-    sys.exit(2)
+        return True
+    return False
 
 # Ensure processed backups directory structure exists so backups never crash on missing folders
 try:
@@ -248,9 +253,9 @@ backup_destinations = {
     }
 
 class NewBookProcessor:
-    def __init__(self, filepath: str):
-        # Settings / DB
-        self.db = CWA_DB()
+    def __init__(self, filepath: str, db: CWA_DB | None = None):
+        # Settings / DB (long-running callers such as ingest_daemon.py pass in a shared CWA_DB)
+        self.db = db if db is not None else CWA_DB()
         self.cwa_settings = self.db.cwa_settings
 
         # Core ingest settings
@@ -270,6 +275,7 @@ class NewBookProcessor:
         if isinstance(self.convert_retained_formats, str):
             self.convert_retained_formats = self.convert_retained_formats.split(',') if self.convert_retained_formats else []
         self.is_kindle_epub_fixer = self.cwa_settings['kindle_epub_fixer']
+        self.conversion_cache = ConversionCache(self.db, self.cwa_settings.get('conversion_cache_size_mb', 0), log_prefix="[ingest-processor]")
 
         # Formats
         self.supported_book_formats = {
@@ -293,14 +299,35 @@ class NewBookProcessor:
             except Exception as e:
                 print(f"[ingest-processor] WARN: Could not read config_calibre_dir from app.db, using default. Error: {e}", flush=True)
 
+        # Each file gets its own conversion/staging folder so several files can be prepared in parallel
         Path(self.tmp_conversion_dir).mkdir(exist_ok=True)
+        self.tmp_conversion_dir = tempfile.mkdtemp(prefix="ingest_", dir=self.tmp_conversion_dir) + "/"
         self.staging_dir = os.path.join(self.tmp_conversion_dir, "staging")
         Path(self.staging_dir).mkdir(exist_ok=True)
 
+        # Library writes recorded by the prepare stage, executed in order by import_book()
+        self.library_actions = []
+        self.prepare_error = None
+        self.readiness_wait = 0.0
+        # BLAKE2b hash of the file as it was dropped into the ingest folder (see hash_index.py)
+        self.content_hash = None
+        # Book folders (chowned recursively) and other library paths changed by this file's import
+        self.touched_trees = set()
+        self.touched_paths = set()
+        # Wall time per ingest stage and how the file ended up, recorded in cwa.db by record_timings()
+        self.started = time.monotonic()
+        self.stage_seconds = {}
+        self.outcome = "skipped"
+        self.output_format = ""
+
         # Current file
         self.filepath = filepath
         self.filename = os.path.basename(filepath)
         self.can_convert, self.input_format = self.can_convert_check()
+        try:
+            self.input_size = os.path.getsize(filepath)
+        except OSError:
+            self.input_size = 0
         # Determine if the file is already in the desired target format using normalized extensions
         self.is_target_format = (self.input_format.lower() == str(self.target_format).lower())
 
@@ -313,8 +340,23 @@ class NewBookProcessor:
         if self.split_library:
             self.library_dir = self.split_library["split_path"]
             self.calibre_env['CALIBRE_OVERRIDE_DATABASE_PATH'] = os.path.join(self.split_library["db_path"], "metadata.db")
+        self.calibre_db_path = self.calibre_env.get('CALIBRE_OVERRIDE_DATABASE_PATH', os.path.join(self.library_dir, 'metadata.db'))
 
     
+    @contextmanager
+    def timed(self, stage: str):
+        """Adds the wall time of the with block to the given stage"""
+        start = time.monotonic()
+        try:
+            yield
+        finally:
+            self.add_stage_time(stage, time.monotonic() - start)
+
+
+    def add_stage_time(self, stage: str, seconds: float) -> None:
+        self.stage_seconds[stage] = self.stage_seconds.get(stage, 0.0) + seconds
+
+
     def get_split_library(self) -> dict[str, str] | None:
         """Checks whether or not the user has split library enabled. Returns None if they don't and the path of the Split Library location if True."""
         with sqlite3.connect("/config/app.db", timeout=30) as con:
@@ -368,14 +410,23 @@ class NewBookProcessor:
                 raise KeyError(f"No backup destination for type '{backup_type}'")
             # Ensure destination directory exists
             os.makedirs(output_path, exist_ok=True)
-            shutil.copy2(input_file, output_path)
+            # Ingest files and staged copies are never modified in place, so the backup can share their inode
+            place_file(input_file, output_path, allow_link=True)
+            if backup_type == "failed" and self.outcome != "imported":
+                self.outcome = "failed"
         except Exception as e:
             # Never let backups crash ingest; just log the problem
             print(f"[ingest-processor]: ERROR - Failed to backup '{input_file}' to '{output_path}': {e}")
 
 
-    def convert_book(self, end_format=None) -> tuple[bool, str]:
-        """Uses the following terminal command to convert the books provided using the calibre converter tool:\n\n--- ebook-convert myfile.input_format myfile.output_format\n\nAnd then saves the resulting files to the calibre-web import folder."""
+    def conversion_cache_key(self, end_format: str, converters: list[str]) -> str | None:
+        """Key of this file's conversion to end_format in the conversion cache, None when it can't be cached"""
+        return self.conversion_cache.make_key(self.content_hash, end_format, converters, self.calibre_env)
+
+
+    def convert_book(self, end_format=None, use_cache=True) -> tuple[bool, str]:
+        """Uses the following terminal command to convert the books provided using the calibre converter tool:\n\n--- ebook-convert myfile.input_format myfile.output_format\n\nAnd then saves the resulting files to the calibre-web import folder.
+        A result from the conversion cache is used instead when this exact file was converted before"""
         print(f"[ingest-processor]: Starting conversion process for {self.filename}...", flush=True)
         print(f"[ingest-processor]: Converting file from {self.input_format} to {self.target_format} format...\n", flush=True)
         print(f"\n[ingest-processor]: START_CON: Converting {self.filename}...\n", flush=True)
@@ -385,12 +436,19 @@ class NewBookProcessor:
 
         original_filepath = Path(self.filepath)
         target_filepath = f"{self.tmp_conversion_dir}{original_filepath.stem}.{end_format}"
+        cache_key = self.conversion_cache_key(end_format, ["ebook-convert"]) if use_cache else None
         try:
-            t_convert_book_start = time.time()
-            subprocess.run(['ebook-convert', self.filepath, target_filepath], env=self.calibre_env, check=True)
-            t_convert_book_end = time.time()
-            time_book_conversion = t_convert_book_end - t_convert_book_start
-            print(f"\n[ingest-processor]: END_CON: Conversion of {self.filename} complete in {time_book_conversion:.2f} seconds.\n", flush=True)
+            if self.conversion_cache.fetch(cache_key, target_filepath):
+                print(f"\n[ingest-processor]: END_CON: {self.filename} was converted before, using the cached {end_format} instead of running ebook-convert.\n", flush=True)
+                cache_result = "hit"
+            else:
+                t_convert_book_start = time.time()
+                subprocess.run(['ebook-convert', self.filepath, target_filepath], env=self.calibre_env, check=True)
+                t_convert_book_end = time.time()
+                time_book_conversion = t_convert_book_end - t_convert_book_start
+                print(f"\n[ingest-processor]: END_CON: Conversion of {self.filename} complete in {time_book_conversion:.2f} seconds.\n", flush=True)
+                self.conversion_cache.store(cache_key, target_filepath)
+                cache_result = "miss" if cache_key else ""
 
             if self.cwa_settings['auto_backup_conversions']:
                 self.backup(self.filepath, backup_type="converted")
@@ -398,7 +456,8 @@ class NewBookProcessor:
             self.db.conversion_add_entry(original_filepath.stem,
                                         self.input_format,
                                         self.target_format,
-                                        str(self.cwa_settings["auto_backup_conversions"]))
+                                        str(self.cwa_settings["auto_backup_conversions"]),
+                                        cache_result)
 
             return True, target_filepath
 
@@ -413,6 +472,20 @@ class NewBookProcessor:
         """Kepubify is limited in that it can only convert from epubs. To get around this, CWA will automatically convert other
         supported formats to epub using the Calibre's conversion tools & then use Kepubify to produce your desired kepubs. Obviously multi-step conversions aren't ideal
         so if you notice issues with your converted files, bare in mind starting with epubs will ensure the best possible results"""
+        converters = ["kepubify"] if self.input_format == "epub" else ["ebook-convert", "kepubify"]
+        cache_key = self.conversion_cache_key("kepub", converters)
+        cached_filepath = f"{self.tmp_conversion_dir}{Path(self.filepath).stem}.kepub"
+        if self.conversion_cache.fetch(cache_key, cached_filepath):
+            print(f"[ingest-processor]: {self.filename} was converted before, using the cached kepub instead of running the conversion.", flush=True)
+            if self.cwa_settings['auto_backup_conversions']:
+                self.backup(self.filepath, backup_type="converted")
+            self.db.conversion_add_entry(Path(self.filepath).stem,
+                                        self.input_format,
+                                        self.target_format,
+                                        str(self.cwa_settings["auto_backup_conversions"]),
+                                        "hit")
+            return True, cached_filepath
+
         if self.input_format == "epub":
             print(f"[ingest-processor]: File in epub format, converting directly to kepub...", flush=True)
             converted_filepath = self.filepath
@@ -421,20 +494,23 @@ class NewBookProcessor:
             print("\n[ingest-processor]: *** NOTICE TO USER: Kepubify is limited in that it can only convert from epubs. To get around this, CWA will automatically convert other"
             "supported formats to epub using the Calibre's conversion tools & then use Kepubify to produce your desired kepubs. Obviously multi-step conversions aren't ideal"
             "so if you notice issues with your converted files, bare in mind starting with epubs will ensure the best possible results***\n", flush=True)
-            convert_successful, converted_filepath = self.convert_book(end_format="epub") # type: ignore
+            # Only the final kepub is cached, not the intermediate epub
+            convert_successful, converted_filepath = self.convert_book(end_format="epub", use_cache=False) # type: ignore
             
         if convert_successful:
             converted_filepath = Path(converted_filepath)
             target_filepath = f"{self.tmp_conversion_dir}{converted_filepath.stem}.kepub"
             try:
                 subprocess.run(['kepubify', '--inplace', '--calibre', '--output', self.tmp_conversion_dir, converted_filepath], check=True)
+                self.conversion_cache.store(cache_key, target_filepath)
                 if self.cwa_settings['auto_backup_conversions']:
                     self.backup(self.filepath, backup_type="converted")
 
                 self.db.conversion_add_entry(converted_filepath.stem,
                                             self.input_format,
                                             self.target_format,
-                                            str(self.cwa_settings["auto_backup_conversions"]))
+                                            str(self.cwa_settings["auto_backup_conversions"]),
+                                            "miss" if cache_key else "")
 
                 return True, target_filepath
 
@@ -472,43 +548,32 @@ class NewBookProcessor:
 
     def is_file_in_use(self, timeout: float = None) -> bool:
         """Wait until the file is no longer in use (write handle is closed) or timeout is reached.
-        Returns True if file is ready, False if timed out or file vanished."""
+        Returns True if file is ready, False if timed out or file vanished. How long it took is kept in
+        self.readiness_wait"""
         
         # Use configured timeout from CWA settings (default 15 minutes if not configured)
         if timeout is None:
             timeout_minutes = self.cwa_settings.get('ingest_timeout_minutes', 15)
             timeout = timeout_minutes * 60  # Convert to seconds
-        
-        start = time.time()
-        while time.time() - start < timeout:
-            if not os.path.exists(self.filepath):
-                return False
-            try:
-                # lsof '-F f' gets file access mode; we check for 'w' (write).
-                # Add timeout to prevent hanging (issue #654)
-                result = subprocess.run(['lsof', '-F', 'f', '--', self.filepath], 
-                                      capture_output=True, text=True, timeout=10)
-                if 'w' not in result.stdout:
-                    return True # Not in use for writing
-            except subprocess.TimeoutExpired:
-                print("[ingest-processor] WARN: lsof command timed out. Assuming file is not in use.", flush=True)
-                return True  # If lsof hangs, assume file is ready to avoid indefinite wait
-            except FileNotFoundError:
-                print("[ingest-processor] WARN: 'lsof' command not found. Cannot reliably check if file is in use. Proceeding with caution.", flush=True)
-                return True # Fallback for systems without lsof
-            except Exception as e:
-                print(f"[ingest-processor] WARN: Error checking file usage with lsof: {e}", flush=True)
-                # On error, wait and retry to be safe
-            time.sleep(1)
-        return False # Timeout reached
 
+        result = FileReadiness().wait_until_ready(self.filepath, timeout)
+        self.readiness_wait = result.waited
+        self.add_stage_time("readiness_wait", result.waited)
+        if result.ready:
+            print(f"[ingest-processor] {self.filename} ready after waiting {result.waited:.2f} seconds ({result.method})", flush=True)
+        else:
+            print(f"[ingest-processor] {self.filename} not ready after waiting {result.waited:.2f} seconds ({result.method}, {result.reason})", flush=True)
+        return result.ready
 
 
-    def add_book_to_library(self, book_path:str, text: bool=True, format: str="text" ) -> None:
+
+    def queue_import(self, book_path:str, text: bool=True, format: str="text") -> None:
+        """Prepare stage: runs the kindle-epub-fixer when enabled and records the resulting file for the library-write stage"""
         # If kindle-epub-fixer is on, run it first and import the *fixed* file.
         if self.target_format == "epub" and self.is_kindle_epub_fixer:
             fixed_epub_path = Path(self.tmp_conversion_dir) / os.path.basename(book_path)
-            self.run_kindle_epub_fixer(book_path, dest=self.tmp_conversion_dir)
+            with self.timed("epub_fixer"):
+                self.run_kindle_epub_fixer(book_path, dest=self.tmp_conversion_dir)
             try:
                 # Use the fixed path only if the fixer succeeded and created a non-empty file
                 if fixed_epub_path.exists() and fixed_epub_path.stat().st_size > 0:
@@ -523,36 +588,58 @@ class NewBookProcessor:
                     print(f"[ingest-processor] An error occurred while checking the fixed EPUB path on {book_path}:\n{e}", flush=True)
                     raise
 
-        # Capture the current max(timestamp) in Calibre DB so we can detect rows whose last_modified was bumped by an overwrite
-        pre_import_max_timestamp = None
-        if self.cwa_settings.get('auto_ingest_automerge') == 'overwrite':
-            try:
-                calibre_db_path = os.path.join(self.library_dir, 'metadata.db')
-                with sqlite3.connect(calibre_db_path, timeout=30) as con:
-                    cur = con.cursor()
-                    pre_import_max_timestamp = cur.execute('SELECT MAX(timestamp) FROM books').fetchone()[0]
-            except Exception as e:
-                print(f"[ingest-processor] WARN: Could not read pre-import max timestamp: {e}", flush=True)
+        self.library_actions.append(("add", book_path, text, format))
+        self.output_format = Path(book_path).suffix[1:].lower()
 
-        print("[ingest-processor]: Importing new book to CWA...")
+
+    def get_pre_import_max_timestamp(self):
+        """Captures the current max(timestamp) in Calibre DB so we can detect rows whose last_modified was bumped by an overwrite"""
+        if self.cwa_settings.get('auto_ingest_automerge') != 'overwrite':
+            return None
+        try:
+            calibre_db_path = os.path.join(self.library_dir, 'metadata.db')
+            with sqlite3.connect(calibre_db_path, timeout=30) as con:
+                cur = con.cursor()
+                return cur.execute('SELECT MAX(timestamp) FROM books').fetchone()[0]
+        except Exception as e:
+            print(f"[ingest-processor] WARN: Could not read pre-import max timestamp: {e}", flush=True)
+            return None
+
+
+    def stage_for_import(self, book_path:str) -> Path | None:
+        """Copies the file to import into this file's staging dir. Returns None (after backing up the
+        original as failed) if it is missing, empty or can't be copied"""
         source_path = Path(book_path)
         if not source_path.exists() or source_path.stat().st_size == 0:
             print(f"[ingest-processor] ERROR: Import file is missing or empty, skipping: {book_path}", flush=True)
             self.backup(self.filepath, backup_type="failed") # Backup original file
-            return
+            return None
 
-        # Stage file for import
         staged_path = Path(self.staging_dir) / source_path.name
         try:
-            shutil.copy2(source_path, staged_path)
+            strategy = place_file(str(source_path), str(staged_path), allow_link=True)
+            print(f"[ingest-processor] Staged {source_path.name} for import ({strategy})", flush=True)
         except Exception as e:
             print(f"[ingest-processor] ERROR: Failed to stage file for import: {e}", flush=True)
             self.backup(self.filepath, backup_type="failed")
+            return None
+        return staged_path
+
+
+    def add_book_to_library(self, book_path:str, text: bool=True, format: str="text" ) -> None:
+        pre_import_max_timestamp = self.get_pre_import_max_timestamp()
+
+        print("[ingest-processor]: Importing new book to CWA...")
+        # Stage file for import
+        staged_path = self.stage_for_import(book_path)
+        if staged_path is None:
             return
 
+        snapshot = library_permissions.snapshot_library(self.calibre_db_path)
         try:
             if text:
-                subprocess.run(["calibredb", "add", str(staged_path), "--automerge", self.cwa_settings['auto_ingest_automerge'], f"--library-path={self.library_dir}"], env=self.calibre_env, check=True)
+                with self.timed("calibredb"):
+                    subprocess.run(["calibredb", "add", str(staged_path), "--automerge", self.cwa_settings['auto_ingest_automerge'], f"--library-path={self.library_dir}"], env=self.calibre_env, check=True)
             else:  # audiobook path
                 meta = audiobook.get_audio_file_info(str(staged_path), format, os.path.basename(str(staged_path)), False)
 
@@ -593,46 +680,21 @@ class NewBookProcessor:
                     if isinstance(ident, str) and ":" in ident and ident.strip():
                         add_command.extend(["--identifier", ident.strip()])
 
-                subprocess.run(add_command, env=self.calibre_env, check=True)
-            
-            print(f"[ingest-processor] Added {staged_path.stem} to Calibre database", flush=True)
-
-            if self.cwa_settings['auto_backup_imports']:
-                self.backup(str(staged_path), backup_type="imported")
+                with self.timed("calibredb"):
+                    subprocess.run(add_command, env=self.calibre_env, check=True)
 
-            self.db.import_add_entry(staged_path.stem,
-                                    str(self.cwa_settings["auto_backup_imports"]))
+            self.record_import(staged_path, book_path)
+            self.record_content_hash(self.imported_book_id(snapshot), Path(staged_path).suffix[1:])
 
             # Optional post-import GDrive sync
-            gdrive_sync_if_enabled()
-
-            # Fetch metadata if enabled
-            self.fetch_metadata_if_enabled(staged_path.stem)
+            sync_start = time.monotonic()
+            if gdrive_sync_if_enabled():
+                self.add_stage_time("gdrive_sync", time.monotonic() - sync_start)
 
-            # Trigger auto-send for users who have it enabled
-            self.trigger_auto_send_if_enabled(staged_path.stem, book_path)
+            # The web process notices the metadata.db write by itself and drops its cached objects
+            # (see CalibreDB.invalidate_if_changed), so there is no session to refresh from here
 
-            # CRITICAL FIX: Refresh Calibre-Web's database session to make new books visible
-            # This solves the issue where multiple books don't appear until container restart
-            self.refresh_cwa_session()
-
-            # If we overwrote an existing book, Calibre does not bump books.timestamp, only last_modified.
-            # Update timestamp to last_modified for any rows changed by this import so sorting by 'new' reflects overwrites.
-            if self.cwa_settings.get('auto_ingest_automerge') == 'overwrite':
-                try:
-                    calibre_db_path = os.path.join(self.library_dir, 'metadata.db')
-                    with sqlite3.connect(calibre_db_path, timeout=30) as con:
-                        cur = con.cursor()
-                        # pre_import_max_timestamp may be None (empty library) -> update all rows where timestamp < last_modified
-                        if pre_import_max_timestamp is None:
-                            cur.execute('UPDATE books SET timestamp = last_modified WHERE timestamp < last_modified')
-                        else:
-                            cur.execute('UPDATE books SET timestamp = last_modified WHERE last_modified > ? AND timestamp < last_modified', (pre_import_max_timestamp,))
-                        affected = cur.rowcount
-                        if affected:
-                            print(f"[ingest-processor] INFO: Updated timestamp for {affected} overwritten book(s) to reflect latest import.", flush=True)
-                except Exception as e:
-                    print(f"[ingest-processor] WARN: Failed to adjust timestamps after overwrite import: {e}", flush=True)
+            self.fix_overwrite_timestamps(pre_import_max_timestamp)
 
         except subprocess.CalledProcessError as e:
             print(f"[ingest-processor] {staged_path.stem} was not able to be added to the Calibre Library due to the following error:\nCALIBREDB EXIT/ERROR CODE: {e.returncode}\n{e.stderr}", flush=True)
@@ -640,9 +702,127 @@ class NewBookProcessor:
         except Exception as e:
             print(f"[ingest-processor] ingest-processor ran into the following error:\n{e}", flush=True)
         finally:
+            self.record_library_changes(snapshot)
             if staged_path.exists():
                 os.remove(staged_path)
 
+
+    def record_library_changes(self, snapshot) -> None:
+        """Remembers the library paths calibredb changed since snapshot, for set_library_permissions()"""
+        trees, paths = library_permissions.touched_library_paths(self.library_dir, self.calibre_db_path, snapshot)
+        self.touched_trees |= trees
+        self.touched_paths |= paths
+
+
+    def record_import(self, staged_path:Path, book_path:str, book_id:int | None = None) -> None:
+        """Per-book follow-ups once calibredb has added the staged file. book_id is passed when the
+        caller knows it (batch imports), otherwise the book is looked up by title"""
+        print(f"[ingest-processor] Added {staged_path.stem} to Calibre database", flush=True)
+        self.outcome = "imported"
+
+        if self.cwa_settings['auto_backup_imports']:
+            self.backup(str(staged_path), backup_type="imported")
+
+        self.db.import_add_entry(staged_path.stem,
+                                str(self.cwa_settings["auto_backup_imports"]))
+
+        # Fetch metadata if enabled
+        with self.timed("metadata_fetch"):
+            self.fetch_metadata_if_enabled(staged_path.stem, book_id)
+
+        # Trigger auto-send for users who have it enabled
+        with self.timed("auto_send"):
+            self.trigger_auto_send_if_enabled(staged_path.stem, book_path, book_id)
+
+
+    def imported_book_id(self, snapshot) -> int | None:
+        """Id of the book a single calibredb add just created, or with automerge=overwrite the book it merged
+        into, found by comparing metadata.db against the snapshot taken before the add"""
+        if snapshot is None:
+            return None
+        max_id, max_last_modified = snapshot
+        try:
+            with sqlite3.connect(self.calibre_db_path, timeout=30) as con:
+                row = con.execute("SELECT MAX(id) FROM books WHERE id > ?", (max_id,)).fetchone()
+                if row and row[0] is not None:
+                    return row[0]
+                if max_last_modified is not None:
+                    row = con.execute("SELECT id FROM books WHERE last_modified > ? ORDER BY last_modified DESC LIMIT 1", (max_last_modified,)).fetchone()
+                    return row[0] if row else None
+        except sqlite3.Error as e:
+            print(f"[ingest-processor] WARN: Could not look up the id of the imported book: {e}", flush=True)
+        return None
+
+
+    def hash_content(self) -> None:
+        """Hashes the file as it was dropped into the ingest folder, before conversion changes it"""
+        try:
+            self.content_hash = hash_index.file_hash(self.filepath)
+        except OSError as e:
+            print(f"[ingest-processor] WARN: Could not hash {self.filename}: {e}", flush=True)
+
+
+    def check_known_content(self) -> bool:
+        """Looks the file up in the content-hash index. When the exact same file was imported before and the
+        book still has the format it was imported as, auto_ingest_hash_dedupe is on and automerge=ignore,
+        the file is dropped without converting it or running calibredb add --automerge. Everything else,
+        overwriting a known book or restoring a format it's missing, goes through the normal conversion
+        and kindle-epub-fixer path. Returns True when the file has been dealt with"""
+        if self.content_hash is None or not self.cwa_settings.get('auto_ingest_hash_dedupe', 0):
+            return False
+        if self.cwa_settings.get('auto_ingest_automerge') != 'ignore':
+            return False
+        matches = self.db.hash_index_lookup(self.content_hash)
+        if not matches:
+            return False
+        try:
+            library_formats = hash_index.book_formats(self.calibre_db_path, list({book_id for book_id, __ in matches}))
+        except sqlite3.Error as e:
+            print(f"[ingest-processor] WARN: Could not check the content-hash index against the library: {e}", flush=True)
+            return False
+
+        for book_id, book_format in matches:
+            if book_id not in library_formats:
+                # The book was deleted since, forget it
+                self.db.hash_index_remove(self.content_hash, book_id)
+                continue
+            if book_format in library_formats[book_id]:
+                print(f"[ingest-processor] {self.filename} is already in the library as book id {book_id} ({book_format}, content hash match), skipping", flush=True)
+                self.outcome = "duplicate"
+                return True
+        return False
+
+
+    def record_content_hash(self, book_id: int | None, book_format: str) -> None:
+        """Adds this file's content hash to the index once it has been imported as book_id"""
+        if self.content_hash is None or book_id is None:
+            return
+        try:
+            self.db.hash_index_add(self.content_hash, book_id, book_format, source="ingest")
+        except Exception as e:
+            print(f"[ingest-processor] WARN: Could not record content hash of {self.filename}: {e}", flush=True)
+
+
+    def fix_overwrite_timestamps(self, pre_import_max_timestamp) -> None:
+        """If we overwrote an existing book, Calibre does not bump books.timestamp, only last_modified.
+        Update timestamp to last_modified for any rows changed by this import so sorting by 'new' reflects overwrites."""
+        if self.cwa_settings.get('auto_ingest_automerge') != 'overwrite':
+            return
+        try:
+            calibre_db_path = os.path.join(self.library_dir, 'metadata.db')
+            with sqlite3.connect(calibre_db_path, timeout=30) as con:
+                cur = con.cursor()
+                # pre_import_max_timestamp may be None (empty library) -> update all rows where timestamp < last_modified
+                if pre_import_max_timestamp is None:
+                    cur.execute('UPDATE books SET timestamp = last_modified WHERE timestamp < last_modified')
+                else:
+                    cur.execute('UPDATE books SET timestamp = last_modified WHERE last_modified > ? AND timestamp < last_modified', (pre_import_max_timestamp,))
+                affected = cur.rowcount
+                if affected:
+                    print(f"[ingest-processor] INFO: Updated timestamp for {affected} overwritten book(s) to reflect latest import.", flush=True)
+        except Exception as e:
+            print(f"[ingest-processor] WARN: Failed to adjust timestamps after overwrite import: {e}", flush=True)
+
     def add_format_to_book(self, book_id:int, book_path:str) -> None:
         """Attach a new format file to an existing Calibre book using calibredb add_format"""
         source_path = Path(book_path)
@@ -654,40 +834,65 @@ class NewBookProcessor:
         # Stage file for import
         staged_path = Path(self.staging_dir) / source_path.name
         try:
-            shutil.copy2(source_path, staged_path)
+            strategy = place_file(str(source_path), str(staged_path), allow_link=True)
+            print(f"[ingest-processor] Staged {source_path.name} for add_format ({strategy})", flush=True)
         except Exception as e:
             print(f"[ingest-processor] ERROR: Failed to stage file for add_format: {e}", flush=True)
             self.backup(self.filepath, backup_type="failed")
             return
 
+        if not self.output_format:
+            self.output_format = source_path.suffix[1:].lower()
+        snapshot = library_permissions.snapshot_library(self.calibre_db_path)
         try:
-            subprocess.run([
-                "calibredb", "add_format", str(book_id), str(staged_path), f"--library-path={self.library_dir}"
-            ], env=self.calibre_env, check=True)
+            with self.timed("calibredb"):
+                subprocess.run([
+                    "calibredb", "add_format", str(book_id), str(staged_path), f"--library-path={self.library_dir}"
+                ], env=self.calibre_env, check=True)
             print(f"[ingest-processor] Added new format for book id {book_id}: {os.path.basename(str(staged_path))}", flush=True)
+            self.outcome = "imported"
+            if os.path.normpath(book_path) == os.path.normpath(self.filepath):
+                self.record_content_hash(book_id, source_path.suffix[1:])
             if self.cwa_settings['auto_backup_imports']:
                 self.backup(str(staged_path), backup_type="imported")
             # Optional post-add-format GDrive sync
-            gdrive_sync_if_enabled()
+            sync_start = time.monotonic()
+            if gdrive_sync_if_enabled():
+                self.add_stage_time("gdrive_sync", time.monotonic() - sync_start)
         except subprocess.CalledProcessError as e:
             print(f"[ingest-processor] Failed to add format for book id {book_id}: {os.path.basename(str(staged_path))}\nCALIBREDB EXIT/ERROR CODE: {e.returncode}\n{e.stderr}", flush=True)
             self.backup(str(staged_path), backup_type="failed")
         except Exception as e:
             print(f"[ingest-processor] Unexpected error while adding format for book id {book_id}: {e}", flush=True)
         finally:
+            self.record_library_changes(snapshot)
             if staged_path.exists():
                 os.remove(staged_path)
 
 
     def run_kindle_epub_fixer(self, filepath:str, dest=None) -> None:
         try:
-            EPUBFixer().process(input_path=filepath, output_path=dest)
+            # Files being ingested are never rewritten in place, so an unchanged EPUB can be hardlinked
+            EPUBFixer(db=self.db).process(input_path=filepath, output_path=dest, allow_link=True)
             print(f"[ingest-processor] {os.path.basename(filepath)} successfully processed with the cwa-kindle-epub-fixer!")
         except Exception as e:
             print(f"[ingest-processor] An error occurred while processing {os.path.basename(filepath)} with the kindle-epub-fixer. See the following error:\n{e}")
 
 
-    def fetch_metadata_if_enabled(self, book_title: str) -> None:
+    def find_imported_book(self, book_title: str, book_id: int | None = None) -> tuple[int, str] | None:
+        """Returns (id, title) of the book that was just added, by id when it is known or else the most
+        recently added book with this title"""
+        calibre_db_path = os.path.join(self.library_dir, 'metadata.db')
+        with sqlite3.connect(calibre_db_path, timeout=30) as con:
+            cur = con.cursor()
+            if book_id is not None:
+                cur.execute("SELECT id, title FROM books WHERE id = ?", (book_id,))
+            else:
+                cur.execute("SELECT id, title FROM books WHERE title LIKE ? ORDER BY timestamp DESC LIMIT 1", (f"%{book_title}%",))
+            return cur.fetchone()
+
+
+    def fetch_metadata_if_enabled(self, book_title: str, book_id: int | None = None) -> None:
         """Fetch and apply metadata for newly ingested books if enabled"""
         if not _CPS_AVAILABLE:
             print("[ingest-processor] CPS modules not available, skipping metadata fetch", flush=True)
@@ -698,13 +903,7 @@ class NewBookProcessor:
             return
             
         try:
-            # Find the book that was just added to get its ID
-            calibre_db_path = os.path.join(self.library_dir, 'metadata.db')
-            with sqlite3.connect(calibre_db_path, timeout=30) as con:
-                cur = con.cursor()
-                # Get the most recently added book with this title
-                cur.execute("SELECT id, title FROM books WHERE title LIKE ? ORDER BY timestamp DESC LIMIT 1", (f"%{book_title}%",))
-                result = cur.fetchone()
+            result = self.find_imported_book(book_title, book_id)
                 
             if not result:
                 print(f"[ingest-processor] Could not find book ID for metadata fetch: {book_title}", flush=True)
@@ -725,7 +924,7 @@ class NewBookProcessor:
             print(f"[ingest-processor] Error fetching metadata: {e}", flush=True)
 
 
-    def trigger_auto_send_if_enabled(self, book_title: str, book_path: str) -> None:
+    def trigger_auto_send_if_enabled(self, book_title: str, book_path: str, book_id: int | None = None) -> None:
         """Trigger auto-send for users who have it enabled"""
         if not _CPS_AVAILABLE:
             print("[ingest-processor] CPS modules not available, skipping auto-send", flush=True)
@@ -736,13 +935,7 @@ class NewBookProcessor:
             return
             
         try:
-            # Find the book that was just added to get its ID
-            calibre_db_path = os.path.join(self.library_dir, 'metadata.db')
-            with sqlite3.connect(calibre_db_path, timeout=30) as con:
-                cur = con.cursor()
-                # Get the most recently added book(s) with this title
-                cur.execute("SELECT id, title FROM books WHERE title LIKE ? ORDER BY timestamp DESC LIMIT 1", (f"%{book_title}%",))
-                result = cur.fetchone()
+            result = self.find_imported_book(book_title, book_id)
                 
             if not result:
                 print(f"[ingest-processor] Could not find book ID for auto-send: {book_title}", flush=True)
@@ -777,8 +970,8 @@ class NewBookProcessor:
                     task_message = f"Auto-sending '{actual_title}' to {username}'s eReader(s)"
                     task = TaskAutoSend(task_message, book_id, user_id, delay_minutes)
                     
-                    # Add to worker queue
-                    WorkerThread.add(username, task)
+                    # Add to worker queue, held back until metadata fetching had time to finish
+                    WorkerThread.add(username, task, delay=delay_minutes * 60)
                     
                     print(f"[ingest-processor] Queued auto-send for '{actual_title}' to user {username} ({kindle_mail})", flush=True)
                     
@@ -789,52 +982,402 @@ class NewBookProcessor:
             print(f"[ingest-processor] Error in auto-send trigger: {e}", flush=True)
 
 
-    def refresh_cwa_session(self) -> None:
-        """Refresh Calibre-Web's database session to make newly added books visible
-        
-        This solves the issue where external calibredb adds aren't immediately visible
-        in Calibre-Web until container restart.
-        """
-        if not _CPS_AVAILABLE:
-            print("[ingest-processor] CPS modules not available, skipping session refresh", flush=True)
+    def set_library_permissions(self):
+        """Sets abc:abc ownership on just the book/author folders and database files this import changed,
+        the periodic cwa-library-permissions service reconciles the rest of the library"""
+        if not self.touched_trees and not self.touched_paths:
             return
-            
+        with self.timed("permissions"):
+            library_permissions.fix_ownership(self.touched_trees, self.touched_paths, log_prefix="[ingest-processor]")
+
+
+    def add_retained_format(self, filepath:str, book_id:int | None = None) -> None:
+        """Adds the original file as an additional format of the book that was just imported. Batch imports
+        pass the book_id they mapped to this file, otherwise the most recently added book is used"""
+        print(f"[ingest-processor]: Retaining original format ({self.input_format}) for {self.filename}...", flush=True)
+        # Find the book that was just added to get its ID
         try:
-            # Import here to avoid circular imports and ensure CPS is available
-            from cps.tasks.database import TaskReconnectDatabase
-            
-            # Create and run the reconnect task
-            task = TaskReconnectDatabase()
-            print("[ingest-processor] Refreshing Calibre-Web database session...", flush=True)
-            
-            # Run the task directly - this forces a database session refresh
-            # which makes newly imported books immediately visible in the UI
-            task.run(None)  # worker_thread not needed for direct execution
-            
-            print("[ingest-processor] Database session refreshed successfully", flush=True)
-            
-        except ImportError as e:
-            print(f"[ingest-processor] Could not import TaskReconnectDatabase: {e}", flush=True)
+            if book_id is not None:
+                result = (book_id,)
+            else:
+                calibre_db_path = os.path.join(self.library_dir, 'metadata.db')
+                with sqlite3.connect(calibre_db_path, timeout=30) as con:
+                    cur = con.cursor()
+                    # Get the most recently added book - use title/author for more reliable matching
+                    # in case of concurrent ingests
+                    cur.execute("""
+                        SELECT id FROM books 
+                        WHERE path = (SELECT path FROM books ORDER BY timestamp DESC LIMIT 1)
+                        ORDER BY timestamp DESC LIMIT 1
+                    """)
+                    result = cur.fetchone()
+
+            if result:
+                book_id = result[0]
+                # Verify the original file still exists before trying to add it
+                if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
+                    self.add_format_to_book(book_id, filepath)
+                else:
+                    print(f"[ingest-processor] Original file no longer exists or is empty, cannot retain format: {filepath}", flush=True)
+            else:
+                print(f"[ingest-processor] Could not find book ID to add retained format for: {self.filename}", flush=True)
         except Exception as e:
-            print(f"[ingest-processor] Error refreshing database session: {e}", flush=True)
-            # Don't fail the import if session refresh fails
-            print("[ingest-processor] Continuing despite session refresh failure - books may require manual refresh", flush=True)
+            print(f"[ingest-processor] Error adding retained format: {e}", flush=True)
 
 
-    def set_library_permissions(self):
+    def cleanup(self) -> None:
+        """Fixes library permissions, removes the processed file and this file's temp conversion folder,
+        then records how long each stage took"""
         try:
-            nsm = os.getenv("NETWORK_SHARE_MODE", "false").strip().lower() in ("1", "true", "yes", "on")
-            if not nsm:
-                subprocess.run(["chown", "-R", "abc:abc", self.library_dir], check=True)
-            else:
-                print(f"[ingest-processor] NETWORK_SHARE_MODE=true detected; skipping chown of {self.library_dir}", flush=True)
+            self.set_library_permissions()
+        except Exception as e:
+            print(f"[ingest-processor] Error setting library permissions during cleanup: {e}", flush=True)
+
+        try:
+            self.delete_current_file()
+        except Exception as e:
+            print(f"[ingest-processor] Error deleting current file during cleanup: {e}", flush=True)
+
+        try:
+            # Cleanup this file's temp conversion folder, which also contains its staging dir
+            shutil.rmtree(self.tmp_conversion_dir, ignore_errors=True)
+        except Exception as e:
+            print(f"[ingest-processor] Error cleaning up temp conversion directory: {e}", flush=True)
+
+        self.record_timings()
+
+
+    def record_timings(self) -> None:
+        """Writes this file's stage timings to cwa_ingest_timings for the stats page. Files ingest didn't
+        act on (ignored temporaries, unsupported formats) aren't recorded"""
+        if self.outcome == "skipped":
+            return
+        try:
+            self.db.ingest_timing_add(self.filename, self.input_format, self.output_format, self.input_size,
+                                      self.outcome, time.monotonic() - self.started, self.stage_seconds)
+        except Exception as e:
+            print(f"[ingest-processor] WARN: Could not record ingest timings for {self.filename}: {e}", flush=True)
+
+
+def truncate_filename(filepath:str, max_length:int=150) -> str:
+    """Truncates the filename if it is too long, returning the (possibly renamed) path"""
+    filename = os.path.basename(filepath)
+    name, ext = os.path.splitext(filename)
+    allowed_len = max_length - len(ext)
+
+    if len(name) > allowed_len:
+        new_name = name[:allowed_len] + ext
+        new_path = os.path.join(os.path.dirname(filepath), new_name)
+        os.rename(filepath, new_path)
+        return new_path
+    return filepath
+
+
+def prepare_book(filepath:str, db=None) -> NewBookProcessor:
+    """Stage 1 of ingest: readiness check, conversion and the kindle-epub-fixer. Touches nothing but the
+    file's own temp folder and cwa.db, so several files can be prepared in parallel. The library writes
+    are recorded in nbp.library_actions for import_book(). Errors are stored in nbp.prepare_error so
+    the caller can still run nbp.cleanup()"""
+    nbp = NewBookProcessor(filepath, db)
+    try:
+        _prepare_book(nbp, filepath)
+    except Exception as e:
+        print(f"[ingest-processor] Unexpected error while preparing {nbp.filename}: {e}", flush=True)
+        nbp.library_actions = []
+        nbp.prepare_error = e
+        nbp.outcome = "failed"
+    return nbp
+
+
+def _prepare_book(nbp:NewBookProcessor, filepath:str) -> None:
+    # If this file is not an ignored temporary, wait briefly for stability to avoid importing a still-growing file
+    ext_tmp_check = Path(nbp.filename).suffix.replace('.', '')
+    if ext_tmp_check not in nbp.ingest_ignored_formats:
+        timeout_minutes = nbp.cwa_settings.get('ingest_timeout_minutes', 15)
+        print(f"[ingest-processor] Checking if file is ready (timeout: {timeout_minutes} minutes): {nbp.filename}", flush=True)
+        ready = nbp.is_file_in_use()
+        if not ready:
+            print(f"[ingest-processor] WARN: File did not become ready in time or vanished (after {timeout_minutes} minutes): {nbp.filename}", flush=True)
+            nbp.outcome = "not_ready"
+            return
+
+    # Sidecar manifest handling for explicit actions (e.g., add_format)
+    manifest_path = filepath + ".cwa.json"
+    try:
+        if Path(manifest_path).exists():
+            with open(manifest_path, 'r', encoding='utf-8') as mf:
+                manifest = json.load(mf)
+            action = manifest.get("action")
+            if action == "add_format":
+                try:
+                    book_id = int(manifest.get("book_id", -1))
+                except Exception:
+                    book_id = -1
+                if book_id > -1:
+                    nbp.library_actions.append(("add_format", book_id, filepath))
+                else:
+                    print(f"[ingest-processor] Invalid book_id in manifest for {os.path.basename(filepath)}", flush=True)
+                # Cleanup manifest regardless of outcome, the file itself is removed by cleanup()
+                try:
+                    os.remove(manifest_path)
+                except Exception:
+                    ...
+                return
+    except Exception as e:
+        print(f"[ingest-processor] Error processing manifest file: {e}", flush=True)
+        # Continue with normal processing if manifest handling fails
+
+    # Check if the user has chosen to exclude files of this type from the ingest process
+    # Remove . (dot), check is against exclude whitout dot
+    ext = Path(nbp.filename).suffix.replace('.', '')
+    if ext in nbp.ingest_ignored_formats:
+        # Do NOT delete ignored temporary files; they may be renamed shortly (e.g. .uploading -> .epub)
+        print(f"[ingest-processor] Skipping ignored/temporary file (no action taken): {nbp.filename}", flush=True)
+        return
+
+    with nbp.timed("hash"):
+        nbp.hash_content()
+    if nbp.check_known_content():
+        return
+
+    if nbp.is_target_format: # File can just be imported
+        print(f"\n[ingest-processor]: No conversion needed for {nbp.filename}, importing now...", flush=True)
+        nbp.queue_import(filepath)
+    elif nbp.is_supported_audiobook():
+        print(f"\n[ingest-processor]: No conversion needed for {nbp.filename}, is audiobook, importing now...", flush=True)
+        nbp.queue_import(filepath, False, Path(nbp.filename).suffix)
+    else:
+        if nbp.auto_convert_on and nbp.can_convert: # File can be converted to target format and Auto-Converter is on
+
+            if nbp.input_format in nbp.convert_ignored_formats: # File could be converted & the converter is activated but the user has specified files of this format should not be converted
+                print(f"\n[ingest-processor]: {nbp.filename} not in target format but user has told CWA not to convert this format so importing the file anyway...", flush=True)
+                nbp.queue_import(filepath)
+                convert_successful = False
+            elif nbp.target_format == "kepub": # File is not in the convert ignore list and target is kepub, so we start the kepub conversion process
+                with nbp.timed("convert"):
+                    convert_successful, converted_filepath = nbp.convert_to_kepub()
+            else: # File is not in the convert ignore list and target is not kepub, so we start the regular conversion process
+                with nbp.timed("convert"):
+                    convert_successful, converted_filepath = nbp.convert_book()
+
+            if convert_successful: # If previous conversion process was successful, remove tmp files and import into library
+                nbp.queue_import(converted_filepath) # type: ignore
+
+                # If the original format should be retained, also add it as an additional format
+                if nbp.input_format in nbp.convert_retained_formats and nbp.input_format not in nbp.ingest_ignored_formats:
+                    nbp.library_actions.append(("retain", filepath))
+
+        elif nbp.can_convert and not nbp.auto_convert_on: # Books not in target format but Auto-Converter is off so files are imported anyway
+            print(f"\n[ingest-processor]: {nbp.filename} not in target format but CWA Auto-Convert is deactivated so importing the file anyway...", flush=True)
+            nbp.queue_import(filepath)
+        else:
+            print(f"[ingest-processor]: Cannot convert {nbp.filepath}. {nbp.input_format} is currently unsupported / is not a known ebook format.", flush=True)
+
+
+def import_book(nbp:NewBookProcessor, db=None) -> None:
+    """Stage 2 of ingest: runs the calibredb writes recorded by prepare_book(). metadata.db must only ever
+    have one writer, so callers running several prepare stages at once funnel them through a single
+    import_book() caller. db lets that caller use its own CWA_DB connection for the import logs"""
+    if db is not None:
+        nbp.db = db
+    for action in nbp.library_actions:
+        if action[0] == "add":
+            __, book_path, text, format = action
+            nbp.add_book_to_library(book_path, text, format)
+        elif action[0] == "add_format":
+            __, book_id, book_path = action
+            nbp.add_format_to_book(book_id, book_path)
+        elif action[0] == "retain":
+            nbp.add_retained_format(action[1])
+
+
+def parse_added_book_ids(output:str) -> list[int]:
+    """Book ids reported by calibredb add, in the order it added the files"""
+    book_ids = []
+    for line in output.splitlines():
+        match = re.match(r"\s*(?:Added|Merged) book ids:\s*([\d,\s]+)", line)
+        if match:
+            book_ids.extend(int(book_id) for book_id in re.findall(r"\d+", match.group(1)))
+    return book_ids
+
+
+def match_book_ids(book_ids:list[int], staged_files:dict[str, int], calibre_db_path:str) -> dict[str, int]:
+    """Maps each staged file (path -> size) to the book calibredb created for it, by matching the format
+    and size recorded in metadata.db's data table. Files calibredb skipped (e.g. duplicates with
+    automerge=ignore) and files that can't be matched are left out of the result, their follow-ups look
+    the book up by title like a single import does"""
+    book_formats = {}
+    if book_ids:
+        try:
+            with sqlite3.connect(calibre_db_path, timeout=30) as con:
+                placeholders = ",".join("?" * len(book_ids))
+                rows = con.execute(f"SELECT book, format, uncompressed_size FROM data WHERE book IN ({placeholders})", book_ids).fetchall()
+            for book_id, book_format, size in rows:
+                book_formats.setdefault(book_id, set()).add((str(book_format).upper(), size))
+        except sqlite3.Error as e:
+            print(f"[ingest-processor] WARN: Could not read formats of the added books: {e}", flush=True)
+
+    matched = {}
+    remaining = list(book_ids)
+    for staged_path, size in staged_files.items():
+        key = (Path(staged_path).suffix[1:].upper(), size)
+        for book_id in remaining:
+            if key in book_formats.get(book_id, ()):
+                matched[staged_path] = book_id
+                remaining.remove(book_id)
+                break
+    return matched
+
+
+def split_ambiguous_batch(nbps:list[NewBookProcessor]) -> tuple[list[NewBookProcessor], list[NewBookProcessor]]:
+    """Splits the files of a batch into the ones match_book_ids() can tell apart and the ones sharing their
+    format and size with another file of the batch, which have to be added one at a time"""
+    keyed = []
+    counts = {}
+    for nbp in nbps:
+        book_path = nbp.library_actions[0][1]
+        try:
+            key = (Path(book_path).suffix[1:].upper(), os.path.getsize(book_path))
+        except OSError:
+            # Staging reports the missing file
+            key = (None, id(nbp))
+        keyed.append((key, nbp))
+        counts[key] = counts.get(key, 0) + 1
+    return [nbp for key, nbp in keyed if counts[key] == 1], [nbp for key, nbp in keyed if counts[key] > 1]
+
+
+def import_books(nbps:list[NewBookProcessor], db=None) -> None:
+    """Stage 2 for several prepared files at once. Every plain ebook add goes through a single calibredb add
+    call, which saves starting calibredb and opening metadata.db once per book; audiobooks (which carry
+    their own metadata arguments) and add_format requests still run one at a time via import_book().
+    The new book ids are mapped back to each file so the per-book follow-ups (import log, metadata fetch,
+    auto-send, retained formats) target the right book"""
+    batch = []
+    for nbp in nbps:
+        if db is not None:
+            nbp.db = db
+        actions = nbp.library_actions
+        if actions and actions[0][0] == "add" and actions[0][2]:
+            batch.append(nbp)
+        else:
+            import_book(nbp)
+
+    # Files the new book ids couldn't be mapped back to are added one at a time
+    batch, singles = split_ambiguous_batch(batch)
+    for nbp in singles:
+        import_book(nbp)
+    if len(batch) == 1:
+        import_book(batch[0])
+        return
+    if not batch:
+        return
+
+    first = batch[0]
+    calibre_db_path = os.path.join(first.library_dir, 'metadata.db')
+    pre_import_max_timestamp = first.get_pre_import_max_timestamp()
+    try:
+        with sqlite3.connect(calibre_db_path, timeout=30) as con:
+            pre_import_max_id = con.execute('SELECT MAX(id) FROM books').fetchone()[0] or 0
+    except sqlite3.Error as e:
+        print(f"[ingest-processor] WARN: Could not read pre-import max book id: {e}", flush=True)
+        pre_import_max_id = None
+
+    print(f"[ingest-processor]: Importing {len(batch)} new books to CWA in one batch...", flush=True)
+    staged = {} # staged path -> (nbp, book_path, size)
+    for nbp in batch:
+        book_path = nbp.library_actions[0][1]
+        staged_path = nbp.stage_for_import(book_path)
+        if staged_path is not None:
+            staged[str(staged_path)] = (nbp, book_path, staged_path.stat().st_size)
+
+    snapshot = library_permissions.snapshot_library(first.calibre_db_path)
+    try:
+        if not staged:
+            return
+        add_command = ["calibredb", "add", *staged, "--automerge", first.cwa_settings['auto_ingest_automerge'], f"--library-path={first.library_dir}"]
+        output = ""
+        failed = False
+        add_start = time.monotonic()
+        try:
+            result = subprocess.run(add_command, env=first.calibre_env, check=True, capture_output=True, text=True)
+            output = result.stdout
+            print(output, end="", flush=True)
         except subprocess.CalledProcessError as e:
-            print(f"[ingest-processor] An error occurred while attempting to recursively set ownership of {self.library_dir} to abc:abc. See the following error:\n{e}", flush=True)
+            # calibredb adds files one by one, so some may have made it in before the failure
+            print(f"[ingest-processor] Batch import failed, retrying the books that weren't added one at a time:\nCALIBREDB EXIT/ERROR CODE: {e.returncode}\n{e.stderr}", flush=True)
+            failed = True
+        # The batch's time is shared evenly between its books
+        add_seconds = (time.monotonic() - add_start) / len(staged)
+        for nbp, __, __ in staged.values():
+            nbp.add_stage_time("calibredb", add_seconds)
+
+        book_ids = parse_added_book_ids(output)
+        if pre_import_max_id is not None:
+            try:
+                with sqlite3.connect(calibre_db_path, timeout=30) as con:
+                    new_ids = [row[0] for row in con.execute('SELECT id FROM books WHERE id > ? ORDER BY id', (pre_import_max_id,))]
+                book_ids += [book_id for book_id in new_ids if book_id not in book_ids]
+            except sqlite3.Error as e:
+                print(f"[ingest-processor] WARN: Could not read the ids of the added books: {e}", flush=True)
+        matched = match_book_ids(book_ids, {path: size for path, (__, __, size) in staged.items()}, calibre_db_path)
+
+        for staged_path, (nbp, book_path, __) in staged.items():
+            book_id = matched.get(staged_path)
+            try:
+                if failed and book_id is None:
+                    nbp.add_book_to_library(book_path)
+                    for action in nbp.library_actions[1:]:
+                        if action[0] == "retain":
+                            nbp.add_retained_format(action[1])
+                    continue
+                nbp.record_import(Path(staged_path), book_path, book_id)
+                nbp.record_content_hash(book_id, Path(staged_path).suffix[1:])
+                for action in nbp.library_actions[1:]:
+                    if action[0] != "retain":
+                        continue
+                    if book_id is None:
+                        print(f"[ingest-processor] Could not find book ID to add retained format for: {nbp.filename}", flush=True)
+                    else:
+                        nbp.add_retained_format(action[1], book_id)
+            except Exception as e:
+                print(f"[ingest-processor] ingest-processor ran into the following error while importing {nbp.filename}:\n{e}", flush=True)
+
+        # Library-wide follow-ups only need to run once per batch
+        sync_start = time.monotonic()
+        if gdrive_sync_if_enabled():
+            sync_seconds = (time.monotonic() - sync_start) / len(staged)
+            for nbp, __, __ in staged.values():
+                nbp.add_stage_time("gdrive_sync", sync_seconds)
+        first.fix_overwrite_timestamps(pre_import_max_timestamp)
+    finally:
+        if staged:
+            first.record_library_changes(snapshot)
+        for staged_path in staged:
+            if os.path.exists(staged_path):
+                os.remove(staged_path)
+
+
+def process_book(filepath:str, db=None) -> None:
+    """Runs both ingest stages for a single file and always cleans up afterwards"""
+    nbp = None
+    try:
+        nbp = prepare_book(filepath, db)
+        if nbp.prepare_error:
+            raise nbp.prepare_error
+        import_book(nbp)
+    finally:
+        # Ensure cleanup always happens, even if an exception occurred
+        if nbp:
+            nbp.cleanup()
+            del nbp # New in Version 2.0.0, should drastically reduce memory usage with large ingests
 
 
-def main(filepath=None):
+def main(filepath=None, db=None):
     """Checks if filepath is a directory. If it is, main will be ran on every file in the given directory
-    Inotifywait won't detect files inside folders if the folder was moved rather than copied"""
+    Inotifywait won't detect files inside folders if the folder was moved rather than copied
+
+    The caller is responsible for holding process_lock; when ran as a script this happens in __main__,
+    ingest_daemon.py acquires it while it has files in flight"""
     
     if filepath is None:
         if len(sys.argv) < 2:
@@ -843,159 +1386,23 @@ def main(filepath=None):
             sys.exit(1)
         filepath = sys.argv[1]
     
-    nbp = None
     try:
-        ##############################################################################################
-        # Truncates the filename if it is too long
-        MAX_LENGTH = 150
-        filename = os.path.basename(filepath)
-        name, ext = os.path.splitext(filename)
-        allowed_len = MAX_LENGTH - len(ext)
-
-        if len(name) > allowed_len:
-            new_name = name[:allowed_len] + ext
-            new_path = os.path.join(os.path.dirname(filepath), new_name)
-            os.rename(filepath, new_path)
-            filepath = new_path
-        ###############################################################################################
+        filepath = truncate_filename(filepath)
         if os.path.isdir(filepath) and Path(filepath).exists():
-            # print(os.listdir(filepath))
             for filename in os.listdir(filepath):
                 f = os.path.join(filepath, filename)
                 if Path(f).exists():
-                    main(f)
+                    main(f, db)
             return
 
-        nbp = NewBookProcessor(filepath)
-
-        # If this file is not an ignored temporary, wait briefly for stability to avoid importing a still-growing file
-        ext_tmp_check = Path(nbp.filename).suffix.replace('.', '')
-        if ext_tmp_check not in nbp.ingest_ignored_formats:
-            timeout_minutes = nbp.cwa_settings.get('ingest_timeout_minutes', 15)
-            print(f"[ingest-processor] Checking if file is ready (timeout: {timeout_minutes} minutes): {nbp.filename}", flush=True)
-            ready = nbp.is_file_in_use()
-            if not ready:
-                print(f"[ingest-processor] WARN: File did not become ready in time or vanished (after {timeout_minutes} minutes): {nbp.filename}", flush=True)
-                return
-
-        # Sidecar manifest handling for explicit actions (e.g., add_format)
-        manifest_path = filepath + ".cwa.json"
-        try:
-            if Path(manifest_path).exists():
-                with open(manifest_path, 'r', encoding='utf-8') as mf:
-                    manifest = json.load(mf)
-                action = manifest.get("action")
-                if action == "add_format":
-                    try:
-                        book_id = int(manifest.get("book_id", -1))
-                    except Exception:
-                        book_id = -1
-                    if book_id > -1:
-                        nbp.add_format_to_book(book_id, filepath)
-                    else:
-                        print(f"[ingest-processor] Invalid book_id in manifest for {os.path.basename(filepath)}", flush=True)
-                    # Cleanup file and manifest regardless of outcome
-                    try:
-                        os.remove(manifest_path)
-                    except Exception:
-                        ...
-                    nbp.set_library_permissions()
-                    nbp.delete_current_file()
-                    return
-        except Exception as e:
-            print(f"[ingest-processor] Error processing manifest file: {e}", flush=True)
-            # Continue with normal processing if manifest handling fails
-            
-        # Check if the user has chosen to exclude files of this type from the ingest process
-        # Remove . (dot), check is against exclude whitout dot
-        ext = Path(nbp.filename).suffix.replace('.', '')
-        if ext in nbp.ingest_ignored_formats:
-            # Do NOT delete ignored temporary files; they may be renamed shortly (e.g. .uploading -> .epub)
-            print(f"[ingest-processor] Skipping ignored/temporary file (no action taken): {nbp.filename}", flush=True)
-            return
-
-        if nbp.is_target_format: # File can just be imported
-            print(f"\n[ingest-processor]: No conversion needed for {nbp.filename}, importing now...", flush=True)
-            nbp.add_book_to_library(filepath)
-        elif nbp.is_supported_audiobook():
-            print(f"\n[ingest-processor]: No conversion needed for {nbp.filename}, is audiobook, importing now...", flush=True)
-            nbp.add_book_to_library(filepath, False, Path(nbp.filename).suffix)
-        else:
-            if nbp.auto_convert_on and nbp.can_convert: # File can be converted to target format and Auto-Converter is on
-
-                if nbp.input_format in nbp.convert_ignored_formats: # File could be converted & the converter is activated but the user has specified files of this format should not be converted
-                    print(f"\n[ingest-processor]: {nbp.filename} not in target format but user has told CWA not to convert this format so importing the file anyway...", flush=True)
-                    nbp.add_book_to_library(filepath)
-                    convert_successful = False
-                elif nbp.target_format == "kepub": # File is not in the convert ignore list and target is kepub, so we start the kepub conversion process
-                    convert_successful, converted_filepath = nbp.convert_to_kepub()
-                else: # File is not in the convert ignore list and target is not kepub, so we start the regular conversion process
-                    convert_successful, converted_filepath = nbp.convert_book()
-                    
-                if convert_successful: # If previous conversion process was successful, remove tmp files and import into library
-                    nbp.add_book_to_library(converted_filepath) # type: ignore
-                    
-                    # If the original format should be retained, also add it as an additional format
-                    if nbp.input_format in nbp.convert_retained_formats and nbp.input_format not in nbp.ingest_ignored_formats:
-                        print(f"[ingest-processor]: Retaining original format ({nbp.input_format}) for {nbp.filename}...", flush=True)
-                        # Find the book that was just added to get its ID
-                        try:
-                            calibre_db_path = os.path.join(nbp.library_dir, 'metadata.db')
-                            with sqlite3.connect(calibre_db_path, timeout=30) as con:
-                                cur = con.cursor()
-                                # Get the most recently added book - use title/author for more reliable matching
-                                # in case of concurrent ingests
-                                cur.execute("""
-                                    SELECT id FROM books 
-                                    WHERE path = (SELECT path FROM books ORDER BY timestamp DESC LIMIT 1)
-                                    ORDER BY timestamp DESC LIMIT 1
-                                """)
-                                result = cur.fetchone()
-                                
-                            if result:
-                                book_id = result[0]
-                                # Verify the original file still exists before trying to add it
-                                if os.path.exists(filepath) and os.path.getsize(filepath) > 0:
-                                    nbp.add_format_to_book(book_id, filepath)
-                                else:
-                                    print(f"[ingest-processor] Original file no longer exists or is empty, cannot retain format: {filepath}", flush=True)
-                            else:
-                                print(f"[ingest-processor] Could not find book ID to add retained format for: {nbp.filename}", flush=True)
-                        except Exception as e:
-                            print(f"[ingest-processor] Error adding retained format: {e}", flush=True)
-
-            elif nbp.can_convert and not nbp.auto_convert_on: # Books not in target format but Auto-Converter is off so files are imported anyway
-                print(f"\n[ingest-processor]: {nbp.filename} not in target format but CWA Auto-Convert is deactivated so importing the file anyway...", flush=True)
-                nbp.add_book_to_library(filepath)
-            else:
-                print(f"[ingest-processor]: Cannot convert {nbp.filepath}. {nbp.input_format} is currently unsupported / is not a known ebook format.", flush=True)
+        process_book(filepath, db)
 
     except Exception as e:
         print(f"[ingest-processor] Unexpected error during processing: {e}", flush=True)
         raise
-    finally:
-        # Ensure cleanup always happens, even if an exception occurred
-        if nbp:
-            try:
-                nbp.set_library_permissions()
-            except Exception as e:
-                print(f"[ingest-processor] Error setting library permissions during cleanup: {e}", flush=True)
-            
-            try:
-                nbp.delete_current_file()
-            except Exception as e:
-                print(f"[ingest-processor] Error deleting current file during cleanup: {e}", flush=True)
-            
-            try:
-                # Cleanup the temp conversion folder, which now contains the staging dir
-                shutil.rmtree(nbp.tmp_conversion_dir, ignore_errors=True)
-            except Exception as e:
-                print(f"[ingest-processor] Error cleaning up temp conversion directory: {e}", flush=True)
-            
-            try:
-                del nbp # New in Version 2.0.0, should drastically reduce memory usage with large ingests
-            except Exception:
-                pass  # Ignore errors in cleanup
 
 if __name__ == "__main__":
+    # Acquire process lock to prevent concurrent execution
+    if not process_lock.acquire(timeout=10):
+        sys.exit(2)
     main()
@@ -19,12 +19,12 @@ import tempfile
 import atexit
 from datetime import datetime
 import json
-import shutil
 
 import pwd
 import grp
 
 from cwa_db import CWA_DB
+from file_placement import place_file
 
 ### Code adapted from https://github.com/innocenat/kindle-epub-fix
 ### Translated from Javascript to Python & modified by crocodilestick
@@ -86,13 +86,18 @@ def print_and_log(string, log=True) -> None:
 # Creates a lock file unless one already exists meaning an instance of the script is
 # already running, then the script is closed, the user is notified and the program
 # exits with code 2
-try:
-    lock = open(tempfile.gettempdir() + '/kindle_epub_fixer.lock', 'x')
-    lock.close()
-except FileExistsError:
-    print_and_log("[cwa-kindle-epub-fixer] CANCELLING... kindle-epub-fixer was initiated but is already running")
-    logger.info(f"\nCWA Kindle EPUB Fixer Service - Run Ended: {datetime.now()}")
-    sys.exit(2)
+# Only taken when ran as a script, so importing EPUBFixer (e.g. from the long-running
+# ingest daemon) doesn't block manual runs for the lifetime of the importing process
+def createLock():
+    try:
+        lock = open(tempfile.gettempdir() + '/kindle_epub_fixer.lock', 'x')
+        lock.close()
+    except FileExistsError:
+        print_and_log("[cwa-kindle-epub-fixer] CANCELLING... kindle-epub-fixer was initiated but is already running")
+        logger.info(f"\nCWA Kindle EPUB Fixer Service - Run Ended: {datetime.now()}")
+        sys.exit(2)
+    # Will automatically run when the script exits
+    atexit.register(removeLock)
 
 # Defining function to delete the lock on script exit
 def removeLock():
@@ -101,22 +106,22 @@ def removeLock():
     except FileNotFoundError:
         ...
 
-# Will automatically run when the script exits
-atexit.register(removeLock)
-
 
 class EPUBFixer:
-    def __init__(self, manually_triggered:bool=False, current_position:str=None):
+    def __init__(self, manually_triggered:bool=False, current_position:str=None, db:CWA_DB=None):
         self.manually_triggered = manually_triggered
         self.current_position = current_position # string in the form of "n/n"
 
-        self.db = CWA_DB()
+        self.db = db if db is not None else CWA_DB()
         self.cwa_settings = self.db.cwa_settings
 
         self.fixed_problems = []
         self.files = {}
+        self.original_files = {}
         self.binary_files = {}
         self.entries = []
+        # Whether the archive already starts with an uncompressed mimetype entry, as write_epub() lays it out
+        self.layout_ok = True
 
 
     def backup_original_file(self, epub_path):
@@ -124,7 +129,8 @@ class EPUBFixer:
         if self.cwa_settings['auto_backup_epub_fixes']:
             try:
                 output_path = f"/config/processed_books/fixed_originals/"
-                shutil.copy2(epub_path, output_path)
+                # Never hardlinked, the original is about to be rewritten in place when fixing library files
+                place_file(epub_path, output_path)
             except Exception as e:
                 print_and_log(f"[cwa-kindle-epub-fixer] ERROR - Error occurred when backing up {epub_path} to {output_path}:\n{e}", log=self.manually_triggered)
 
@@ -132,12 +138,17 @@ class EPUBFixer:
         """Read EPUB file contents"""
         with zipfile.ZipFile(epub_path, 'r') as zip_ref:
             self.entries = zip_ref.namelist()
+            first = zip_ref.infolist()[0] if self.entries else None
+            self.layout_ok = 'mimetype' not in self.entries or (
+                first.filename == 'mimetype' and first.compress_type == zipfile.ZIP_STORED and not first.extra)
             for filename in self.entries:
                 ext = filename.split('.')[-1]
                 if filename == 'mimetype' or ext in ['html', 'xhtml', 'htm', 'xml', 'svg', 'css', 'opf', 'ncx']:
                     self.files[filename] = zip_ref.read(filename).decode('utf-8')
                 else:
                     self.binary_files[filename] = zip_ref.read(filename)
+        # The fixes only ever touch the text files, keep them to tell if anything changed
+        self.original_files = dict(self.files)
 
     def fix_encoding(self):
         """Add UTF-8 encoding declaration if missing"""
@@ -312,8 +323,10 @@ class EPUBFixer:
                                     fixed_problems)
 
 
-    def process(self, input_path, output_path=None, default_language='en'):
-        """Process a single EPUB file"""
+    def process(self, input_path, output_path=None, default_language='en', allow_link=False):
+        """Process a single EPUB file. When nothing needed fixing the EPUB isn't rewritten: it's left alone
+        when fixing in place, otherwise placed at output_path with file_placement (hardlinked if allow_link
+        is set and nothing will rewrite either file in place)"""
         if not output_path:
             output_path = input_path
 
@@ -339,11 +352,17 @@ class EPUBFixer:
         self.export_issue_summary(input_path)
 
         # Write EPUB
-        print_and_log("[cwa-kindle-epub-fixer] Writing EPUB...", log=self.manually_triggered)
         if Path(output_path).is_dir():
-            output_path = output_path + os.path.basename(input_path)
-        self.write_epub(output_path)
-        print_and_log("[cwa-kindle-epub-fixer] EPUB successfully written.", log=self.manually_triggered)
+            output_path = os.path.join(output_path, os.path.basename(input_path))
+        if self.files != self.original_files or not self.layout_ok:
+            print_and_log("[cwa-kindle-epub-fixer] Writing EPUB...", log=self.manually_triggered)
+            self.write_epub(output_path)
+            print_and_log("[cwa-kindle-epub-fixer] EPUB successfully written.", log=self.manually_triggered)
+        elif os.path.abspath(str(output_path)) == os.path.abspath(str(input_path)):
+            print_and_log("[cwa-kindle-epub-fixer] Nothing changed, leaving EPUB as it is.", log=self.manually_triggered)
+        else:
+            strategy = place_file(str(input_path), str(output_path), allow_link=allow_link)
+            print_and_log(f"[cwa-kindle-epub-fixer] Nothing changed, EPUB placed unmodified ({strategy}).", log=self.manually_triggered)
         
         # Add entry to cwa.db
         print_and_log("[cwa-kindle-epub-fixer] Adding run to cwa.db...", log=self.manually_triggered)
@@ -463,4 +482,5 @@ def main():
     
 
 if __name__ == "__main__":
+    createLock()
     main()
\ No newline at end of file
@@ -0,0 +1,141 @@
+#!/usr/bin/env python3
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Library ownership helpers.
+
+Ingest and convert-library used to run `chown -R abc:abc <library>` after every book, which on a
+large library walks every inode for each imported file. Instead, the writers snapshot metadata.db
+before calling calibredb and afterwards fix ownership of only the book folders (and their author
+folders) that calibredb created or modified, plus metadata.db itself.
+
+Running this script with --reconcile walks the whole library once at idle I/O priority and only
+chowns entries that aren't already owned by abc:abc. The cwa-library-permissions service does
+this periodically to catch anything the targeted fix-ups missed.
+
+Usage:
+  python3 scripts/library_permissions.py --reconcile
+"""
+
+import argparse
+import os
+import shutil
+import sqlite3
+import subprocess
+import sys
+
+OWNER = "abc:abc"
+
+
+def network_share_mode() -> bool:
+    return os.getenv("NETWORK_SHARE_MODE", "false").strip().lower() in ("1", "true", "yes", "on")
+
+
+def snapshot_library(calibre_db_path: str) -> tuple[int, str | None] | None:
+    """Highest book id and last_modified before a library write, passed to touched_library_paths()
+    afterwards. Returns None if metadata.db can't be read"""
+    try:
+        with sqlite3.connect(calibre_db_path, timeout=30) as con:
+            max_id, max_last_modified = con.execute("SELECT MAX(id), MAX(last_modified) FROM books").fetchone()
+        return max_id or 0, max_last_modified
+    except sqlite3.Error as e:
+        print(f"[library-permissions] WARN: Could not snapshot {calibre_db_path}: {e}", flush=True)
+        return None
+
+
+def touched_library_paths(library_dir: str, calibre_db_path: str, snapshot) -> tuple[set[str], set[str]]:
+    """Paths created or modified since snapshot_library() was taken, as (trees, paths): book folders
+    whose whole contents need fixing, and author folders / database files that only need themselves
+    fixed. A missing snapshot yields just the database files"""
+    trees, paths = set(), set()
+    for suffix in ("", "-wal", "-shm"):
+        if os.path.exists(calibre_db_path + suffix):
+            paths.add(calibre_db_path + suffix)
+    if snapshot is None:
+        return trees, paths
+
+    max_id, max_last_modified = snapshot
+    try:
+        with sqlite3.connect(calibre_db_path, timeout=30) as con:
+            if max_last_modified is None:
+                rows = con.execute("SELECT path FROM books WHERE id > ?", (max_id,)).fetchall()
+            else:
+                rows = con.execute("SELECT path FROM books WHERE id > ? OR last_modified > ?", (max_id, max_last_modified)).fetchall()
+    except sqlite3.Error as e:
+        print(f"[library-permissions] WARN: Could not read changed books from {calibre_db_path}: {e}", flush=True)
+        return trees, paths
+
+    for (book_path,) in rows:
+        book_dir = os.path.join(library_dir, book_path)
+        if os.path.isdir(book_dir):
+            trees.add(book_dir)
+            paths.add(os.path.dirname(book_dir))
+    return trees, paths
+
+
+def fix_ownership(trees, paths, log_prefix: str = "[library-permissions]") -> None:
+    """chowns the given book folders recursively and the other paths on their own"""
+    if network_share_mode():
+        print(f"{log_prefix} NETWORK_SHARE_MODE=true detected; skipping chown of changed library paths", flush=True)
+        return
+    try:
+        if trees:
+            subprocess.run(["chown", "-R", OWNER, *sorted(trees)], check=True)
+        if paths:
+            subprocess.run(["chown", OWNER, *sorted(paths)], check=True)
+    except subprocess.CalledProcessError as e:
+        print(f"{log_prefix} An error occurred while attempting to set ownership of changed library paths to {OWNER}. See the following error:\n{e}", flush=True)
+
+
+def get_library_dirs(app_db_path: str = "/config/app.db") -> list[str]:
+    """Library (and split library) folders configured in app.db"""
+    with sqlite3.connect(app_db_path, timeout=30) as con:
+        cur = con.cursor()
+        calibre_dir, split, split_dir = cur.execute("SELECT config_calibre_dir, config_calibre_split, config_calibre_split_dir FROM settings;").fetchone()
+    dirs = [calibre_dir] if calibre_dir else []
+    if split and split_dir:
+        dirs.append(split_dir)
+    return [d for d in dirs if os.path.isdir(d)]
+
+
+def reconcile(library_dir: str) -> None:
+    """Walks the whole library at idle I/O priority and lowest CPU priority, chowning only the
+    entries with the wrong owner so unchanged inodes aren't rewritten"""
+    user, group = OWNER.split(":")
+    command = ["find", library_dir, "(", "!", "-user", user, "-o", "!", "-group", group, ")", "-exec", "chown", "-h", OWNER, "{}", "+"]
+    command = ["nice", "-n", "19"] + command
+    if shutil.which("ionice"):
+        command = ["ionice", "-c", "3"] + command
+    print(f"[library-permissions] Reconciling ownership of {library_dir}...", flush=True)
+    result = subprocess.run(command)
+    if result.returncode != 0:
+        print(f"[library-permissions] find/chown exited with code {result.returncode} while reconciling {library_dir}", flush=True)
+
+
+def main(argv=None) -> int:
+    parser = argparse.ArgumentParser(description="Fix ownership of the Calibre library")
+    parser.add_argument("--reconcile", action="store_true", help="Walk the whole library and fix any entries not owned by abc:abc")
+    args = parser.parse_args(argv)
+
+    if not args.reconcile:
+        parser.print_help()
+        return 1
+    if network_share_mode():
+        print("[library-permissions] NETWORK_SHARE_MODE=true detected; skipping ownership reconcile", flush=True)
+        return 0
+    try:
+        library_dirs = get_library_dirs()
+    except (sqlite3.Error, TypeError) as e:
+        print(f"[library-permissions] Could not read library location from app.db: {e}", flush=True)
+        return 1
+    for library_dir in library_dirs:
+        reconcile(library_dir)
+    return 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,101 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Benchmark of Cover Thumbnail Generation
+
+Times writing the 6 cover thumbnails of a book (3 resolutions x WebP/JPEG) the old way, decoding cover.jpg
+once per thumbnail, against write_cover_thumbnails(), which decodes it once and downscales large -> medium
+-> small. Uses the image backend the thumbnail tasks use, see bench_image_backends.py to compare the backends.
+
+    python tests/benchmarks/bench_cover_thumbnails.py [--cover cover.jpg] [--books 20]
+
+Without --cover a 1800x2700 test cover is generated.
+"""
+
+import argparse
+import os
+import statistics
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from cps import constants, imaging
+from cps.tasks.thumbnail import (THUMBNAIL_FORMATS, get_resize_height, get_resize_width, open_cover,
+                                 write_cover_thumbnails)
+
+RESOLUTIONS = [constants.COVER_THUMBNAIL_SMALL, constants.COVER_THUMBNAIL_MEDIUM, constants.COVER_THUMBNAIL_LARGE]
+
+
+def targets_for(out_dir):
+    return {resolution: [(fmt, os.path.join(out_dir, f"book_1_r{resolution}.{fmt}")) for fmt in THUMBNAIL_FORMATS]
+            for resolution in RESOLUTIONS}
+
+
+def one_decode_per_thumbnail(cover, targets):
+    """What TaskGenerateCoverThumbnails did before: open and decode the cover for every single thumbnail"""
+    for resolution, files in targets.items():
+        for fmt, filename in files:
+            with imaging.backend.open(filename=cover) as img:
+                height = get_resize_height(resolution)
+                if img.height > height:
+                    width = get_resize_width(resolution, img.width, img.height)
+                    img.resize(width, height)
+                img.save(filename, fmt, 82)
+
+
+def decode_once(cover, targets):
+    with open_cover(targets, filename=cover) as img:
+        write_cover_thumbnails(img, targets)
+
+
+def make_cover(path):
+    from PIL import Image
+    Image.effect_mandelbrot((1800, 2700), (-2.0, -1.5, 1.0, 1.5), 100).convert('RGB').save(path, quality=90)
+
+
+def time_per_book(func, cover, out_dir, books):
+    targets = targets_for(out_dir)
+    func(cover, targets)  # warm up
+    timings = []
+    for __ in range(books):
+        start = time.perf_counter()
+        func(cover, targets)
+        timings.append(time.perf_counter() - start)
+    return timings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--cover", help="cover image to use instead of a generated one")
+    parser.add_argument("--books", type=int, default=20, help="number of books to time (default: 20)")
+    args = parser.parse_args()
+
+    if not imaging.backend:
+        sys.exit("No image backend is available, nothing to benchmark")
+
+    with tempfile.TemporaryDirectory() as out_dir:
+        cover = args.cover
+        if not cover:
+            cover = os.path.join(out_dir, "cover.jpg")
+            make_cover(cover)
+        print(f"Cover: {cover} ({os.path.getsize(cover) / 1024:.0f} KB), {args.books} books, "
+              f"backend {imaging.backend.name}")
+
+        results = {}
+        for label, func in (("one decode per thumbnail", one_decode_per_thumbnail), ("decode once", decode_once)):
+            timings = time_per_book(func, cover, out_dir, args.books)
+            results[label] = statistics.median(timings)
+            print(f"{label:>26}: median {results[label] * 1000:7.1f} ms/book, "
+                  f"mean {statistics.mean(timings) * 1000:7.1f} ms/book")
+        print(f"{'speedup':>26}: {results['one decode per thumbnail'] / results['decode once']:.2f}x")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,112 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Benchmark of the Image Backends
+
+Extracts the cover images of the EPUBs in tests/fixtures/sample_books and writes the 6 cover thumbnails of
+every one of them (3 resolutions x WebP/JPEG) the way TaskGenerateCoverThumbnails does, with every installed
+image backend (pyvips, Pillow, ImageMagick). Each backend runs in a fresh process, so its peak RSS is its own.
+
+    python tests/benchmarks/bench_image_backends.py [--rounds 20] [--covers more_covers_dir]
+
+--covers adds the .jpg/.png files of a directory, e.g. some cover.jpg files of a real library.
+"""
+
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+import zipfile
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from cps import constants, imaging
+from cps.tasks.thumbnail import THUMBNAIL_FORMATS, open_cover, write_cover_thumbnails
+
+FIXTURES = Path(__file__).parent.parent / "fixtures" / "sample_books"
+RESOLUTIONS = [constants.COVER_THUMBNAIL_SMALL, constants.COVER_THUMBNAIL_MEDIUM, constants.COVER_THUMBNAIL_LARGE]
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def extract_covers(out_dir):
+    covers = []
+    for epub in sorted(FIXTURES.glob("*.epub")):
+        try:
+            with zipfile.ZipFile(epub) as archive:
+                for name in archive.namelist():
+                    if 'cover' in name.lower() and name.lower().endswith(IMAGE_EXTENSIONS):
+                        path = os.path.join(out_dir, f"{len(covers)}{os.path.splitext(name)[1]}")
+                        with open(path, 'wb') as f:
+                            f.write(archive.read(name))
+                        covers.append(path)
+                        break
+        except zipfile.BadZipFile:
+            continue
+    return covers
+
+
+def run_backend(name, covers, rounds):
+    """Runs in the child process, prints the result as JSON"""
+    imaging.backend = imaging.get_backend(name)
+    # ru_maxrss is in KB on Linux. The imports of cps are the same for every backend
+    baseline = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    with tempfile.TemporaryDirectory() as out_dir:
+        targets = {resolution: [(fmt, os.path.join(out_dir, f"r{resolution}.{fmt}")) for fmt in THUMBNAIL_FORMATS]
+                   for resolution in RESOLUTIONS}
+        start = time.perf_counter()
+        for __ in range(rounds):
+            for cover in covers:
+                with open_cover(targets, filename=cover) as img:
+                    write_cover_thumbnails(img, targets)
+        elapsed = time.perf_counter() - start
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024
+    print(json.dumps({"covers": len(covers) * rounds, "seconds": elapsed, "peak_rss_mb": peak,
+                      "baseline_rss_mb": baseline}))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--rounds", type=int, default=20, help="times every cover is processed (default: 20)")
+    parser.add_argument("--covers", help="directory with more cover images to include")
+    parser.add_argument("--backend", help=argparse.SUPPRESS)
+    parser.add_argument("--cover-list", help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.backend:
+        run_backend(args.backend, args.cover_list.split(os.pathsep), args.rounds)
+        return
+
+    backends = imaging.available_backends()
+    if not backends:
+        sys.exit("No image backend is available, nothing to benchmark")
+
+    with tempfile.TemporaryDirectory() as cover_dir:
+        covers = extract_covers(cover_dir)
+        if args.covers:
+            covers += sorted(str(path) for path in Path(args.covers).iterdir()
+                             if path.suffix.lower() in IMAGE_EXTENSIONS)
+        if not covers:
+            sys.exit("No cover images found")
+        print(f"{len(covers)} covers x {args.rounds} rounds, 6 thumbnails per cover")
+
+        for name in backends:
+            output = subprocess.run([sys.executable, __file__, "--backend", name, "--rounds", str(args.rounds),
+                                     "--cover-list", os.pathsep.join(covers)],
+                                    check=True, capture_output=True, text=True).stdout
+            result = json.loads(output.strip().splitlines()[-1])
+            print(f"{imaging.get_backend(name).version:>24}: {result['covers'] / result['seconds']:7.1f} covers/s, "
+                  f"{result['seconds'] * 1000 / result['covers']:6.1f} ms/cover, peak RSS {result['peak_rss_mb']:6.1f} MB "
+                  f"(+{result['peak_rss_mb'] - result['baseline_rss_mb']:.1f} MB over the imports)")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,79 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Benchmark of Concurrent OPDS Requests
+
+Sends the given number of /opds/new requests to a running server from N client threads at once and reports
+throughput and latency for every N. Run it against the same library before and after a change to compare.
+
+    python tests/benchmarks/bench_opds_concurrency.py --url http://localhost:8083 --user admin \\
+        --password admin123 [--concurrency 1 4 16 64] [--requests 400]
+
+Only the Python standard library is needed, so it can run on another machine than the server.
+"""
+
+import argparse
+import base64
+import statistics
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+
+
+def fetch(url, headers):
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(urllib.request.Request(url, headers=headers), timeout=120) as response:
+            response.read()
+            ok = response.status == 200
+    except (urllib.error.URLError, OSError):
+        ok = False
+    return ok, time.perf_counter() - start
+
+
+def run(url, headers, concurrency, requests):
+    with ThreadPoolExecutor(max_workers=concurrency) as pool:
+        start = time.perf_counter()
+        results = list(pool.map(lambda __: fetch(url, headers), range(requests)))
+        elapsed = time.perf_counter() - start
+    latencies = sorted(latency for ok, latency in results if ok)
+    errors = sum(1 for ok, __ in results if not ok)
+    return elapsed, latencies, errors
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", default="http://localhost:8083", help="server url (default: http://localhost:8083)")
+    parser.add_argument("--path", default="/opds/new", help="path to request (default: /opds/new)")
+    parser.add_argument("--user", default="admin", help="user for HTTP basic auth (default: admin)")
+    parser.add_argument("--password", default="admin123", help="password for HTTP basic auth (default: admin123)")
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 4, 16, 64],
+                        help="parallel clients to try (default: 1 4 16 64)")
+    parser.add_argument("--requests", type=int, default=400, help="requests per concurrency level (default: 400)")
+    args = parser.parse_args()
+
+    url = args.url.rstrip("/") + args.path
+    token = base64.b64encode(f"{args.user}:{args.password}".encode()).decode()
+    headers = {"Authorization": f"Basic {token}"}
+    ok, __ = fetch(url, headers)  # warm up, and check the url and credentials
+    if not ok:
+        raise SystemExit(f"GET {url} failed, check --url, --user and --password")
+
+    print(f"GET {url}, {args.requests} requests per level")
+    for concurrency in args.concurrency:
+        elapsed, latencies, errors = run(url, headers, concurrency, args.requests)
+        if not latencies:
+            print(f"{concurrency:>4} clients: all {errors} requests failed")
+            continue
+        p95 = latencies[min(len(latencies) - 1, int(len(latencies) * 0.95))]
+        print(f"{concurrency:>4} clients: {len(latencies) / elapsed:7.1f} req/s, "
+              f"median {statistics.median(latencies) * 1000:7.1f} ms, p95 {p95 * 1000:7.1f} ms, {errors} errors")
+
+
+if __name__ == "__main__":
+    main()
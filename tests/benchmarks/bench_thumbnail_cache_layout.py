@@ -0,0 +1,103 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Benchmark of the Thumbnail Cache Layout
+
+Creates the given number of empty thumbnail files in the flat layout (every file in one directory) and in the
+sharded layout of fs.thumbnail_shard(), then times random lookups (isfile) and a full scan of each. Runs in a
+temporary directory on the same filesystem as --dir, which should be the one /config lives on.
+
+    python tests/benchmarks/bench_thumbnail_cache_layout.py [--files 100000 1000000] [--lookups 20000] [--dir /config]
+
+Creating a million files takes a while and needs a million free inodes. The numbers are with a warm dentry
+cache, for cold cache numbers run 'sync; echo 3 > /proc/sys/vm/drop_caches' as root before each layout.
+"""
+
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+sys.path.insert(0, str(Path(__file__).parent.parent.parent))
+
+from cps.fs import thumbnail_shard
+
+
+def thumbnail_names(count):
+    # 6 thumbnails per book, named like TaskGenerateCoverThumbnails names them
+    names = []
+    book_id = 1
+    while len(names) < count:
+        for resolution in (1, 2, 4):
+            for fmt in ("webp", "jpg"):
+                names.append(f"book_{book_id}_r{resolution}.{fmt}")
+        book_id += 1
+    return names[:count]
+
+
+def flat_path(root, name):
+    return os.path.join(root, name)
+
+
+def sharded_path(root, name):
+    return os.path.join(root, *thumbnail_shard(name), name)
+
+
+def create(root, names, path_for):
+    start = time.perf_counter()
+    for name in names:
+        path = path_for(root, name)
+        directory = os.path.dirname(path)
+        if not os.path.isdir(directory):
+            os.makedirs(directory, exist_ok=True)
+        with open(path, "wb"):
+            pass
+    return time.perf_counter() - start
+
+
+def lookups(root, names, path_for, count):
+    sample = random.sample(names, min(count, len(names)))
+    # Half of the lookups miss, like cover requests for books without thumbnails
+    sample += [name.replace("book_", "book_x") for name in sample]
+    start = time.perf_counter()
+    for name in sample:
+        os.path.isfile(path_for(root, name))
+    return (time.perf_counter() - start) / len(sample)
+
+
+def scan(root):
+    start = time.perf_counter()
+    files = 0
+    for __, __, filenames in os.walk(root):
+        files += len(filenames)
+    return time.perf_counter() - start, files
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--files", type=int, nargs="+", default=[100000], help="number of thumbnail files (default: 100000)")
+    parser.add_argument("--lookups", type=int, default=20000, help="number of lookups to time (default: 20000)")
+    parser.add_argument("--dir", default=None, help="directory to create the test caches in (default: system temp)")
+    args = parser.parse_args()
+
+    for count in args.files:
+        names = thumbnail_names(count)
+        print(f"{count} files")
+        for label, path_for in (("flat", flat_path), ("sharded", sharded_path)):
+            with tempfile.TemporaryDirectory(dir=args.dir) as root:
+                created = create(root, names, path_for)
+                lookup = lookups(root, names, path_for, args.lookups)
+                scanned, files = scan(root)
+                assert files == count
+                print(f"{label:>8}: create {created:7.1f} s, lookup {lookup * 1e6:6.1f} us, full scan {scanned:6.2f} s")
+
+
+if __name__ == "__main__":
+    main()
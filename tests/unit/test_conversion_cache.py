@@ -0,0 +1,95 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Unit Tests for the Conversion Cache
+
+These tests store fake conversion results in a temp cache folder and check
+keying, fetching and the LRU eviction. Converter versions are pinned so the
+tests don't need calibre or kepubify installed.
+"""
+
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add scripts directory to path (works in both dev container and CI)
+scripts_dir = Path(__file__).parent.parent.parent / "scripts"
+sys.path.insert(0, str(scripts_dir))
+
+import conversion_cache
+from conversion_cache import ConversionCache
+
+
+@pytest.fixture
+def cache_db(temp_cwa_db):
+    temp_cwa_db.cur.execute("DELETE FROM cwa_conversion_cache")
+    temp_cwa_db.con.commit()
+    return temp_cwa_db
+
+
+@pytest.fixture
+def cache(cache_db, tmp_path, monkeypatch):
+    monkeypatch.setattr(conversion_cache, "converter_version", lambda command: f"{command} 1.0")
+    return ConversionCache(cache_db, max_size_mb=1, cache_dir=str(tmp_path / "cache"))
+
+
+def converted_file(tmp_path, name, size):
+    path = tmp_path / name
+    path.write_bytes(b"x" * size)
+    return str(path)
+
+
+@pytest.mark.unit
+class TestConversionCache:
+    """Test storing, fetching and evicting conversion results."""
+
+    def test_key_changes_with_converter_version_and_settings(self, cache, tmp_path, monkeypatch):
+        env = {"HOME": str(tmp_path)}
+        key = cache.make_key("hash", "epub", ["ebook-convert"], env)
+        assert key == cache.make_key("hash", "EPUB", ["ebook-convert"], env)
+        assert key != cache.make_key("hash", "kepub", ["ebook-convert", "kepubify"], env)
+
+        conversion_dir = tmp_path / ".config" / "calibre" / "conversion"
+        conversion_dir.mkdir(parents=True)
+        (conversion_dir / "epub_output.py").write_text("json:{'epub_flatten': true}")
+        assert cache.make_key("hash", "epub", ["ebook-convert"], env) != key
+
+        monkeypatch.setattr(conversion_cache, "converter_version", lambda command: None)
+        assert cache.make_key("hash", "epub", ["ebook-convert"], env) is None
+
+    def test_disabled_cache_has_no_keys(self, cache_db, tmp_path):
+        assert ConversionCache(cache_db, max_size_mb=0, cache_dir=str(tmp_path)).make_key("hash", "epub", ["ebook-convert"]) is None
+
+    def test_fetch_returns_stored_result(self, cache, tmp_path):
+        key = cache.make_key("hash", "epub", ["ebook-convert"])
+        dest = tmp_path / "out.epub"
+        assert not cache.fetch(key, str(dest))
+
+        cache.store(key, converted_file(tmp_path, "book.epub", 100))
+        assert cache.fetch(key, str(dest))
+        assert dest.read_bytes() == b"x" * 100
+
+    def test_evicts_least_recently_used(self, cache, cache_db, tmp_path):
+        keys = [cache.make_key(f"hash{i}", "epub", ["ebook-convert"]) for i in range(3)]
+        cache.store(keys[0], converted_file(tmp_path, "a.epub", 400 * 1024))
+        cache.store(keys[1], converted_file(tmp_path, "b.epub", 400 * 1024))
+        cache_db.cur.execute("UPDATE cwa_conversion_cache SET last_used = '2000-01-01 00:00:00' WHERE key = ?", (keys[1],))
+        cache_db.con.commit()
+
+        cache.store(keys[2], converted_file(tmp_path, "c.epub", 400 * 1024))
+        assert cache_db.conversion_cache_lookup(keys[1]) is None
+        assert cache_db.conversion_cache_lookup(keys[0]) is not None
+        assert cache_db.conversion_cache_total_size() <= cache.max_bytes
+
+    def test_missing_cache_file_is_a_miss(self, cache, tmp_path):
+        key = cache.make_key("hash", "epub", ["ebook-convert"])
+        cache.store(key, converted_file(tmp_path, "book.epub", 100))
+        Path(cache.entry_path(key, "epub")).unlink()
+
+        assert not cache.fetch(key, str(tmp_path / "out.epub"))
+        assert cache.db.conversion_cache_lookup(key) is None
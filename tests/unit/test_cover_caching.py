@@ -0,0 +1,83 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Unit Tests for HTTP Caching of Covers
+
+These tests send a cover file inside a test request context and check the
+validators, the 304 answers to conditional requests and the Cache-Control
+of versioned and unversioned cover urls, and that thumbnails written before
+the book last changed aren't served as its current cover.
+"""
+
+from datetime import datetime, timezone
+
+from cps.services.thumbnail_index import CachedThumbnail
+
+import pytest
+from flask import Flask
+
+from cps import helper
+
+LAST_MODIFIED = datetime(2025, 5, 1, 12, 0, tzinfo=timezone.utc)
+VERSION = helper.get_cover_version(LAST_MODIFIED)
+ETAG = "book_1-" + VERSION
+
+
+@pytest.fixture
+def cover_dir(tmp_path):
+    (tmp_path / "cover.jpg").write_bytes(b"cover")
+    return str(tmp_path)
+
+
+def send(cover_dir, url, headers=None):
+    app = Flask(__name__)
+    with app.test_request_context(url, headers=headers or {}):
+        return helper.send_cover(cover_dir, "cover.jpg", ETAG, LAST_MODIFIED, VERSION)
+
+
+@pytest.mark.unit
+class TestCoverCaching:
+    """Test conditional requests and Cache-Control of covers."""
+
+    def test_cover_has_strong_validators(self, cover_dir):
+        response = send(cover_dir, "/cover/1")
+        assert response.status_code == 200
+        assert response.headers["ETag"] == f'"{ETAG}"'
+        assert response.last_modified == LAST_MODIFIED
+        assert response.cache_control.no_cache
+        assert not response.cache_control.immutable
+
+    def test_matching_etag_gets_304(self, cover_dir):
+        response = send(cover_dir, "/cover/1", {"If-None-Match": f'"{ETAG}"'})
+        assert response.status_code == 304
+        response = send(cover_dir, "/cover/1", {"If-None-Match": '"book_1-0"'})
+        assert response.status_code == 200
+
+    def test_versioned_url_is_immutable(self, cover_dir):
+        response = send(cover_dir, f"/cover/1?c={VERSION}")
+        assert response.cache_control.immutable
+        assert response.cache_control.max_age == helper.COVER_IMMUTABLE_MAX_AGE
+        assert response.cache_control.private
+
+        # An outdated version has to revalidate
+        assert not send(cover_dir, "/cover/1?c=1").cache_control.immutable
+
+    def test_not_modified_without_reading_the_cover(self):
+        app = Flask(__name__)
+        with app.test_request_context("/cover/1", headers={"If-None-Match": f'"{ETAG}"'}):
+            assert helper.cover_not_modified(ETAG, LAST_MODIFIED, VERSION).status_code == 304
+        with app.test_request_context("/cover/1"):
+            assert helper.cover_not_modified(ETAG, LAST_MODIFIED, VERSION) is None
+
+    def test_thumbnail_older_than_book_is_outdated(self):
+        written_after = CachedThumbnail("/cache", "book_1_r1.webp", LAST_MODIFIED.timestamp() + 10)
+        written_before = CachedThumbnail("/cache", "book_1_r1.webp", LAST_MODIFIED.timestamp() - 10)
+        assert helper.is_current_thumbnail(written_after, LAST_MODIFIED)
+        assert not helper.is_current_thumbnail(written_before, LAST_MODIFIED)
+        # Calibre's naive UTC timestamps
+        assert not helper.is_current_thumbnail(written_before, LAST_MODIFIED.replace(tzinfo=None))
+        assert not helper.is_current_thumbnail(None, LAST_MODIFIED)
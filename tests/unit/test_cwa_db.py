@@ -304,6 +304,98 @@ class TestCWADBStatistics:
         assert import_final == import_initial + 1
 
 
+@pytest.mark.unit
+class TestCWADBIngestQueue:
+    """Test the ingest queue used by the ingest daemon."""
+
+    @pytest.fixture
+    def queue_db(self, temp_cwa_db):
+        temp_cwa_db.cur.execute("DELETE FROM cwa_ingest_queue")
+        temp_cwa_db.con.commit()
+        return temp_cwa_db
+
+    def test_same_path_is_queued_once(self, queue_db):
+        """Verify a path reported twice only gets one row."""
+        queue_db.ingest_queue_add("/ingest/book.epub")
+        queue_db.ingest_queue_add("/ingest/book.epub")
+        assert queue_db.ingest_queue_size() == 1
+
+    def test_claims_highest_priority_first(self, queue_db):
+        """Verify web uploads are claimed before earlier bulk drops."""
+        queue_db.ingest_queue_add("/ingest/bulk1.epub")
+        queue_db.ingest_queue_add("/ingest/bulk2.epub")
+        queue_db.ingest_queue_add("/ingest/new_1_upload.epub", priority=10)
+
+        claimed = [queue_db.ingest_queue_claim()["path"] for __ in range(3)]
+        assert claimed == ["/ingest/new_1_upload.epub", "/ingest/bulk1.epub", "/ingest/bulk2.epub"]
+        assert queue_db.ingest_queue_claim() is None
+
+    def test_failed_attempt_backs_off_until_out_of_attempts(self, queue_db):
+        """Verify a failure schedules a later retry and the last attempt marks the path failed."""
+        queue_db.ingest_queue_add("/ingest/book.epub")
+        assert queue_db.ingest_queue_claim()["attempts"] == 1
+        assert queue_db.ingest_queue_fail("/ingest/book.epub", "boom", max_attempts=2)
+
+        # Not due until the backoff has passed
+        assert queue_db.ingest_queue_claim() is None
+        queue_db.cur.execute("UPDATE cwa_ingest_queue SET next_attempt_at = '2000-01-01 00:00:00'")
+        queue_db.con.commit()
+        assert queue_db.ingest_queue_claim()["attempts"] == 2
+        assert not queue_db.ingest_queue_fail("/ingest/book.epub", "boom", max_attempts=2)
+
+        status = queue_db.ingest_queue_status()
+        assert status["failed"] == 1
+        assert status["last"]["error"] == "boom"
+
+    def test_interrupted_and_finished_paths_are_queued_again(self, queue_db):
+        """Verify rows left in processing are reset and a finished path dropped in again is requeued."""
+        queue_db.ingest_queue_add("/ingest/a.epub")
+        queue_db.ingest_queue_add("/ingest/b.epub")
+        queue_db.ingest_queue_claim()
+        queue_db.ingest_queue_claim()
+        queue_db.ingest_queue_complete("/ingest/b.epub")
+
+        assert queue_db.ingest_queue_reset_processing() == 1
+        assert queue_db.ingest_queue_status()["done_last_hour"] == 1
+        queue_db.ingest_queue_add("/ingest/b.epub")
+        assert queue_db.ingest_queue_size() == 2
+
+
+@pytest.mark.unit
+class TestCWADBIngestTimings:
+    """Test the per-stage ingest timings shown on the stats page."""
+
+    @pytest.fixture
+    def timings_db(self, temp_cwa_db):
+        temp_cwa_db.cur.execute("DELETE FROM cwa_ingest_timings")
+        temp_cwa_db.con.commit()
+        return temp_cwa_db
+
+    def test_percentiles_only_count_files_that_ran_the_stage(self, timings_db):
+        """Verify p50/p95 per stage and that skipped stages don't dilute them."""
+        for i in range(1, 21):
+            stages = {"calibredb": float(i)}
+            if i <= 4:
+                stages["convert"] = 10.0 * i
+            timings_db.ingest_timing_add(f"book{i}.epub", "epub", "epub", 1024, "imported", float(i), stages)
+
+        summary = timings_db.get_ingest_timing_summary()
+        assert summary["files"] == 20
+        assert summary["stages"]["calibredb"] == {"count": 20, "p50": 10.0, "p95": 19.0}
+        assert summary["stages"]["convert"] == {"count": 4, "p50": 20.0, "p95": 40.0}
+        assert summary["stages"]["total"]["count"] == 20
+
+    def test_throughput_only_counts_imported_books(self, timings_db):
+        """Verify books/hour ignores failed files and is zero without data."""
+        assert timings_db.get_ingest_timing_summary()["books_per_hour"] == 0.0
+        timings_db.ingest_timing_add("book.epub", "epub", "epub", 1024, "imported", 36.0, {})
+        timings_db.ingest_timing_add("broken.epub", "epub", "", 1024, "failed", 1.0, {})
+
+        summary = timings_db.get_ingest_timing_summary()
+        assert summary["imported"] == 1
+        assert summary["books_per_hour"] > 0
+
+
 @pytest.mark.unit
 class TestCWADBErrorHandling:
     """Test database error handling and edge cases."""
@@ -0,0 +1,97 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Unit Tests for metadata.db Change Detection
+
+These tests point the CalibreDB change monitor at a small sqlite file and write
+to it from a second connection, the way ingest's calibredb calls do, and check
+that only the session of the caller is expired.
+"""
+
+import sqlite3
+
+import pytest
+
+from cps import db
+
+
+class FakeSession:
+    def __init__(self, loaded=1):
+        self.expired = 0
+        self.info = {}
+        self.identity_map = [object()] * loaded
+
+    def expire_all(self):
+        self.expired += 1
+
+
+def calibre_db_with_session():
+    instance = db.CalibreDB()
+    instance.session = FakeSession()
+    return instance
+
+
+@pytest.fixture
+def metadata_db(tmp_path, monkeypatch):
+    path = tmp_path / "metadata.db"
+    with sqlite3.connect(path) as con:
+        con.execute("CREATE TABLE books (id INTEGER PRIMARY KEY, title TEXT)")
+        con.execute("CREATE TABLE custom_columns (id INTEGER PRIMARY KEY, datatype TEXT)")
+    monkeypatch.setattr(db.CalibreDB, "instances", set())
+    monkeypatch.setattr(db.CalibreDB, "change_count", 0)
+    db.CalibreDB.open_change_monitor(str(path))
+    yield path
+    with db.CalibreDB.change_lock:
+        db.CalibreDB.close_change_monitor()
+
+
+@pytest.mark.unit
+class TestInvalidateIfChanged:
+    """Test that writes by other connections only invalidate the session of the caller."""
+
+    def test_nothing_to_do_without_writes(self, metadata_db):
+        request = calibre_db_with_session()
+        request.session.info['change_count'] = db.CalibreDB.change_count
+        assert not request.invalidate_if_changed()
+        assert request.session.expired == 0
+
+    def test_external_write_expires_only_the_callers_session(self, metadata_db):
+        request = calibre_db_with_session()
+        task = calibre_db_with_session()
+        for instance in (request, task):
+            instance.session.info['change_count'] = db.CalibreDB.change_count
+        with sqlite3.connect(metadata_db) as con:
+            con.execute("INSERT INTO books (title) VALUES ('New Book')")
+
+        assert request.invalidate_if_changed()
+        assert request.session.expired == 1
+        # Handled once, not on every following request
+        assert not request.invalidate_if_changed()
+        # The session of a background task belongs to its thread, it's expired when that thread checks
+        assert task.session.expired == 0
+        assert task.invalidate_if_changed()
+        assert task.session.expired == 1
+
+    def test_new_session_has_nothing_to_expire(self, metadata_db):
+        request = calibre_db_with_session()
+        request.session = FakeSession(loaded=0)
+        with sqlite3.connect(metadata_db) as con:
+            con.execute("INSERT INTO books (title) VALUES ('New Book')")
+
+        assert not request.invalidate_if_changed()
+        assert request.session.expired == 0
+        assert request.session.info['change_count'] == db.CalibreDB.change_count
+
+    def test_custom_column_change_rebuilds_engine(self, metadata_db, monkeypatch):
+        rebuilt = []
+        monkeypatch.setattr(db.CalibreDB, "config", type("Config", (), {"config_calibre_dir": str(metadata_db.parent)}))
+        monkeypatch.setattr(db.CalibreDB, "setup_db", classmethod(lambda cls, *args: rebuilt.append(args)))
+        with sqlite3.connect(metadata_db) as con:
+            con.execute("INSERT INTO custom_columns (datatype) VALUES ('text')")
+
+        assert db.CalibreDB.check_for_changes()
+        assert len(rebuilt) == 1
@@ -0,0 +1,117 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Unit Tests for the Pooled Calibre Database Engine
+
+These tests set up CalibreDB on a copy of the empty library and check that
+threads get connections of their own, prepared by the connect hook, and that
+a request writing while a background task holds a write waits for it.
+"""
+
+import shutil
+import threading
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+from sqlalchemy import text
+
+from cps import db, ub
+
+EMPTY_LIBRARY = Path(__file__).parent.parent.parent / "empty_library"
+
+
+@pytest.fixture
+def calibre(tmp_path, monkeypatch):
+    shutil.copy(EMPTY_LIBRARY / "metadata.db", tmp_path / "metadata.db")
+    monkeypatch.setattr(ub, "session", None)
+    monkeypatch.setattr(ub, "app_DB_path", None)
+    ub.init_db(str(tmp_path / "app.db"))
+    for attr in ("engine", "session_factory", "app_db_path", "change_monitor", "data_version",
+                 "custom_columns_signature", "change_count", "_init"):
+        monkeypatch.setattr(db.CalibreDB, attr, getattr(db.CalibreDB, attr))
+    monkeypatch.setattr(db.CalibreDB, "instances", set())
+    monkeypatch.setattr(db.CalibreDB, "config", SimpleNamespace(config_title_regex=r"^(A|The|An)\s+",
+                                                                db_configured=False, invalidate=lambda *a: None))
+    db.CalibreDB.setup_db(str(tmp_path), str(tmp_path / "app.db"))
+    yield db.CalibreDB(scoped=True, init=True)
+    db.CalibreDB.dispose()
+    db.CalibreDB.engine.dispose()
+
+
+def in_thread(func):
+    result = []
+    thread = threading.Thread(target=lambda: result.append(func()))
+    thread.start()
+    thread.join(5)
+    return result[0]
+
+
+@pytest.mark.unit
+class TestPooledEngine:
+    """Test per-thread sessions and connections of the calibre database."""
+
+    def test_threads_get_connections_of_their_own(self, calibre):
+        def connection():
+            conn = calibre.session.connection().connection.driver_connection
+            # Prepared by the connect hook
+            assert conn.execute("SELECT title_sort('The Hobbit'), lower('ÄB')").fetchone() == ("Hobbit, The", "ab")
+            assert calibre.session.execute(text("SELECT count(*) FROM app_settings.user")).scalar() >= 0
+            return calibre.session(), conn
+
+        session, conn = connection()
+        other_session, other_conn = in_thread(connection)
+        assert session is not other_session
+        assert conn is not other_conn
+
+        calibre.remove_session()
+        assert calibre.session() is not session
+
+    def test_request_write_waits_for_task_write(self, calibre):
+        # A background task's session holds sqlite's write lock from its flush to its commit
+        task = db.CalibreDB(expire_on_commit=False, init=True)
+        task.session.add(db.Tags("first"))
+        task.session.flush()
+
+        def request():
+            calibre.session.add(db.Tags("second"))
+            calibre.session.commit()
+            calibre.remove_session()
+
+        thread = threading.Thread(target=request)
+        thread.start()
+        thread.join(0.5)
+        # Waits in sqlite's busy handler for the task's transaction
+        assert thread.is_alive()
+        task.session.commit()
+        thread.join(5)
+        assert not thread.is_alive()
+        assert {tag.name for tag in task.session.query(db.Tags)} == {"first", "second"}
+        task.session.close()
+
+    def test_bulk_write_waits_for_task_write(self, calibre):
+        calibre.session.add(db.Tags("first"))
+        calibre.session.commit()
+        task = db.CalibreDB(expire_on_commit=False, init=True)
+        task.session.add(db.Tags("second"))
+        task.session.flush()
+
+        def request():
+            # query.delete() doesn't flush anything, sqlite still serializes it
+            calibre.session.query(db.Tags).filter(db.Tags.name == "first").delete()
+            calibre.session.commit()
+            calibre.remove_session()
+
+        thread = threading.Thread(target=request)
+        thread.start()
+        thread.join(0.5)
+        assert thread.is_alive()
+        task.session.commit()
+        thread.join(5)
+        assert not thread.is_alive()
+        assert {tag.name for tag in task.session.query(db.Tags)} == {"second"}
+        task.session.close()
@@ -0,0 +1,72 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Unit Tests for the Kindle EPUB Fixer
+
+These tests run the fixer on small EPUBs that need no text fixes and check
+that it only rewrites the archive when its zip layout isn't the one readers
+expect (an uncompressed mimetype entry first).
+"""
+
+import sys
+import zipfile
+from pathlib import Path
+
+import pytest
+
+# Add scripts directory to path (works in both dev container and CI)
+scripts_dir = Path(__file__).parent.parent.parent / "scripts"
+sys.path.insert(0, str(scripts_dir))
+
+kindle_epub_fixer = pytest.importorskip("kindle_epub_fixer")
+
+OPF = ('<?xml version="1.0" encoding="utf-8"?>\n'
+       '<package xmlns="http://www.idpf.org/2007/opf" version="3.0">'
+       '<metadata xmlns:dc="http://purl.org/dc/elements/1.1/"><dc:language>en</dc:language></metadata>'
+       '</package>')
+
+
+def write_epub(path, mimetype_first=True, mimetype_compression=zipfile.ZIP_STORED):
+    with zipfile.ZipFile(path, 'w', zipfile.ZIP_DEFLATED) as zip_ref:
+        if not mimetype_first:
+            zip_ref.writestr('content.opf', OPF)
+        zip_ref.writestr('mimetype', 'application/epub+zip', compress_type=mimetype_compression)
+        if mimetype_first:
+            zip_ref.writestr('content.opf', OPF)
+    return path
+
+
+def first_entry(path):
+    with zipfile.ZipFile(path) as zip_ref:
+        return zip_ref.infolist()[0]
+
+
+@pytest.fixture
+def fixer(temp_cwa_db):
+    fixer = kindle_epub_fixer.EPUBFixer(db=temp_cwa_db)
+    fixer.cwa_settings['auto_backup_epub_fixes'] = False
+    return fixer
+
+
+@pytest.mark.unit
+class TestArchiveLayout:
+    """Test rewriting EPUBs whose zip layout isn't normalized."""
+
+    def test_normalized_epub_is_left_alone(self, tmp_path, fixer):
+        epub = write_epub(tmp_path / "book.epub")
+        before = epub.stat().st_mtime_ns
+        assert fixer.process(str(epub)) == []
+        assert epub.stat().st_mtime_ns == before
+
+    @pytest.mark.parametrize("mimetype_first, compression", [(False, zipfile.ZIP_STORED),
+                                                             (True, zipfile.ZIP_DEFLATED)])
+    def test_mimetype_is_moved_first_and_stored(self, tmp_path, fixer, mimetype_first, compression):
+        epub = write_epub(tmp_path / "book.epub", mimetype_first, compression)
+        assert fixer.process(str(epub)) == []
+        entry = first_entry(epub)
+        assert entry.filename == 'mimetype'
+        assert entry.compress_type == zipfile.ZIP_STORED
@@ -0,0 +1,194 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Unit Tests for File Readiness Detection
+
+These tests drive each readiness strategy with a fake /proc tree, a fake clock
+and a fake inotify instance, so no real devices or writers are needed.
+"""
+
+import os
+import sys
+from pathlib import Path
+
+import pytest
+
+# Add scripts directory to path (works in both dev container and CI)
+scripts_dir = Path(__file__).parent.parent.parent / "scripts"
+sys.path.insert(0, str(scripts_dir))
+
+import file_readiness
+from file_readiness import FileReadiness
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+    def sleep(self, seconds):
+        self.now += seconds
+
+
+class FakeProc:
+    """Builds /proc/<pid>/fd/<n> symlinks and matching fdinfo files."""
+
+    def __init__(self, root: Path):
+        self.root = root
+        (root / "self" / "fd").mkdir(parents=True)
+        (root / "self" / "fd" / "0").symlink_to("/dev/null")
+
+    def open(self, pid, fd, target, flags):
+        (self.root / str(pid) / "fd").mkdir(parents=True, exist_ok=True)
+        (self.root / str(pid) / "fdinfo").mkdir(parents=True, exist_ok=True)
+        (self.root / str(pid) / "fd" / str(fd)).symlink_to(target)
+        (self.root / str(pid) / "fdinfo" / str(fd)).write_text(f"pos:\t0\nflags:\t{flags}\nmnt_id:\t1\n")
+
+    def close(self, pid, fd):
+        (self.root / str(pid) / "fd" / str(fd)).unlink()
+        (self.root / str(pid) / "fdinfo" / str(fd)).unlink()
+
+
+class FakeInotify:
+    """Closes the writer's fd and reports IN_CLOSE_WRITE on the first wait."""
+
+    def __init__(self, on_wait=None):
+        self.on_wait = on_wait
+        self.closed = False
+        self.watched = []
+
+    def add_watch(self, path, mask):
+        self.watched.append((path, mask))
+        return 1
+
+    def read_events(self, timeout):
+        if self.on_wait:
+            self.on_wait()
+            self.on_wait = None
+            return [file_readiness.IN_CLOSE_WRITE]
+        return []
+
+    def close(self):
+        self.closed = True
+
+
+@pytest.fixture
+def book(tmp_path):
+    path = tmp_path / "ingest" / "book.epub"
+    path.parent.mkdir()
+    path.write_bytes(b"epub")
+    return path
+
+
+@pytest.fixture
+def proc(tmp_path):
+    return FakeProc(tmp_path / "proc")
+
+
+@pytest.mark.unit
+class TestProcScan:
+    """Test writer detection from /proc."""
+
+    def test_no_writers(self, proc, book):
+        assert not FileReadiness(proc_root=str(proc.root)).has_writers(str(book))
+
+    def test_write_only_and_read_write_count_as_writers(self, proc, book):
+        readiness = FileReadiness(proc_root=str(proc.root))
+        proc.open(100, 5, book, "0100001")  # O_WRONLY
+        assert readiness.has_writers(str(book))
+        proc.close(100, 5)
+        proc.open(100, 6, book, "02")  # O_RDWR
+        assert readiness.has_writers(str(book))
+
+    def test_readers_are_ignored(self, proc, book):
+        proc.open(100, 5, book, "0100000")  # O_RDONLY
+        assert not FileReadiness(proc_root=str(proc.root)).has_writers(str(book))
+
+
+@pytest.mark.unit
+class TestWaitUntilReady:
+    """Test each readiness strategy."""
+
+    def test_inotify_wakes_on_close_write(self, proc, book):
+        clock = FakeClock()
+        proc.open(100, 5, book, "01")
+
+        def writer_closes():
+            clock.now += 3
+            proc.close(100, 5)
+
+        inotify = FakeInotify(on_wait=writer_closes)
+        readiness = FileReadiness(proc_root=str(proc.root), inotify_factory=lambda: inotify,
+                                  clock=clock, sleep=clock.sleep, network_share=False)
+        result = readiness.wait_until_ready(str(book), timeout=60)
+
+        assert result.ready and result.method == "inotify"
+        assert result.waited == 3
+        assert inotify.closed
+
+    def test_falls_back_to_proc_polling_without_inotify(self, proc, book):
+        clock = FakeClock()
+        proc.open(100, 5, book, "01")
+
+        def sleep(seconds):
+            clock.sleep(seconds)
+            if clock.now >= 1:
+                proc.close(100, 5)
+
+        def no_inotify():
+            raise OSError(24, "Too many open files")
+
+        readiness = FileReadiness(proc_root=str(proc.root), inotify_factory=no_inotify,
+                                  clock=clock, sleep=sleep, poll_interval=0.25, network_share=False)
+        result = readiness.wait_until_ready(str(book), timeout=60)
+
+        assert result.ready and result.method == "proc"
+        assert result.waited == 1
+
+    def test_proc_times_out(self, proc, book):
+        clock = FakeClock()
+        proc.open(100, 5, book, "01")
+        readiness = FileReadiness(proc_root=str(proc.root), inotify_factory=None,
+                                  clock=clock, sleep=clock.sleep, network_share=False)
+        result = readiness.wait_until_ready(str(book), timeout=10)
+
+        assert not result.ready and result.reason == "timeout"
+        assert result.waited >= 10
+
+    def test_stabilisation_when_proc_unreadable(self, tmp_path, book):
+        clock = FakeClock()
+        sizes = iter([b"e", b"ep", b"epub"])
+
+        def sleep(seconds):
+            clock.sleep(seconds)
+            data = next(sizes, None)
+            if data is not None:
+                book.write_bytes(data)
+                os.utime(book, ns=(int(clock.now * 1e9), int(clock.now * 1e9)))
+
+        readiness = FileReadiness(proc_root=str(tmp_path / "missing"), clock=clock, sleep=sleep,
+                                  stable_interval=0.5, stable_checks=2, network_share=False)
+        result = readiness.wait_until_ready(str(book), timeout=60)
+
+        assert result.ready and result.method == "stable"
+        assert result.waited == 2.0
+
+    def test_network_share_uses_stabilisation(self, proc, book):
+        clock = FakeClock()
+        readiness = FileReadiness(proc_root=str(proc.root), clock=clock, sleep=clock.sleep,
+                                  stable_interval=0.5, stable_checks=2, network_share=True)
+        result = readiness.wait_until_ready(str(book), timeout=60)
+
+        assert result.ready and result.method == "stable"
+
+    def test_vanished_file(self, proc, tmp_path):
+        readiness = FileReadiness(proc_root=str(proc.root), inotify_factory=None, network_share=False)
+        result = readiness.wait_until_ready(str(tmp_path / "gone.epub"), timeout=60)
+
+        assert not result.ready and result.reason == "vanished"
@@ -0,0 +1,109 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Unit Tests for the Image Backends
+
+These tests write a test cover with Pillow and run it through every image
+backend that is installed: decoding at a reduced size, resizing, cropping,
+compositing and encoding WebP and JPEG, and converting uploaded covers to
+cover.jpg.
+"""
+
+import io
+
+import pytest
+
+from cps import imaging
+
+PIL = pytest.importorskip("PIL.Image")
+
+
+def cover_bytes(width=1200, height=1800, fmt="JPEG", mode="RGB"):
+    buffer = io.BytesIO()
+    PIL.new(mode, (width, height), "red").save(buffer, format=fmt)
+    return buffer.getvalue()
+
+
+@pytest.fixture(params=imaging.available_backends())
+def backend(request):
+    return imaging.get_backend(request.param)
+
+
+@pytest.mark.unit
+class TestImageBackends:
+    """Test the operations the thumbnail tasks and cover conversion use."""
+
+    def test_reduced_decode_stays_tall_enough(self, backend):
+        with backend.open(blob=cover_bytes(), height=255) as img:
+            assert 255 <= img.height < 1800
+            assert img.width * 3 == img.height * 2
+
+    def test_writes_webp_and_jpeg(self, backend, tmp_path):
+        with backend.open(blob=cover_bytes(fmt="PNG", mode="RGBA")) as img:
+            img.resize(170, 255)
+            for fmt in ("webp", "jpg"):
+                img.save(str(tmp_path / f"cover.{fmt}"), fmt, 82)
+        for fmt, pil_format in (("webp", "WEBP"), ("jpg", "JPEG")):
+            with PIL.open(tmp_path / f"cover.{fmt}") as written:
+                assert written.format == pil_format
+                assert written.size == (170, 255)
+
+    def test_composite_of_cropped_images(self, backend, tmp_path):
+        with backend.blank(340, 510) as canvas:
+            for left, top in ((0, 0), (170, 0), (0, 255), (170, 255)):
+                with backend.open(blob=cover_bytes(300, 300)) as img:
+                    img.crop_center(170, 255)
+                    assert (img.width, img.height) == (170, 255)
+                    canvas.composite(img, left, top)
+            canvas.save(str(tmp_path / "series.webp"), "webp", 80)
+        with PIL.open(tmp_path / "series.webp") as written:
+            assert written.size == (340, 510)
+            assert written.convert("RGB").getpixel((300, 400)) == pytest.approx((254, 0, 0), abs=2)
+
+    def test_broken_image_raises_image_error(self, backend):
+        with pytest.raises(imaging.ImageError):
+            backend.open(blob=b"not an image")
+
+    def test_unavailable_backend_falls_back(self, monkeypatch):
+        monkeypatch.setattr(imaging, "BACKENDS", [("vips", False, imaging.VipsBackend),
+                                                  ("pillow", True, imaging.PillowBackend)])
+        assert imaging.select_backend("vips").name == "pillow"
+        assert imaging.select_backend("auto").name == "pillow"
+
+
+class Upload:
+    """An uploaded cover file, like werkzeug's FileStorage"""
+
+    def __init__(self, data, content_type):
+        self.headers = {'content-type': content_type}
+        self.stream = io.BytesIO(data)
+
+
+@pytest.mark.unit
+class TestCoverUpload:
+    """Test converting uploaded covers to cover.jpg with the image backend."""
+
+    @pytest.fixture(autouse=True)
+    def library(self, tmp_path, monkeypatch, backend):
+        from cps import helper
+        monkeypatch.setattr(imaging, "backend", backend)
+        monkeypatch.setattr(helper.config, "config_use_google_drive", False, raising=False)
+        monkeypatch.setattr(helper.config, "get_book_path", lambda: str(tmp_path))
+        return tmp_path
+
+    def test_png_upload_is_saved_as_jpeg(self, library):
+        from cps import helper
+        assert helper.save_cover(Upload(cover_bytes(fmt="PNG", mode="RGBA"), 'image/png'), "Author/Book (1)") == (True, None)
+        with PIL.open(library / "Author/Book (1)/cover.jpg") as saved:
+            assert saved.format == "JPEG"
+            assert saved.size == (1200, 1800)
+
+    def test_broken_upload_is_rejected(self, library):
+        from cps import helper
+        result, __ = helper.save_cover(Upload(b"not an image", 'image/png'), "Author/Book (1)")
+        assert not result
+        assert not (library / "Author/Book (1)/cover.jpg").exists()
@@ -0,0 +1,107 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Unit Tests for Batch Ingest
+
+These tests verify that the book ids reported by a batched calibredb add are
+mapped back to the right source files, and that files the mapping couldn't
+tell apart are left out of the batch.
+"""
+
+import sqlite3
+import sys
+from pathlib import Path
+from types import SimpleNamespace
+
+import pytest
+
+# Add scripts directory to path (works in both dev container and CI)
+scripts_dir = Path(__file__).parent.parent.parent / "scripts"
+sys.path.insert(0, str(scripts_dir))
+
+ingest_processor = pytest.importorskip("ingest_processor")
+
+
+@pytest.fixture
+def calibre_db(tmp_path):
+    """Minimal metadata.db with just the data table the mapping reads."""
+    db_path = tmp_path / "metadata.db"
+    with sqlite3.connect(db_path) as con:
+        con.execute("CREATE TABLE data (id INTEGER PRIMARY KEY, book INTEGER, format TEXT, uncompressed_size INTEGER, name TEXT)")
+    return db_path
+
+
+def add_format(db_path, book_id, book_format, size):
+    with sqlite3.connect(db_path) as con:
+        con.execute("INSERT INTO data (book, format, uncompressed_size, name) VALUES (?, ?, ?, ?)",
+                    (book_id, book_format, size, f"book {book_id}"))
+
+
+@pytest.mark.unit
+class TestParseAddedBookIds:
+    """Test parsing of calibredb add output."""
+
+    def test_parses_added_ids_in_order(self):
+        output = "Some plugin noise\nAdded book ids: 12, 10, 11\n"
+        assert ingest_processor.parse_added_book_ids(output) == [12, 10, 11]
+
+    def test_includes_merged_ids(self):
+        output = "Added book ids: 5\nMerged book ids: 3, 4\n"
+        assert ingest_processor.parse_added_book_ids(output) == [5, 3, 4]
+
+    def test_no_ids(self):
+        assert ingest_processor.parse_added_book_ids("") == []
+
+
+@pytest.mark.unit
+class TestMatchBookIds:
+    """Test mapping of new book ids to staged files."""
+
+    def test_matches_by_format_and_size(self, calibre_db):
+        add_format(calibre_db, 1, "EPUB", 200)
+        add_format(calibre_db, 2, "EPUB", 100)
+        add_format(calibre_db, 3, "PDF", 100)
+        staged = {"/tmp/a/first.epub": 100, "/tmp/b/second.pdf": 100, "/tmp/c/third.epub": 200}
+
+        matched = ingest_processor.match_book_ids([1, 2, 3], staged, str(calibre_db))
+
+        assert matched == {"/tmp/a/first.epub": 2, "/tmp/b/second.pdf": 3, "/tmp/c/third.epub": 1}
+
+    def test_leftovers_are_not_guessed(self, calibre_db):
+        # Sizes recorded by Calibre differ from the staged files, the ids aren't paired up by position
+        add_format(calibre_db, 7, "EPUB", 1)
+        add_format(calibre_db, 8, "EPUB", 2)
+        staged = {"/tmp/a/first.epub": 100, "/tmp/b/second.epub": 200}
+
+        matched = ingest_processor.match_book_ids([7, 8], staged, str(calibre_db))
+
+        assert matched == {}
+
+    def test_skipped_files_stay_unmatched(self, calibre_db):
+        # Second file was a duplicate calibredb ignored, so only one id came back
+        add_format(calibre_db, 4, "EPUB", 999)
+        staged = {"/tmp/a/first.epub": 100, "/tmp/b/second.epub": 200}
+
+        matched = ingest_processor.match_book_ids([4], staged, str(calibre_db))
+
+        assert matched == {}
+
+    def test_files_sharing_format_and_size_are_added_one_at_a_time(self, tmp_path):
+        def prepared(name, size):
+            path = tmp_path / name
+            path.write_bytes(b"x" * size)
+            return SimpleNamespace(library_actions=[("add", str(path), True, "text")])
+
+        first = prepared("first.epub", 100)
+        second = prepared("second.epub", 100)
+        other_size = prepared("third.epub", 200)
+        other_format = prepared("fourth.pdf", 100)
+
+        batch, singles = ingest_processor.split_ambiguous_batch([first, second, other_size, other_format])
+
+        assert batch == [other_size, other_format]
+        assert singles == [first, second]
@@ -0,0 +1,228 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Unit Tests for Cover Thumbnail Generation
+
+These tests run write_cover_thumbnails() on a stand-in for a decoded image,
+so they check the order of the resizes and writes without an image backend.
+The checkpoint of the process pool run and the watermark of incremental runs
+are checked with a temporary app.db, and thumbnails missing on a cover request
+are queued on a fresh WorkerThread. Series thumbnails are checked to pick up
+the cached thumbnails of their books.
+"""
+
+from collections import deque
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+import os
+import threading
+
+import pytest
+
+from cps import constants, fs, helper, ub
+from cps.services.worker import CalibreTask, WorkerThread, LANE_CPU, LANE_IO, LANE_NETWORK
+from cps.tasks import thumbnail
+from cps.tasks.thumbnail import TaskGenerateCoverThumbnails, TaskGenerateSeriesThumbnails, write_cover_thumbnails
+
+
+class DecodedCover:
+    def __init__(self, width, height):
+        self.width = width
+        self.height = height
+        self.quality = None
+        self.saved = []
+
+    def resize(self, width, height):
+        self.width, self.height = width, height
+
+    def save(self, filename, fmt, quality):
+        self.quality = quality
+        self.saved.append((filename, fmt, self.height))
+
+
+@pytest.mark.unit
+class TestWriteCoverThumbnails:
+    """Test writing all thumbnails of a book from one decode."""
+
+    def test_downscales_from_large_to_small(self):
+        img = DecodedCover(1800, 2700)
+        targets = {resolution: [(fmt, f"r{resolution}.{fmt}") for fmt in ('webp', 'jpg')]
+                   for resolution in (constants.COVER_THUMBNAIL_SMALL, constants.COVER_THUMBNAIL_MEDIUM,
+                                      constants.COVER_THUMBNAIL_LARGE)}
+        write_cover_thumbnails(img, targets)
+
+        assert [height for __, __, height in img.saved] == [1020, 1020, 510, 510, 255, 255]
+        assert [(filename, fmt) for filename, fmt, __ in img.saved] == [
+            ("r4.webp", "webp"), ("r4.jpg", "jpg"), ("r2.webp", "webp"), ("r2.jpg", "jpg"),
+            ("r1.webp", "webp"), ("r1.jpg", "jpg")]
+        assert img.quality == 82
+
+    def test_small_cover_is_not_upscaled(self):
+        img = DecodedCover(200, 300)
+        write_cover_thumbnails(img, {constants.COVER_THUMBNAIL_LARGE: [('jpg', 'large.jpg')],
+                                     constants.COVER_THUMBNAIL_SMALL: [('jpg', 'small.jpg')]})
+        assert img.saved == [('large.jpg', 'jpg', 300), ('small.jpg', 'jpg', 255)]
+
+
+@pytest.fixture
+def app_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(ub, "session", None)
+    monkeypatch.setattr(ub, "app_DB_path", None)
+    ub.init_db(str(tmp_path / "app.db"))
+
+
+@pytest.mark.unit
+class TestProcessPoolCheckpoint:
+    """Test the checkpoint of a library-wide run whose books finish out of order."""
+
+    def test_checkpoint_stops_at_first_unfinished_book(self, app_db, monkeypatch):
+        task = TaskGenerateCoverThumbnails()
+        checkpoints = []
+        monkeypatch.setattr(task, "save_checkpoint", checkpoints.append)
+
+        handed_out = deque([1, 2, 3, 4])
+        finished = {1, 3}
+        task.commit_thumbnail_plans([], handed_out, finished)
+        assert checkpoints == [{"book_id": 1}]
+
+        finished.update({2, 4})
+        task.commit_thumbnail_plans([], handed_out, finished)
+        assert checkpoints[-1] == {"book_id": 4}
+        assert not handed_out and not finished
+
+
+@pytest.mark.unit
+class TestIncrementalScan:
+    """Test the last_modified watermark of library-wide cover thumbnail runs."""
+
+    def test_watermark_stays_at_failed_book(self, app_db):
+        task = TaskGenerateCoverThumbnails()
+        assert task.get_watermark() is None
+        task.scan_started = datetime(2025, 5, 2)
+        task.book_failed(SimpleNamespace(last_modified=datetime(2025, 5, 1, tzinfo=timezone.utc)))
+        task.save_watermark()
+        assert TaskGenerateCoverThumbnails().get_watermark() == datetime(2025, 5, 1)
+
+        task = TaskGenerateCoverThumbnails()
+        task.scan_started = datetime(2025, 5, 3)
+        task.save_watermark()
+        assert TaskGenerateCoverThumbnails().get_watermark() == datetime(2025, 5, 3)
+
+    def test_only_changed_books_unless_verifying(self, app_db, monkeypatch):
+        monkeypatch.setattr(TaskGenerateCoverThumbnails, "get_books_with_covers", staticmethod(lambda *args: "all"))
+        monkeypatch.setattr(TaskGenerateCoverThumbnails, "get_changed_books_with_covers",
+                            staticmethod(lambda watermark: "changed"))
+        monkeypatch.setattr(TaskGenerateCoverThumbnails, "get_last_modified", staticmethod(lambda: datetime(2025, 6, 1)))
+        assert TaskGenerateCoverThumbnails().get_books_to_scan() == "all"
+
+        task = TaskGenerateCoverThumbnails()
+        task.scan_started = datetime(2025, 5, 1)
+        task.save_watermark()
+        assert TaskGenerateCoverThumbnails().get_books_to_scan() == "changed"
+        assert TaskGenerateCoverThumbnails(verify=True).get_books_to_scan() == "all"
+
+        # A resumed run keeps the start of the run it continues
+        resumed = TaskGenerateCoverThumbnails()
+        resumed.checkpoint = {"book_id": 7, "scan_started": "2025-05-20T00:00:00"}
+        resumed.get_books_to_scan()
+        assert resumed.scan_started == datetime(2025, 5, 20)
+
+
+class HeldThumbnailTask(CalibreTask):
+    release = None
+
+    def __init__(self, book_id):
+        super().__init__("thumbnails")
+        self.book_id = book_id
+        self.finished = threading.Event()
+
+    def run(self, worker_thread):
+        self.release.wait(5)
+        self._handleSuccess()
+        self.finished.set()
+
+    @property
+    def name(self):
+        return "Held"
+
+    @property
+    def is_cancellable(self):
+        return True
+
+    @property
+    def lane(self):
+        return LANE_CPU
+
+    @property
+    def serial_key(self):
+        return "thumbnails"
+
+
+@pytest.mark.unit
+class TestOnDemandThumbnails:
+    """Test queueing missing thumbnails for cover requests."""
+
+    def test_one_pending_generation_per_book(self, monkeypatch):
+        monkeypatch.setattr(WorkerThread, "_instance", WorkerThread({LANE_CPU: 1, LANE_IO: 1, LANE_NETWORK: 1}))
+        monkeypatch.setattr(helper, "TaskGenerateCoverThumbnails", HeldThumbnailTask)
+        monkeypatch.setattr(helper, "_pending_cover_thumbnails", dict())
+        monkeypatch.setattr(helper, "MAX_PENDING_COVER_THUMBNAILS", 2)
+        monkeypatch.setattr(HeldThumbnailTask, "release", threading.Event())
+
+        for book_id in (1, 1, 2, 3):
+            helper.queue_missing_cover_thumbnails(book_id)
+        tasks = [item.task for item in WorkerThread.get_instance().tasks]
+        assert [task.book_id for task in tasks] == [1, 2]
+
+        HeldThumbnailTask.release.set()
+        assert all(task.finished.wait(5) for task in tasks)
+        helper.queue_missing_cover_thumbnails(3)
+        assert WorkerThread.get_instance().tasks[-1].task.book_id == 3
+
+
+@pytest.mark.unit
+class TestSeriesThumbnailSources:
+    """Test composing series thumbnails from the cached thumbnails of their books."""
+
+    def test_uses_smallest_up_to_date_book_thumbnail(self, app_db, tmp_path, monkeypatch):
+        monkeypatch.setattr(fs, "CONFIG_DIR", str(tmp_path))
+        task = TaskGenerateSeriesThumbnails()
+        for book_id, resolution, generated_at in ((1, constants.COVER_THUMBNAIL_SMALL, datetime(2025, 5, 2)),
+                                                  (1, constants.COVER_THUMBNAIL_MEDIUM, datetime(2025, 5, 2)),
+                                                  (2, constants.COVER_THUMBNAIL_MEDIUM, datetime(2025, 4, 1))):
+            thumb = TaskGenerateCoverThumbnails.new_book_cover_thumbnail(SimpleNamespace(id=book_id), resolution, 'webp')
+            thumb.generated_at = generated_at
+            task.app_db_session.add(thumb)
+            with open(task.cache.get_cache_file_path(thumb.filename, constants.CACHE_TYPE_THUMBNAILS), 'wb') as f:
+                f.write(b'image')
+        task.app_db_session.commit()
+
+        books = [SimpleNamespace(id=book_id, last_modified=datetime(2025, 5, 1, tzinfo=timezone.utc))
+                 for book_id in (1, 2, 3)]
+        paths = task.get_cover_thumbnail_paths(books, constants.COVER_THUMBNAIL_MEDIUM)
+        # Book 2's thumbnail predates the book and book 3 has none, both are composed from the original cover
+        assert list(paths) == [1]
+        assert paths[1].endswith(ub.thumbnail_filename(constants.THUMBNAIL_TYPE_COVER, 1,
+                                                       constants.COVER_THUMBNAIL_SMALL, 'webp'))
+
+    def test_source_changes_with_cover_only(self, app_db, tmp_path, monkeypatch):
+        monkeypatch.setattr(thumbnail.config, "get_book_path", lambda: str(tmp_path))
+        monkeypatch.setattr(thumbnail.config, "config_use_google_drive", False, raising=False)
+        (tmp_path / "book").mkdir()
+        cover = tmp_path / "book" / "cover.jpg"
+        cover.write_bytes(b"cover")
+        os.utime(cover, (1700000000, 1700000000))
+        book = SimpleNamespace(id=1, path="book", last_modified=datetime(2025, 5, 1, tzinfo=timezone.utc))
+        task = TaskGenerateSeriesThumbnails()
+        source = task.get_series_source([book])
+        assert source == "1:1700000000"
+
+        book.last_modified = datetime(2025, 6, 1, tzinfo=timezone.utc)
+        assert task.get_series_source([book]) == source
+        os.utime(cover, (1700000100, 1700000100))
+        assert task.get_series_source([book]) != source
@@ -0,0 +1,88 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Unit Tests for the Sharded Thumbnail Cache
+
+These tests use a temporary thumbnail cache to check where thumbnails are
+stored and that thumbnails of the flat layout are moved into their shards,
+both on access and by the background migration.
+"""
+
+import os
+
+import pytest
+
+from cps import constants, fs
+from cps.tasks import thumbnail_migration
+from cps.tasks.thumbnail_migration import TaskShardThumbnailCache
+
+
+@pytest.fixture
+def thumbnails_dir(tmp_path, monkeypatch):
+    monkeypatch.setattr(fs, "CONFIG_DIR", str(tmp_path))
+    path = tmp_path / "thumbnails"
+    path.mkdir()
+    return path
+
+
+@pytest.mark.unit
+class TestShardedThumbnailCache:
+    """Test the two level layout of the thumbnail cache."""
+
+    def test_thumbnails_are_sharded(self, thumbnails_dir):
+        path = fs.FileSystem().get_cache_file_path("book_1_r1.webp", constants.CACHE_TYPE_THUMBNAILS)
+        shard = fs.thumbnail_shard("book_1_r1.webp")
+        assert path == os.path.join(str(thumbnails_dir), shard[0], shard[1], "book_1_r1.webp")
+        assert len(shard[0]) == len(shard[1]) == 2
+
+    def test_flat_thumbnail_is_moved_on_access(self, thumbnails_dir):
+        (thumbnails_dir / "book_1_r1.jpg").write_bytes(b"image")
+        cache = fs.FileSystem()
+        assert cache.get_cache_file_exists("book_1_r1.jpg", constants.CACHE_TYPE_THUMBNAILS)
+        assert not (thumbnails_dir / "book_1_r1.jpg").exists()
+        assert os.path.isfile(cache.get_cache_file_path("book_1_r1.jpg", constants.CACHE_TYPE_THUMBNAILS))
+
+    def test_migration_moves_remaining_thumbnails(self, thumbnails_dir):
+        names = [f"book_{book_id}_r1.webp" for book_id in range(10)]
+        for name in names:
+            (thumbnails_dir / name).write_bytes(b"image")
+        assert thumbnail_migration.has_flat_thumbnails(str(thumbnails_dir))
+
+        TaskShardThumbnailCache().run(None)
+        assert not thumbnail_migration.has_flat_thumbnails(str(thumbnails_dir))
+        cache = fs.FileSystem()
+        assert all(cache.get_cache_file_exists(name, constants.CACHE_TYPE_THUMBNAILS) for name in names)
+        # Shards aren't mistaken for the subdirectories of the old uuid layout
+        assert not any(thumbnail_migration.is_legacy_subdir(str(entry)) for entry in thumbnails_dir.iterdir())
+
+
+@pytest.mark.unit
+class TestLegacyThumbnailCleanup:
+    """Test the one-time cleanup of the old uuid based layout."""
+
+    legacy_name = "3f2b6c1e-9a4d-4e2b-8c1f-0d5e7a9b1c2d.jpg"
+
+    def test_only_uuid_named_thumbnails_are_legacy(self, thumbnails_dir):
+        shard = thumbnails_dir / "3f"
+        shard.mkdir()
+        (shard / ".DS_Store").write_bytes(b"")
+        (shard / "book_1_r1.webp").write_bytes(b"image")
+        assert not thumbnail_migration.is_legacy_subdir(str(shard))
+
+        (shard / self.legacy_name).write_bytes(b"image")
+        assert thumbnail_migration.is_legacy_subdir(str(shard))
+
+    def test_completed_migration_is_not_repeated(self, thumbnails_dir):
+        legacy_dir = thumbnails_dir / "3f"
+        legacy_dir.mkdir()
+        (legacy_dir / self.legacy_name).write_bytes(b"image")
+        assert not thumbnail_migration.get_migration_status()
+
+        thumbnail_migration.set_migration_completed()
+        assert thumbnail_migration.get_migration_status()
+        thumbnail_migration.check_and_migrate_thumbnails()
+        assert (legacy_dir / self.legacy_name).exists()
@@ -0,0 +1,82 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Unit Tests for the Thumbnail Index
+
+These tests add thumbnail rows to a temporary app.db and files to a temporary
+thumbnail cache, and check that lookups are served from memory until the
+entry is invalidated.
+"""
+
+import pytest
+
+from cps import constants, fs, ub
+from cps.services import thumbnail_index
+
+
+@pytest.fixture
+def thumbnails(tmp_path, monkeypatch):
+    monkeypatch.setattr(ub, "session", None)
+    monkeypatch.setattr(ub, "app_DB_path", None)
+    monkeypatch.setattr(fs, "CONFIG_DIR", str(tmp_path))
+    ub.init_db(str(tmp_path / "app.db"))
+    thumbnail_index.invalidate()
+    (tmp_path / "thumbnails").mkdir()
+    session = ub.get_new_session_instance()
+
+    def add(book_id, resolution, fmt, with_file=True):
+        filename = ub.thumbnail_filename(constants.THUMBNAIL_TYPE_COVER, book_id, resolution, fmt)
+        session.add(ub.Thumbnail(type=constants.THUMBNAIL_TYPE_COVER, entity_id=book_id, format=fmt,
+                                 resolution=resolution, filename=filename))
+        session.commit()
+        if with_file:
+            (tmp_path / "thumbnails" / filename).write_bytes(b"image")
+        return filename
+
+    yield add
+    thumbnail_index.invalidate()
+
+
+def count_queries(monkeypatch):
+    loads = []
+    load = thumbnail_index._load
+
+    def counting_load(*args):
+        loads.append(args)
+        return load(*args)
+    monkeypatch.setattr(thumbnail_index, "_load", counting_load)
+    return loads
+
+
+@pytest.mark.unit
+class TestThumbnailIndex:
+    """Test looking up cover thumbnails without app.db."""
+
+    def test_lookup_is_served_from_memory(self, thumbnails, monkeypatch):
+        filename = thumbnails(1, constants.COVER_THUMBNAIL_SMALL, "webp")
+        thumbnails(1, constants.COVER_THUMBNAIL_SMALL, "jpg", with_file=False)
+        loads = count_queries(monkeypatch)
+
+        for __ in range(3):
+            thumbnail = thumbnail_index.lookup(constants.THUMBNAIL_TYPE_COVER, 1, constants.COVER_THUMBNAIL_SMALL, "webp")
+            assert thumbnail.filename == filename
+            assert thumbnail_index.lookup(constants.THUMBNAIL_TYPE_COVER, 1, constants.COVER_THUMBNAIL_SMALL, "jpg") is None
+        assert len(loads) == 1
+
+    def test_invalidate_picks_up_new_thumbnails(self, thumbnails):
+        assert thumbnail_index.lookup(constants.THUMBNAIL_TYPE_COVER, 2, constants.COVER_THUMBNAIL_SMALL, "jpg") is None
+        thumbnails(2, constants.COVER_THUMBNAIL_SMALL, "jpg")
+        assert thumbnail_index.lookup(constants.THUMBNAIL_TYPE_COVER, 2, constants.COVER_THUMBNAIL_SMALL, "jpg") is None
+
+        thumbnail_index.invalidate(constants.THUMBNAIL_TYPE_COVER, 2)
+        assert thumbnail_index.lookup(constants.THUMBNAIL_TYPE_COVER, 2, constants.COVER_THUMBNAIL_SMALL, "jpg")
+
+    def test_index_is_bounded(self, thumbnails, monkeypatch):
+        monkeypatch.setattr(thumbnail_index, "MAX_ENTITIES", 2)
+        for book_id in (1, 2, 3):
+            thumbnail_index.lookup(constants.THUMBNAIL_TYPE_COVER, book_id, constants.COVER_THUMBNAIL_SMALL)
+        assert list(thumbnail_index._index) == [(constants.THUMBNAIL_TYPE_COVER, 2), (constants.THUMBNAIL_TYPE_COVER, 3)]
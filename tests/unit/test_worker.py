@@ -0,0 +1,316 @@
+# Calibre-Web Automated – fork of Calibre-Web
+# Copyright (C) 2018-2025 Calibre-Web contributors
+# Copyright (C) 2024-2025 Calibre-Web Automated contributors
+# SPDX-License-Identifier: GPL-3.0-or-later
+# See CONTRIBUTORS for full list of authors.
+
+"""
+Unit Tests for the Background Task Worker
+
+These tests run small tasks through a fresh WorkerThread to check that tasks
+added with a delay wait without holding up the tasks queued after them, and
+that tasks in one lane don't hold up the other lanes and that duplicate work
+is coalesced, and that a database reconnect waits for the running tasks while
+holding back all lanes. The persistent queue tests use a temporary app.db.
+"""
+
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import pytest
+
+from cps import ub
+from cps.services import task_store
+from cps.services.worker import CalibreTask, WorkerThread, STAT_CANCELLED, STAT_FINISH_SUCCESS, STAT_STARTED, STAT_WAITING, \
+    LANE_CPU, LANE_IO, LANE_NETWORK
+from cps.tasks.database import TaskReconnectDatabase
+
+
+class RecordingTask(CalibreTask):
+    def __init__(self, message, ran, lane=LANE_IO, serial_key=None, release=None, coalesce_key=None):
+        super().__init__(message)
+        self.ran = ran
+        self._lane = lane
+        self._serial_key = serial_key
+        self._coalesce_key = coalesce_key
+        self.release = release
+        self.finished = threading.Event()
+
+    def run(self, worker_thread):
+        self.ran.append(self.message)
+        if self.release is not None:
+            self.release.wait(5)
+        self._handleSuccess()
+        self.finished.set()
+
+    @property
+    def lane(self):
+        return self._lane
+
+    @property
+    def serial_key(self):
+        return self._serial_key
+
+    @property
+    def coalesce_key(self):
+        return self._coalesce_key
+
+    @property
+    def name(self):
+        return "Recording"
+
+    @property
+    def is_cancellable(self):
+        return True
+
+
+class RecordingReconnectTask(TaskReconnectDatabase):
+    def __init__(self, ran, worker_thread):
+        super().__init__()
+        self.ran = ran
+        self.worker_thread = worker_thread
+        self.running_alongside = None
+        self.finished = threading.Event()
+
+    def run(self, worker_thread):
+        self.ran.append("reconnect")
+        self.running_alongside = self.worker_thread.running - 1
+        time.sleep(0.2)
+        self._handleSuccess()
+        self.finished.set()
+
+
+class StoredTask(CalibreTask):
+    def __init__(self, task_message):
+        super().__init__(task_message)
+        self.finished = threading.Event()
+
+    def serialize(self):
+        return {"task_message": self.message}
+
+    def run(self, worker_thread):
+        self._handleSuccess()
+        self.finished.set()
+
+    @property
+    def name(self):
+        return "Stored"
+
+    @property
+    def is_cancellable(self):
+        return True
+
+
+@pytest.fixture
+def app_db(tmp_path, monkeypatch):
+    monkeypatch.setattr(ub, "session", None)
+    monkeypatch.setattr(ub, "app_DB_path", None)
+    ub.init_db(str(tmp_path / "app.db"))
+    return ub.get_new_session_instance()
+
+
+def stored_state(session, task_id):
+    session.expire_all()
+    return session.query(ub.TaskQueue).filter(ub.TaskQueue.task_id == str(task_id)).one()
+
+
+def wait_until_started(task):
+    deadline = time.time() + 5
+    while task.stat != STAT_STARTED and time.time() < deadline:
+        time.sleep(0.05)
+
+
+@pytest.fixture
+def worker_thread(monkeypatch):
+    ins = WorkerThread({LANE_CPU: 2, LANE_IO: 1, LANE_NETWORK: 1})
+    monkeypatch.setattr(WorkerThread, "_instance", ins)
+    return ins
+
+
+@pytest.mark.unit
+class TestDelayedTasks:
+    """Test tasks added with not_before/delay."""
+
+    def test_delayed_task_does_not_block_later_tasks(self, worker_thread):
+        ran = []
+        delayed = RecordingTask("delayed", ran)
+        immediate = RecordingTask("immediate", ran)
+        WorkerThread.add(None, delayed, delay=2)
+        WorkerThread.add(None, immediate)
+
+        assert immediate.finished.wait(5)
+        assert ran == ["immediate"]
+        assert delayed.stat == STAT_WAITING
+        assert delayed in [item.task for item in worker_thread.tasks]
+
+        assert delayed.finished.wait(5)
+        assert ran == ["immediate", "delayed"]
+        assert delayed.stat == STAT_FINISH_SUCCESS
+
+    def test_cancelled_delayed_task_never_runs(self, worker_thread):
+        ran = []
+        delayed = RecordingTask("delayed", ran)
+        WorkerThread.add(None, delayed, delay=3600)
+        worker_thread.end_task(delayed.id)
+
+        deadline = time.time() + 5
+        while worker_thread.delayed and time.time() < deadline:
+            time.sleep(0.1)
+        assert not worker_thread.delayed
+        assert delayed.stat == STAT_CANCELLED
+        assert ran == []
+
+
+@pytest.mark.unit
+class TestWorkerLanes:
+    """Test running tasks in separate lanes."""
+
+    def test_busy_lane_does_not_block_other_lanes(self, worker_thread):
+        ran = []
+        release = threading.Event()
+        long_running = RecordingTask("thumbnails", ran, lane=LANE_CPU, release=release)
+        email = RecordingTask("email", ran, lane=LANE_IO)
+        WorkerThread.add(None, long_running)
+        wait_until_started(long_running)
+        WorkerThread.add(None, email)
+
+        assert email.finished.wait(5)
+        assert long_running.stat == STAT_STARTED
+        release.set()
+        assert long_running.finished.wait(5)
+        assert {item.task for item in worker_thread.tasks} >= {long_running, email}
+
+    def test_tasks_with_same_serial_key_run_in_order(self, worker_thread):
+        ran = []
+        release = threading.Event()
+        first = RecordingTask("clear", ran, lane=LANE_CPU, serial_key="thumbnails", release=release)
+        second = RecordingTask("generate", ran, lane=LANE_CPU, serial_key="thumbnails")
+        convert = RecordingTask("convert", ran, lane=LANE_CPU)
+        for task in (first, second, convert):
+            WorkerThread.add(None, task)
+
+        assert convert.finished.wait(5)
+        assert second.stat == STAT_WAITING
+        release.set()
+        assert second.finished.wait(5)
+        assert ran.index("clear") < ran.index("generate")
+
+    def test_reconnect_waits_for_running_tasks_and_holds_all_lanes(self, worker_thread):
+        ran = []
+        release = threading.Event()
+        thumbnails = RecordingTask("thumbnails", ran, lane=LANE_CPU, release=release)
+        WorkerThread.add(None, thumbnails)
+        wait_until_started(thumbnails)
+
+        reconnect = RecordingReconnectTask(ran, worker_thread)
+        backup = RecordingTask("backup", ran, lane=LANE_IO)
+        convert = RecordingTask("convert", ran, lane=LANE_CPU)
+        for task in (reconnect, backup, convert):
+            WorkerThread.add(None, task)
+
+        time.sleep(0.5)
+        assert reconnect.stat == STAT_WAITING
+        assert backup.stat == STAT_WAITING
+        assert convert.stat == STAT_WAITING
+        release.set()
+
+        assert backup.finished.wait(5)
+        assert convert.finished.wait(5)
+        assert reconnect.running_alongside == 0
+        assert ran.index("thumbnails") < ran.index("reconnect") < min(ran.index("backup"), ran.index("convert"))
+
+    def test_resize_lanes(self, worker_thread):
+        worker_thread.resize_lanes({LANE_IO: 3})
+        assert len(worker_thread.lanes[LANE_IO].threads) == 3
+
+        worker_thread.resize_lanes({LANE_IO: 1})
+        deadline = time.time() + 5
+        while len(worker_thread.lanes[LANE_IO].threads) > 1 and time.time() < deadline:
+            time.sleep(0.1)
+        assert len(worker_thread.lanes[LANE_IO].threads) == 1
+
+
+@pytest.mark.unit
+class TestCoalescing:
+    """Test merging duplicate thumbnail-like work while it waits behind a running task."""
+
+    @staticmethod
+    def thumbnail_task(message, ran, book_id=None, release=None):
+        return RecordingTask(message, ran, lane=LANE_CPU, serial_key="thumbnails", release=release,
+                             coalesce_key=("cover_thumbnails", book_id))
+
+    def test_duplicates_fold_into_library_wide_task(self, worker_thread):
+        ran = []
+        release = threading.Event()
+        WorkerThread.add(None, RecordingTask("running", ran, lane=LANE_CPU, serial_key="thumbnails", release=release))
+        book = self.thumbnail_task("book 1", ran, book_id=1)
+        assert WorkerThread.add(None, book) is book
+        assert WorkerThread.add(None, self.thumbnail_task("book 1 again", ran, book_id=1)) is book
+
+        library = self.thumbnail_task("library", ran)
+        assert WorkerThread.add(None, library) is library
+        assert book.stat == STAT_CANCELLED
+        assert WorkerThread.add(None, self.thumbnail_task("book 2", ran, book_id=2)) is library
+
+        release.set()
+        assert library.finished.wait(5)
+        assert ran == ["running", "library"]
+
+    def test_merging_keeps_order_of_serial_tasks(self, worker_thread):
+        ran = []
+        release = threading.Event()
+        WorkerThread.add(None, RecordingTask("running", ran, lane=LANE_CPU, serial_key="thumbnails", release=release))
+        WorkerThread.add(None, self.thumbnail_task("generate", ran, book_id=1))
+        WorkerThread.add(None, RecordingTask("clear", ran, lane=LANE_CPU, serial_key="thumbnails",
+                                             coalesce_key=("clear_cover_thumbnails", 1)))
+        # Can't merge into "generate", which would then run before "clear"
+        regenerate = self.thumbnail_task("generate again", ran, book_id=1)
+        assert WorkerThread.add(None, regenerate) is regenerate
+
+        release.set()
+        assert regenerate.finished.wait(5)
+        assert ran == ["running", "clear", "generate again"]
+
+
+@pytest.mark.unit
+class TestPersistentQueue:
+    """Test storing tasks in app.db and queueing them again after a restart."""
+
+    def test_unfinished_task_is_requeued_once(self, app_db, worker_thread):
+        task_id = uuid.uuid4()
+        # Left behind by the previous run
+        task_store.add(task_id, "{}.StoredTask".format(StoredTask.__module__), "key", "admin", False, False,
+                       {"task_message": "restored"}, datetime.now())
+        task_store.set_state(task_id, task_store.RUNNING)
+
+        assert WorkerThread.requeue_persisted_tasks() == 1
+        assert WorkerThread.requeue_persisted_tasks() == 0
+        restored = [item.task for item in worker_thread.tasks if item.task.id == task_id][0]
+        assert restored.finished.wait(5)
+        deadline = time.time() + 5
+        while stored_state(app_db, task_id).state != task_store.DONE and time.time() < deadline:
+            time.sleep(0.1)
+        assert stored_state(app_db, task_id).state == task_store.DONE
+        assert stored_state(app_db, task_id).payload is None
+
+    def test_scheduled_task_resumes_from_checkpoint(self, app_db, worker_thread, monkeypatch):
+        previous = StoredTask("scan")
+        previous.scheduled = True
+        WorkerThread.add(None, previous, delay=3600)
+        previous.save_checkpoint({"book_id": 42})
+        # Restart, which ends the previous run
+        monkeypatch.setattr(WorkerThread, "_instance", WorkerThread({LANE_IO: 1}))
+        task_store.end_interrupted_scheduled()
+
+        resumed = StoredTask("scan")
+        resumed.scheduled = True
+        WorkerThread.add(None, resumed, delay=3600)
+        assert resumed.checkpoint == {"book_id": 42}
+        assert stored_state(app_db, previous.id).state == task_store.ENDED
+
+        again = StoredTask("scan")
+        again.scheduled = True
+        WorkerThread.add(None, again, delay=3600)
+        assert again.checkpoint is None